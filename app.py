@@ -1,14 +1,19 @@
 import os
 import logging as log
-from typing import Tuple
+from base64 import b64encode
+from typing import Tuple, Optional
 from pathlib import Path
 from time import strftime
 from nanoServer.Server import Server
 from nanoServer.Monitor import Monitor
-from nanoServer.API import FRAME, SYS_INFO, CONFIGS, CONFIG, LOGIN_INFO
-from nanoServer.Streamer import Streamer
+from nanoServer.API import FRAME, BINARY_FRAME, SYS_INFO, CONFIGS, CONFIG, LOGIN_INFO, METRICS, PROFILE, PROFILE_FILE
+from nanoServer.Metrics import REGISTRY, MetricsWriter
+from nanoServer.Profiler import ProfilerManager
+from nanoServer.SessionRecorder import SessionRecorder
+from nanoServer.Streamer import Streamer, RESULT_FORMATS
 from nanoServer.PWMController import PWMController
 from nanoServer.Configer import Configer
+from nanoServer.Affinity import configure_tensorflow
 from nanoServer.ShellPrinter import ShellPrinter
 from nanoServer.utils.util import read_pwd
 
@@ -25,6 +30,8 @@ log.basicConfig(
 )
 
 pwd = read_pwd(configer.password_path)
+if configer.is_local_detector or configer.remote_fallback_config:
+    configure_tensorflow(configer.detector_threads, configer.tf_inter_op_threads)
 streamer = Streamer(
     max_fps=configer.max_fps,
     idle_interval=configer.idle_interval,
@@ -35,17 +42,36 @@ streamer = Streamer(
     remote_detector_ip=configer.remote_detector_ip,
     remote_detector_port=configer.remote_detector_port,
     remote_detector_timeout=configer.remote_detector_timeout,
+    remote_image_encoding=configer.remote_image_encoding,
+    remote_jpeg_quality=configer.remote_jpeg_quality,
+    remote_deadline=configer.remote_deadline,
+    remote_failure_threshold=configer.remote_failure_threshold,
+    remote_retry_interval=configer.remote_retry_interval,
+    remote_fallback_config=configer.remote_fallback_config,
+    cache_size=configer.cache_size,
+    cache_ttl=configer.cache_ttl,
+    cache_distance=configer.cache_distance,
+    is_track=configer.is_track,
+    track_iou_threshold=configer.track_iou_threshold,
+    detector_threads=configer.detector_threads,
+    detector_cpus=configer.detector_cpus,
+    camera_cpus=configer.camera_cpus,
     is_show_exc_info=configer.is_show_exc_info
 )
 
 monitor = Monitor()
+metrics_writer = MetricsWriter(configer.metrics_path, configer.metrics_interval) if configer.metrics_path else None
+profiler = ProfilerManager(log_dir)
 
 pwm_controller = PWMController(
     (configer.pwm_speed_port, configer.pwm_angle_port),
     configer.pwm_frequency,
     min_angle=configer.pwm_min_angle,
     max_angle=configer.pwm_max_angle,
-    is_listen=configer.is_pwm_listen
+    is_listen=configer.is_pwm_listen,
+    is_hardware_pwm=configer.is_hardware_pwm,
+    spin_time=configer.pwm_spin_time,
+    switch_interval=configer.pwm_switch_interval
 )
 
 s = Server(
@@ -57,9 +83,14 @@ s = Server(
     max_connection=configer.max_connection,
     is_show_exc_info=configer.is_show_exc_info
 )
+recorder = SessionRecorder(configer.record_path, configer.is_record_payload) if configer.record_path else None
+s.set_recorder(recorder)
+# threads started by these (the PWM engine, socket I/O, routines) inherit the cpu set
+pwm_controller.set_cpus(configer.pwm_cpus)
+s.set_cpus(configer.network_cpus)
 
 monitor.set_row_string(0, '%s:%s' % (s.ip, s.port))
-shell_printer = ShellPrinter(s, pwm_controller, streamer)
+shell_printer = ShellPrinter(s, pwm_controller, streamer, profiler)
 
 
 @s.login(pwd)
@@ -78,24 +109,38 @@ def client_enter(m: Monitor, address, *args, **kwargs):
     m.set_row_string(1, '%s:%s' % address)
 
 
-@s.routine(streamer)
-def stream(st: Streamer, *args, **kwargs):
-    stream_frame = st.get()
+# runs once per camera frame while streaming, an idle session does not poll the camera
+@s.routine(streamer, trigger=streamer.stream_trigger, pass_address=True)
+def stream(st: Streamer, address: Tuple = ('127.0.0.1', 0), *args, **kwargs):
+    stream_frame = st.get(is_wait=False)
     if not stream_frame.is_available():
         return
+    if st.get_result_format(address) == 'BINARY':
+        frame = BINARY_FRAME.copy()
+        frame['IMAGE'] = stream_frame.b64image
+        frame['RESULT'] = stream_frame.result.to_b64(stream_frame.class_version)
+        frame['CLASS_VERSION'] = stream_frame.class_version
+        # class names only go out when the table changed
+        if not st.is_class_table_sent(stream_frame.class_version, address):
+            frame['CLASS'] = st.class_table.classes
+        return frame
     frame = FRAME.copy()
     frame['IMAGE'] = stream_frame.b64image if stream_frame.b64image else ''
-    frame['BBOX'] = stream_frame.boxes
-    frame['CLASS'] = stream_frame.classes
+    frame['BBOX'] = stream_frame.result.box_list()
+    frame['CLASS'] = stream_frame.result.classes
     return frame
 
 
 @s.exit(streamer, monitor, pwm_controller, pass_address=True)
 def client_exit(st: Streamer, m: Monitor, pwm: PWMController, address: Tuple = ('127.0.0.1', 0), *args, **kwargs):
+    log.info('Client %s:%s disconnect' % address)
+    st.remove_session(address)
+    # the camera, the model and the motors are shared, only the last client leaving stops them
+    if s.session_count() > 1:
+        return
     st.reset()
     m.set_row_string(1, None)
     pwm.reset()
-    log.info('Client %s:%s disconnect' % address)
 
 
 @s.response('RESET')
@@ -171,6 +216,16 @@ def set_stream(message, st: Streamer, *args, **kwargs):
     st.set_stream(is_stream)
 
 
+@s.response('SET_RESULT_FORMAT', streamer, pass_address=True)
+def set_result_format(message, st: Streamer, address: Tuple = ('127.0.0.1', 0), *args, **kwargs):
+    result_format = message.get('FORMAT', 'JSON')
+    log.info(f'Set result format: {result_format}')
+    if result_format not in RESULT_FORMATS:
+        log.warning(f'Wrong result format {result_format}')
+        return
+    st.set_result_format(result_format, address)
+
+
 @s.response('SET_QUALITY', streamer)
 def set_quality(message, st: Streamer, *args, **kwargs):
     width = int(message.get('WIDTH', 0))
@@ -182,7 +237,70 @@ def set_quality(message, st: Streamer, *args, **kwargs):
     st.set_quality(width, height)
 
 
-@s.response('MOV', pwm_controller)
+@s.response('GET_METRICS')
+def get_metrics(message, *args, **kwargs):
+    metrics = METRICS.copy()
+    metrics['METRICS'] = REGISTRY.to_dict()
+    return metrics
+
+
+def profile_message(pm: ProfilerManager, error: Optional[str] = None) -> dict:
+    profile = PROFILE.copy()
+    profile['IS_RUNNING'] = pm.is_running()
+    profile['MODE'] = pm.get_mode()
+    profile['FILES'] = pm.get_files()
+    profile['ERROR'] = error
+    return profile
+
+
+@s.response('PROFILE_START', profiler, pwd)
+def profile_start(message, pm: ProfilerManager, password, *args, **kwargs):
+    if message.get('PWD', '') != password:
+        log.warning('Profile start with wrong password')
+        return profile_message(pm, 'Wrong password')
+    try:
+        pm.start(
+            message.get('MODE', 'SAMPLE'),
+            message.get('THREADS', []),
+            float(message.get('RATE', 100)),
+            float(message.get('DURATION', 0))
+        )
+    except (ValueError, RuntimeError) as E:
+        log.warning(f'Profile start fail: {E}')
+        return profile_message(pm, str(E))
+    return profile_message(pm)
+
+
+@s.response('PROFILE_STOP', profiler, pwd)
+def profile_stop(message, pm: ProfilerManager, password, *args, **kwargs):
+    if message.get('PWD', '') != password:
+        log.warning('Profile stop with wrong password')
+        return profile_message(pm, 'Wrong password')
+    pm.stop()
+    return profile_message(pm)
+
+
+@s.response('GET_PROFILE', profiler, pwd)
+def get_profile(message, pm: ProfilerManager, password, *args, **kwargs):
+    if message.get('PWD', '') != password:
+        log.warning('Get profile with wrong password')
+        return profile_message(pm, 'Wrong password')
+    name = message.get('NAME', '')
+    if not name:
+        return profile_message(pm)
+    try:
+        data = pm.read(name)
+    except (KeyError, OSError) as E:
+        log.warning(f'Get profile fail: {E}')
+        return profile_message(pm, str(E))
+    profile_file = PROFILE_FILE.copy()
+    profile_file['NAME'] = name
+    profile_file['DATA'] = b64encode(data).decode()
+    return profile_file
+
+
+# joystick floods, only the newest MOV is applied and it never waits behind other commands
+@s.last_value_response('MOV', pwm_controller)
 def mov(message, pwm, *args, **kwargs):
     r = message.get('R', 0)
     theta = message.get('THETA', 90)
@@ -194,6 +312,8 @@ if __name__ == '__main__':
     streamer.start()
     pwm_controller.start()
     shell_printer.start()
+    if metrics_writer is not None:
+        metrics_writer.start()
     try:
         s.run()
     except KeyboardInterrupt:
@@ -203,6 +323,12 @@ if __name__ == '__main__':
         streamer.close()
         pwm_controller.close()
         shell_printer.close()
+        profiler.close()
+        if recorder is not None:
+            recorder.close()
+        if metrics_writer is not None:
+            metrics_writer.close()
+            metrics_writer.join()
         monitor.join()
         streamer.join()
         pwm_controller.join()
@@ -0,0 +1,123 @@
+import sys
+
+sys.path.append('.')
+import json
+import logging as log
+from argparse import ArgumentParser
+from socket import socket, AF_INET, SOCK_STREAM
+from threading import Lock
+from time import perf_counter, sleep, strftime
+from nanoServer.Server import Server
+from nanoServer.socketIO import send
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def run_mode(is_last_value: bool, seconds: float, mov_rate: float, slow_every: int, slow_time: float) -> dict:
+    """
+    a joystick sends MOV at mov_rate, every slow_every-th message is a command
+    that keeps the main handler busy for slow_time
+    """
+    s = Server('127.0.0.1', 0, max_connection=1, server_timeout=10, client_timeout=10)
+    lock = Lock()
+    latencies = []
+    applied = []
+
+    def mov(message, *args, **kwargs):
+        # perf_counter is shared by both ends in one process
+        with lock:
+            latencies.append(perf_counter() - message['T'])
+            applied.append(message['SEQ'])
+
+    def slow(message, *args, **kwargs):
+        sleep(slow_time)
+
+    if is_last_value:
+        s.last_value_response('MOV')(mov)
+    else:
+        s.response('MOV')(mov)
+    s.response('SLOW')(slow)
+    s.start()
+
+    sock = socket(AF_INET, SOCK_STREAM)
+    # the server listens after its thread starts
+    for _ in range(50):
+        try:
+            sock.connect((s.ip, s.port))
+            break
+        except ConnectionRefusedError:
+            sleep(0.02)
+    sent = 0
+    interval = 1 / mov_rate
+    start = perf_counter()
+    next_time = start
+    while perf_counter() - start < seconds:
+        sent += 1
+        if sent % slow_every == 0:
+            send(sock, json.dumps({'CMD': 'SLOW'}))
+        send(sock, json.dumps({'CMD': 'MOV', 'R': 0.5, 'THETA': 90, 'SEQ': sent, 'T': perf_counter()}))
+        next_time += interval
+        sleep(max(next_time - perf_counter(), 0))
+    # the plain queue may still be draining
+    sleep(min(slow_time * sent / slow_every, 5.))
+    sock.close()
+    s.close()
+    s.join(5)
+
+    with lock:
+        values = [latency * 1000 for latency in latencies]
+        last_seq = applied[-1] if applied else 0
+    return {
+        'mode': 'last-value' if is_last_value else 'queue',
+        'sent': sent,
+        'applied': len(values),
+        'coalesced': sent - len(values),
+        'newest_applied': last_seq == sent,
+        'latency_ms': {
+            'p50': percentile(values, 50) if values else None,
+            'p99': percentile(values, 99) if values else None,
+            'max': max(values) if values else None,
+        },
+    }
+
+
+def parse_args():
+    parser = ArgumentParser(description='MOV actuation latency while the main handler is busy')
+    parser.add_argument('--seconds', type=float, default=5.)
+    parser.add_argument('--mov-rate', type=float, default=100., help='MOV messages per second')
+    parser.add_argument('--slow-every', type=int, default=20, help='a slow command every N messages')
+    parser.add_argument('--slow-time', type=float, default=0.1, help='seconds a slow command takes')
+    parser.add_argument('--output', default=None, help='JSON result file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # python3 benchmarks/ControlLaneBenchmark.py --mov-rate 100 --slow-every 20 --slow-time 0.1
+    args = parse_args()
+    log.basicConfig(level=log.ERROR)
+    records = []
+    print('%-11s %6s %8s %10s %9s %9s %9s' % ('mode', 'sent', 'applied', 'coalesced', 'p50(ms)', 'p99(ms)', 'max(ms)'))
+    for is_last_value in (False, True):
+        record = run_mode(is_last_value, args.seconds, args.mov_rate, args.slow_every, args.slow_time)
+        records.append(record)
+        latency = record['latency_ms']
+        print('%-11s %6d %8d %10d %9.2f %9.2f %9.2f' % (
+            record['mode'],
+            record['sent'],
+            record['applied'],
+            record['coalesced'],
+            latency['p50'] or 0,
+            latency['p99'] or 0,
+            latency['max'] or 0
+        ))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': strftime('%Y-%m-%d %H:%M:%S'),
+                'args': vars(args),
+                'records': records,
+            }, f, indent=2)
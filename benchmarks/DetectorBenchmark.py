@@ -0,0 +1,327 @@
+import sys
+
+sys.path.append('.')
+import json
+import platform
+import subprocess
+import numpy as np
+from argparse import ArgumentParser, SUPPRESS
+from pathlib import Path
+from time import perf_counter, strftime
+from typing import Dict, List
+
+# the models of the README table, built with random weights when no config is given.
+# Random weights score most anchors near 0.5, so filter / nms times of these
+# models are an upper bound, use a real config and recorded images for those stages
+SYNTHETIC_MODELS = {
+    'v4-320': ('yolov4', 320, False),
+    'v4-416': ('yolov4', 416, False),
+    'v4-tiny-416': ('yolov4', 416, True),
+}
+STAGES = ('preprocess', 'forward', 'filter', 'nms', 'postprocess')
+
+
+def synthetic_config(name: str, num_class=80) -> dict:
+    model_type, size, tiny = SYNTHETIC_MODELS[name]
+    return {
+        'name': name,
+        'model_path': '',
+        'weight_path': '',
+        'frame_work': 'tf',
+        'model_type': model_type,
+        'size': size,
+        'tiny': tiny,
+        'max_output_size_per_class': 50,
+        'max_total_size': 50,
+        'iou_threshold': 0.5,
+        'score_threshold': 0.25,
+        'logdir': '',
+        'model_cache': False,
+        'YOLO': {
+            'CLASSES': [f'class_{i}' for i in range(num_class)],
+            'ANCHORS': [12, 16, 19, 36, 40, 28, 36, 75, 76, 55, 72, 146, 142, 110, 192, 243, 459, 401],
+            'ANCHORS_TINY': [23, 27, 37, 58, 81, 82, 81, 82, 135, 169, 344, 319],
+            'STRIDES': [8, 16, 32],
+            'STRIDES_TINY': [16, 32],
+            'XYSCALE': [1.2, 1.1, 1.05],
+            'XYSCALE_TINY': [1.05, 1.05],
+            'ANCHOR_PER_SCALE': 3,
+            'IOU_LOSS_THRESH': 0.5,
+        },
+        'TRAIN': {
+            'ANNOT_PATH': '',
+            'BATCH_SIZE': 1,
+            'LR_INIT': 1e-3,
+            'LR_END': 1e-6,
+            'WARMUP_EPOCHS': 0,
+            'INIT_EPOCH': 0,
+            'FIRST_STAGE_EPOCHS': 0,
+            'SECOND_STAGE_EPOCHS': 0,
+            'PRETRAIN': None,
+        },
+        'TEST': {
+            'ANNOT_PATH': '',
+            'BATCH_SIZE': 1,
+        },
+    }
+
+
+def load_images(image_dir=None, video=None, num_images=16, width=1280, height=720) -> List[np.ndarray]:
+    import cv2
+    if image_dir is not None:
+        from nanoServer.Detector.core.converter import list_images
+        images = [cv2.imread(str(p)) for p in list_images(image_dir)[:num_images]]
+        return [image for image in images if image is not None]
+    if video is not None:
+        cap = cv2.VideoCapture(video)
+        images = []
+        while len(images) < num_images:
+            ret, image = cap.read()
+            if not ret:
+                break
+            images.append(image)
+        cap.release()
+        return images
+    # upscaled noise, the resize cost of normalization is the same as for a camera frame
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(num_images):
+        small = rng.integers(0, 256, size=(height // 40, width // 40, 3), dtype=np.uint8)
+        images.append(cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR))
+    return images
+
+
+def build_detector(job: dict):
+    from nanoServer.Detector.Detector import Detector
+    from nanoServer.Detector.core.configer import YOLOConfiger
+
+    if job['config'] in SYNTHETIC_MODELS:
+        from nanoServer.Detector.KerasBackend import KerasBackend
+        from nanoServer.Detector.core.models import build_model
+
+        class RandomWeightsBackend(KerasBackend):
+            def load(self):
+                model = build_model(self.configer, training=False, is_filter=False, is_load_weights=False)
+                self.model = lambda batch: model(batch, training=False)
+
+        configer = YOLOConfiger(synthetic_config(job['config']))
+        configer.num_threads = job['threads']
+        return Detector(configer, backend=RandomWeightsBackend(configer)), configer
+    configer = YOLOConfiger(job['config'])
+    configer.num_threads = job['threads']
+    return Detector(configer), configer
+
+
+def timed_detect_batch(detector, images: List[np.ndarray], times: Dict[str, List[float]]):
+    """
+    Detector.detect_batch split into stages
+    """
+    from nanoServer.Detector.DetectResult import DetectResult
+    from nanoServer.Detector.core.postprocess import filter_boxes, suppress
+
+    s = perf_counter()
+    batch = np.concatenate([detector.normalization(image) for image in images])
+    times['preprocess'].append(perf_counter() - s)
+
+    s = perf_counter()
+    pred_xywh, pred_prob = detector.backend.infer(batch)
+    times['forward'].append(perf_counter() - s)
+
+    filter_time = nms_time = post_time = 0.
+    for image, xywh, prob in zip(images, pred_xywh, pred_prob):
+        s = perf_counter()
+        boxes, scores, class_ids = filter_boxes(xywh, prob, detector.score_threshold)
+        filter_time += perf_counter() - s
+
+        s = perf_counter()
+        keep, scores = suppress(
+            boxes,
+            scores,
+            class_ids,
+            detector.iou_threshold,
+            detector.max_output_size_per_class,
+            detector.max_total_size,
+            detector.nms_method,
+            detector.score_threshold
+        )
+        nms_time += perf_counter() - s
+
+        s = perf_counter()
+        height, width = image.shape[:2]
+        size = detector.size
+        scale = np.array((width / size, height / size) * 2, dtype=np.float32)
+        result = np.empty((len(keep), 5), dtype=np.int64)
+        result[:, :4] = boxes[keep] * scale
+        result[:, 4] = class_ids[keep]
+        DetectResult(boxes=result, scores=scores, classes=detector.classes)
+        post_time += perf_counter() - s
+    times['filter'].append(filter_time)
+    times['nms'].append(nms_time)
+    times['postprocess'].append(post_time)
+
+
+def percentiles(values: List[float]) -> dict:
+    values = np.array(values) * 1000
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+    }
+
+
+def run_job(job: dict) -> List[dict]:
+    """
+    one model and one thread count, runs in its own process because
+    Tensorflow thread pools are fixed once created
+    """
+    from nanoServer.Affinity import configure_tensorflow
+    configure_tensorflow(job['threads'], job['inter_op_threads'])
+    images = load_images(job['images'], job['video'], job['num_images'])
+    detector, configer = build_detector(job)
+
+    records = []
+    for batch_size in job['batch_sizes']:
+        batches = [
+            [images[(i * batch_size + j) % len(images)] for j in range(batch_size)]
+            for i in range(job['iterations'])
+        ]
+        warm_up = {stage: [] for stage in STAGES}
+        for batch in batches[:job['warmup']]:
+            timed_detect_batch(detector, batch, warm_up)
+
+        times = {stage: [] for stage in STAGES}
+        latencies = []
+        for batch in batches:
+            s = perf_counter()
+            timed_detect_batch(detector, batch, times)
+            latencies.append(perf_counter() - s)
+        records.append({
+            'model': configer.name,
+            'frame_work': configer.frame_work,
+            'size': configer.size,
+            'weights': 'random' if job['config'] in SYNTHETIC_MODELS else 'real',
+            'images': 'synthetic' if job['images'] is None and job['video'] is None else 'recorded',
+            'threads': job['threads'],
+            'batch_size': batch_size,
+            'iterations': job['iterations'],
+            'latency_ms': percentiles(latencies),
+            'throughput_fps': batch_size * len(latencies) / sum(latencies),
+            'stages_ms': {stage: percentiles(times[stage]) for stage in STAGES},
+        })
+    detector.release()
+    return records
+
+
+def record_key(record: dict) -> tuple:
+    return record['model'], record['frame_work'], record['threads'], record['batch_size']
+
+
+def compare(records: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    :return: descriptions of records whose p50 latency is slower than the baseline by more than tolerance
+    """
+    with open(baseline_path) as f:
+        baseline = {record_key(record): record for record in json.load(f)['records']}
+    regressions = []
+    for record in records:
+        base = baseline.get(record_key(record))
+        if base is None:
+            continue
+        p50 = record['latency_ms']['p50']
+        base_p50 = base['latency_ms']['p50']
+        if p50 > base_p50 * (1 + tolerance):
+            regressions.append('%s %s threads=%d batch=%d: p50 %.2fms -> %.2fms' % (
+                *record_key(record), base_p50, p50
+            ))
+    return regressions
+
+
+def parse_args():
+    parser = ArgumentParser(description='Detector latency / throughput benchmark')
+    parser.add_argument(
+        'configs',
+        nargs='*',
+        default=list(SYNTHETIC_MODELS),
+        help=f'YOLO config files, or {", ".join(SYNTHETIC_MODELS)} for random weights'
+    )
+    parser.add_argument('--images', default=None, help='image folder, synthetic frames if not set')
+    parser.add_argument('--video', default=None, help='recorded clip, synthetic frames if not set')
+    parser.add_argument('--num-images', type=int, default=16)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1])
+    parser.add_argument('--threads', type=int, nargs='+', default=[0], help='0 keeps the library default')
+    parser.add_argument('--inter-op-threads', type=int, default=0, help='0 keeps the library default')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--output', default=None, help='JSON result file')
+    parser.add_argument('--baseline', default=None, help='JSON result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed p50 slowdown against the baseline')
+    parser.add_argument('--job', default=None, help=SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # python3 benchmarks/DetectorBenchmark.py --batch-sizes 1 2 4 --threads 1 2 4 --output benchmarks/result.json
+    # python3 benchmarks/DetectorBenchmark.py configs/yolov4-416.json --images images/ --baseline benchmarks/result.json
+    args = parse_args()
+    if args.job is not None:
+        print(json.dumps(run_job(json.loads(args.job))))
+        exit(0)
+
+    records = []
+    for config in args.configs:
+        for threads in args.threads:
+            job = {
+                'config': config,
+                'threads': threads,
+                'inter_op_threads': args.inter_op_threads,
+                'batch_sizes': args.batch_sizes,
+                'iterations': args.iterations,
+                'warmup': args.warmup,
+                'images': args.images,
+                'video': args.video,
+                'num_images': args.num_images,
+            }
+            output = subprocess.run(
+                [sys.executable, __file__, '--job', json.dumps(job)],
+                capture_output=True,
+                text=True,
+                check=True
+            ).stdout
+            records.extend(json.loads(output.strip().splitlines()[-1]))
+
+    print('%-16s %-8s %7s %5s %9s %9s %9s %8s | %s' % (
+        'model', 'frame', 'threads', 'batch', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'FPS',
+        ' '.join('%11s' % stage for stage in STAGES)
+    ))
+    for record in records:
+        latency = record['latency_ms']
+        print('%-16s %-8s %7d %5d %9.2f %9.2f %9.2f %8.2f | %s' % (
+            record['model'],
+            record['frame_work'],
+            record['threads'],
+            record['batch_size'],
+            latency['p50'],
+            latency['p95'],
+            latency['p99'],
+            record['throughput_fps'],
+            ' '.join('%11.2f' % record['stages_ms'][stage]['p50'] for stage in STAGES)
+        ))
+
+    result = {
+        'time': strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'records': records,
+    }
+    if args.output is not None:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline is not None:
+        regressions = compare(records, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            exit(1)
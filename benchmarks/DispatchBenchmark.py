@@ -0,0 +1,136 @@
+import sys
+
+sys.path.append('.')
+import json
+import logging as log
+from argparse import ArgumentParser
+from socket import socket, AF_INET, SOCK_STREAM
+from time import perf_counter, strftime
+from nanoServer.API import MAIN_KEY, MOV
+from nanoServer.ClientHandler import ClientHandler, EventHandler
+
+
+class FakePWM:
+    def __init__(self):
+        self.count = 0
+
+    def set(self, r, theta):
+        self.count += 1
+
+
+def mov(message, pwm, *args, **kwargs):
+    # the MOV response of app.py
+    r = message.get('R', 0)
+    theta = message.get('THETA', 90)
+    pwm.set(r, theta)
+
+
+def count_middleware(counter: dict):
+    def middleware(message, next_handler):
+        counter['messages'] += 1
+        return next_handler(message)
+
+    return middleware
+
+
+def legacy_execute_response(handler: ClientHandler, message):
+    """
+    ClientHandler.execute_response before the compiled router
+    """
+    handler.last_cmd = message
+    if type(message) is str:
+        message = json.loads(message)
+    if type(message) is not dict:
+        raise TypeError('Get unexpected JSON message')
+    sub_key = message.get(MAIN_KEY, None)
+    if sub_key is None:
+        raise KeyError('Message dint define main key')
+    response_func_maps = handler.event_handler.get_response_func_maps()
+    func_map = response_func_maps.get(sub_key, None)
+    if func_map is None:
+        raise KeyError('Main key not found')
+    func, args, kwargs = func_map.get_func_arg_kwargs()
+    if kwargs.get('pass_address'):
+        kwargs.update({'address': handler.sock.getpeername()})
+    args = (message, *args)
+    return func(*args, **kwargs)
+
+
+def loopback_pair():
+    server = socket(AF_INET, SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    client = socket(AF_INET, SOCK_STREAM)
+    client.connect(server.getsockname())
+    accepted, _ = server.accept()
+    server.close()
+    return client, accepted
+
+
+def build_handler(sock: socket, pwm: FakePWM, pass_address: bool, middlewares: int):
+    event_handler = EventHandler()
+    kwargs = {'pass_address': True} if pass_address else {}
+    event_handler.add_response('MOV', mov, (pwm,), kwargs)
+    counter = {'messages': 0}
+    for _ in range(middlewares):
+        event_handler.add_middleware(count_middleware(counter))
+    event_handler.compile()
+    return ClientHandler(sock, event_handler)
+
+
+def run(dispatch, messages) -> float:
+    s = perf_counter()
+    for message in messages:
+        dispatch(message)
+    return len(messages) / (perf_counter() - s)
+
+
+def parse_args():
+    parser = ArgumentParser(description='Messages per second of MOV floods through ClientHandler dispatch')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None, help='JSON result file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # python3 benchmarks/DispatchBenchmark.py --messages 200000 --output benchmarks/dispatch.json
+    args = parse_args()
+    log.basicConfig(level=log.ERROR)
+    message = MOV.copy()
+    message['R'] = 0.5
+    message['THETA'] = 90
+    # as they come out of the socket, JSON text
+    messages = [json.dumps(message)] * args.messages
+
+    client_sock, server_sock = loopback_pair()
+    records = []
+    print('%-10s %-12s %11s %14s' % ('dispatch', 'pass_address', 'middlewares', 'messages/s'))
+    for pass_address in (False, True):
+        for name, middlewares in (('legacy', 0), ('router', 0), ('router', 2)):
+            pwm = FakePWM()
+            handler = build_handler(server_sock, pwm, pass_address, middlewares)
+            if name == 'legacy':
+                dispatch = lambda m: legacy_execute_response(handler, m)
+            else:
+                dispatch = handler.execute_response
+            # best of repeat, the others are mostly scheduler noise
+            rate = max(run(dispatch, messages) for _ in range(args.repeat))
+            records.append({
+                'dispatch': name,
+                'pass_address': pass_address,
+                'middlewares': middlewares,
+                'messages_per_second': rate,
+            })
+            print('%-10s %-12s %11d %14.0f' % (name, pass_address, middlewares, rate))
+    client_sock.close()
+    server_sock.close()
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': strftime('%Y-%m-%d %H:%M:%S'),
+                'python': sys.version.split()[0],
+                'messages': args.messages,
+                'records': records,
+            }, f, indent=2)
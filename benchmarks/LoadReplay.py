@@ -0,0 +1,307 @@
+import sys
+
+sys.path.append('.')
+import os
+import json
+import logging as log
+from argparse import ArgumentParser
+from collections import deque
+from socket import socket, AF_INET, SOCK_STREAM
+from threading import Thread, Lock
+from time import perf_counter, sleep, strftime
+from typing import List, Tuple, Optional, Dict
+from nanoServer.SessionRecorder import load_recording
+from nanoServer.socketIO import send, send_binary, recv_message
+
+# (seconds since the session start, message, binary payload)
+Record = Tuple[float, dict, Optional[bytes]]
+
+# request -> response command, requests without one get no latency
+RESPONSES = {
+    'LOGIN': 'LOG_INFO',
+    'GET_SYS_INFO': 'SYS_INFO',
+    'GET_CONFIGS': 'CONFIGS',
+    'GET_CONFIG': 'CONFIG',
+    'GET_METRICS': 'METRICS',
+    'DETECT': 'RESULT',
+}
+# never replayed, they stop the server or the profiler of someone else
+SKIP_COMMANDS = ('EXIT', 'SHUTDOWN', 'PROFILE_START', 'PROFILE_STOP', 'GET_PROFILE')
+
+
+def percentile(values: list, q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def stream_scenario(duration: float, mov_rate: float, is_infer: bool) -> List[Record]:
+    """
+    a phone of app.py: stream on, joystick at mov_rate, system info every second
+    """
+    records = [
+        (0., {'CMD': 'LOGIN', 'PWD': '***'}, None),
+        (0., {'CMD': 'GET_SYS_INFO'}, None),
+        (0., {'CMD': 'GET_CONFIGS'}, None),
+        (0., {'CMD': 'SET_STREAM', 'STREAM': True}, None),
+        (0., {'CMD': 'SET_INFER', 'INFER': is_infer}, None),
+    ]
+    steps = int(duration * mov_rate)
+    for i in range(steps):
+        t = i / mov_rate
+        records.append((t, {'CMD': 'MOV', 'R': 0.5, 'THETA': 45 + 90 * (i % 100) / 100}, None))
+        if int(t) != int((i - 1) / mov_rate):
+            records.append((t, {'CMD': 'GET_SYS_INFO'}, None))
+    records.append((duration, {'CMD': 'SET_STREAM', 'STREAM': False}, None))
+    return records
+
+
+def detect_scenario(duration: float, detect_rate: float) -> List[Record]:
+    """
+    a car using detectServer, DETECT at detect_rate with the image of --image
+    """
+    records = [(0., {'CMD': 'GET_CONFIG'}, None)]
+    for i in range(int(duration * detect_rate)):
+        records.append((i / detect_rate, {'CMD': 'DETECT', 'FORMAT': 'JSON', 'ENCODING': 'JPEG'}, None))
+    return records
+
+
+class ReplayClient(Thread):
+    def __init__(
+            self,
+            index: int,
+            address: Tuple[str, int],
+            records: List[Record],
+            speed=1.,
+            password='',
+            image: Optional[bytes] = None,
+            drain=1.,
+    ):
+        Thread.__init__(self, name=f'ReplayClient-{index}', daemon=True)
+        self.address = address
+        self.records = records
+        self.speed = speed
+        self.password = password
+        self.image = image
+        self.drain = drain
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.lock = Lock()
+        self.pending: Dict[str, deque] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.frames: List[float] = []
+        self.sent = 0
+        self.skipped = 0
+        self.is_busy = False
+        self.is_running = True
+        self.error: Optional[str] = None
+
+    def run(self):
+        try:
+            self.sock.connect(self.address)
+        except OSError as E:
+            self.error = str(E)
+            return
+        receiver = Thread(target=self.receiving, name=f'{self.name}-recv', daemon=True)
+        receiver.start()
+        start = perf_counter()
+        try:
+            for t, message, payload in self.records:
+                delay = start + t / self.speed - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                if not self.is_running or self.is_busy:
+                    break
+                self.send(message, payload)
+            sleep(self.drain)
+        except OSError as E:
+            self.error = str(E)
+        finally:
+            self.is_running = False
+            self.sock.close()
+            receiver.join(1)
+
+    def send(self, message: dict, payload: Optional[bytes]):
+        cmd = message.get('CMD')
+        if cmd in SKIP_COMMANDS:
+            self.skipped += 1
+            return
+        if 'PWD' in message:
+            message = dict(message, PWD=self.password)
+        if cmd == 'DETECT' and 'IMAGE' not in message and payload is None:
+            if self.image is None:
+                # recorded without payloads, nothing to send
+                self.skipped += 1
+                return
+            message = dict(message, ENCODING='JPEG')
+            message.pop('SHAPE', None)
+            payload = self.image
+        response = RESPONSES.get(cmd)
+        if response is not None:
+            with self.lock:
+                self.pending.setdefault(response, deque()).append((cmd, perf_counter()))
+        if payload is None:
+            send(self.sock, json.dumps(message))
+        else:
+            send_binary(self.sock, message, payload)
+        self.sent += 1
+
+    def receiving(self):
+        while self.is_running:
+            try:
+                message = recv_message(self.sock)
+            except Exception:
+                return
+            now = perf_counter()
+            if type(message) is str:
+                message = json.loads(message)
+            cmd = message.get('CMD')
+            if cmd == 'FRAME':
+                self.frames.append(now)
+                continue
+            if cmd == 'SYS_BUSY':
+                self.is_busy = True
+                return
+            with self.lock:
+                pending = self.pending.get(cmd)
+                if not pending:
+                    continue
+                request, sent_time = pending.popleft()
+                self.latencies.setdefault(request, []).append(now - sent_time)
+
+    def fps(self) -> float:
+        if len(self.frames) < 2:
+            return 0.
+        return (len(self.frames) - 1) / (self.frames[-1] - self.frames[0])
+
+    def unanswered(self) -> int:
+        with self.lock:
+            return sum(len(pending) for pending in self.pending.values())
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f'/proc/{pid}/stat') as f:
+        # the process name may contain spaces, fields after it are fixed
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime, fields 14 and 15 of proc(5)
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def build_sessions(args) -> List[List[Record]]:
+    if args.recording is not None:
+        sessions = list(load_recording(args.recording).values())
+        if not sessions:
+            raise ValueError(f'No session in {args.recording}')
+        return sessions
+    if args.scenario == 'stream':
+        return [stream_scenario(args.duration, args.mov_rate, args.infer)]
+    return [detect_scenario(args.duration, args.detect_rate)]
+
+
+def parse_args():
+    parser = ArgumentParser(description='Replay recorded or scripted sessions from concurrent clients')
+    parser.add_argument('ip')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--recording', default=None, help='JSON lines of SessionRecorder, a scenario if not set')
+    parser.add_argument('--scenario', default='stream', choices=('stream', 'detect'))
+    parser.add_argument('--clients', type=int, default=1, help='client i replays session i % sessions')
+    parser.add_argument('--speed', type=float, default=1., help='2 replays twice as fast as recorded')
+    parser.add_argument('--duration', type=float, default=30., help='seconds of a scenario')
+    parser.add_argument('--mov-rate', type=float, default=20.)
+    parser.add_argument('--infer', action='store_true', help='SET_INFER true in the stream scenario')
+    parser.add_argument('--detect-rate', type=float, default=5.)
+    parser.add_argument('--image', default=None, help='JPEG file sent by DETECT without a recorded payload')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--server-pid', type=int, default=None, help='sample the CPU usage of this process')
+    parser.add_argument('--drain', type=float, default=1., help='seconds to wait for responses after the last send')
+    parser.add_argument('--output', default=None, help='JSON result file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # python3 app.py (or python3 detectServer.py --port 5050 --record-path detect.jsonl)
+    # python3 benchmarks/LoadReplay.py 127.0.0.1 5050 --scenario detect --image person.jpg --clients 4 --server-pid 1234
+    # python3 benchmarks/LoadReplay.py 192.168.0.3 8000 --recording logs/sessions.jsonl --clients 8 --speed 2
+    args = parse_args()
+    log.basicConfig(level=log.WARNING)
+    sessions = build_sessions(args)
+    image = None
+    if args.image is not None:
+        with open(args.image, 'rb') as f:
+            image = f.read()
+
+    clients = [
+        ReplayClient(
+            i,
+            (args.ip, args.port),
+            sessions[i % len(sessions)],
+            args.speed,
+            args.password,
+            image,
+            args.drain
+        )
+        for i in range(args.clients)
+    ]
+    cpu_usages = []
+    last_cpu = cpu_seconds(args.server_pid) if args.server_pid else 0.
+    last_time = s = perf_counter()
+    for client in clients:
+        client.start()
+    while any(client.is_alive() for client in clients):
+        sleep(1)
+        if args.server_pid:
+            cpu, now = cpu_seconds(args.server_pid), perf_counter()
+            cpu_usages.append((cpu - last_cpu) / (now - last_time) * 100)
+            last_cpu, last_time = cpu, now
+    elapsed = perf_counter() - s
+
+    latencies: Dict[str, List[float]] = {}
+    for client in clients:
+        for cmd, values in client.latencies.items():
+            latencies.setdefault(cmd, []).extend(value * 1000 for value in values)
+    connected = [client for client in clients if client.error is None and not client.is_busy]
+    result = {
+        'time': strftime('%Y-%m-%d %H:%M:%S'),
+        'server': f'{args.ip}:{args.port}',
+        'args': vars(args),
+        'elapsed': elapsed,
+        'clients': args.clients,
+        'rejected': sum(client.is_busy for client in clients),
+        'errors': [client.error for client in clients if client.error is not None],
+        'sent': sum(client.sent for client in clients),
+        'skipped': sum(client.skipped for client in clients),
+        'unanswered': sum(client.unanswered() for client in clients),
+        'latency_ms': {
+            cmd: {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+            }
+            for cmd, values in sorted(latencies.items())
+        },
+        'frames': sum(len(client.frames) for client in clients),
+        'fps_per_client': sum(client.fps() for client in connected) / len(connected) if connected else 0.,
+        'server_cpu_percent': {
+            'mean': sum(cpu_usages) / len(cpu_usages),
+            'max': max(cpu_usages),
+        } if cpu_usages else None,
+    }
+
+    print('clients %d, rejected %d, sent %d, skipped %d, unanswered %d, %.1f seconds' % (
+        result['clients'], result['rejected'], result['sent'], result['skipped'], result['unanswered'], elapsed
+    ))
+    print('%-14s %7s %9s %9s %9s' % ('command', 'count', 'p50(ms)', 'p95(ms)', 'p99(ms)'))
+    for cmd, latency in result['latency_ms'].items():
+        print('%-14s %7d %9.2f %9.2f %9.2f' % (cmd, latency['count'], latency['p50'], latency['p95'], latency['p99']))
+    print('frames %d, %.2f FPS per client' % (result['frames'], result['fps_per_client']))
+    if result['server_cpu_percent'] is not None:
+        print('server CPU mean %.1f%%, max %.1f%%' % (
+            result['server_cpu_percent']['mean'], result['server_cpu_percent']['max']
+        ))
+    for error in result['errors']:
+        print(f'error: {error}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
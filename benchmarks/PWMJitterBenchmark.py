@@ -0,0 +1,163 @@
+import sys
+
+sys.path.append('.')
+import json
+from argparse import ArgumentParser
+from threading import Thread, Event
+from time import perf_counter, sleep, strftime
+from typing import List, Optional
+from nanoServer.FakeGPIO import FakeGPIO
+from nanoServer.PWMEngine import PWMEngine
+
+
+def percentile(values: list, q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+class LegacyPWM(Thread):
+    """
+    PWMSimulator before the engine, a thread per channel alternating output and sleep
+    """
+
+    def __init__(self, gpio: FakeGPIO, channel: int, period: float, duty_cycle_percent: float):
+        Thread.__init__(self, name=f'LegacyPWM-{channel}', daemon=True)
+        self.gpio = gpio
+        self.channel = channel
+        self.period = period
+        self.duty_cycle_percent = duty_cycle_percent
+        self.stop = Event()
+        gpio.setup(channel, gpio.OUT)
+
+    def run(self):
+        while not self.stop.wait(0):
+            high_time = self.period * self.duty_cycle_percent / 100
+            low_time = self.period - high_time
+            self.gpio.output(self.channel, self.gpio.HIGH)
+            sleep(high_time)
+            if low_time <= 0:
+                continue
+            self.gpio.output(self.channel, self.gpio.LOW)
+            sleep(low_time)
+
+
+def gil_load(stop: Event):
+    # pure Python work holds the GIL like pre and post processing around a detector
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+
+def run_mode(mode: str, seconds: float, period: float, duties: List[float], load_threads: int, spin_time: float):
+    gpio = FakeGPIO()
+    channels = list(range(len(duties)))
+    stop = Event()
+    loads = [Thread(target=gil_load, args=(stop,), daemon=True) for _ in range(load_threads)]
+    for load in loads:
+        load.start()
+
+    if mode == 'legacy':
+        pwms = [LegacyPWM(gpio, channel, period, duty) for channel, duty in zip(channels, duties)]
+        for pwm in pwms:
+            pwm.start()
+        sleep(seconds)
+        stop_time = perf_counter()
+        for pwm in pwms:
+            pwm.stop.set()
+        for pwm in pwms:
+            pwm.join()
+    else:
+        engine = PWMEngine(gpio, spin_time if mode == 'engine' else 0., name='PWM')
+        for channel, duty in zip(channels, duties):
+            engine.add_channel(channel, period, is_hardware=False).change_duty_cycle_percent(duty)
+        engine.start()
+        sleep(seconds)
+        stop_time = perf_counter()
+        engine.close()
+        engine.join()
+
+    stop.set()
+    for load in loads:
+        load.join()
+    # close() pulls the pins low in the middle of a cycle
+    return [
+        measure([edge for edge in gpio.get_edges(channel) if edge[0] < stop_time], period, duty)
+        for channel, duty in zip(channels, duties)
+    ]
+
+
+def measure(edges, period: float, duty_cycle_percent: float) -> dict:
+    """
+    period error from rising edge to rising edge, duty error from rising to falling edge,
+    drift of the last rising edge from the grid of the first one
+    """
+    rises = [t for t, level in edges if level]
+    high_times = [
+        fall - rise
+        for (rise, rise_level), (fall, fall_level) in zip(edges, edges[1:])
+        if rise_level and not fall_level
+    ]
+    period_errors = [abs(b - a - period) * 1000 for a, b in zip(rises, rises[1:])]
+    duty_errors = [abs(high / period * 100 - duty_cycle_percent) for high in high_times]
+    drift = (rises[-1] - rises[0] - (len(rises) - 1) * period) * 1000 if len(rises) > 1 else None
+    return {
+        'duty_cycle_percent': duty_cycle_percent,
+        'cycles': len(rises),
+        'period_error_ms': {
+            'p50': percentile(period_errors, 50),
+            'p99': percentile(period_errors, 99),
+            'max': max(period_errors) if period_errors else None,
+        },
+        'duty_error_percent': {
+            'p50': percentile(duty_errors, 50),
+            'p99': percentile(duty_errors, 99),
+            'max': max(duty_errors) if duty_errors else None,
+        },
+        'drift_ms': drift,
+    }
+
+
+def parse_args():
+    parser = ArgumentParser(description='Software PWM edge jitter on a fake GPIO, with and without GIL load')
+    parser.add_argument('--seconds', type=float, default=5.)
+    parser.add_argument('--period', type=float, default=0.25, help='seconds of one cycle, frequency of sys.ini')
+    parser.add_argument('--duties', type=float, nargs='+', default=[30., 50.], help='duty cycle of each channel')
+    parser.add_argument('--load-threads', type=int, nargs='+', default=[0, 2], help='CPU bound Python threads')
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'engine-sleep', 'engine'],
+                        choices=('legacy', 'engine-sleep', 'engine'))
+    parser.add_argument('--spin-time', type=float, default=0.0005, help='spin_time of the engine mode')
+    parser.add_argument('--switch-interval', type=float, default=0., help='thread switch interval of every mode, 0 keeps the default')
+    parser.add_argument('--output', default=None, help='JSON result file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # python3 benchmarks/PWMJitterBenchmark.py --period 0.02 --load-threads 0 2 4 --output benchmarks/pwm.json
+    # python3 benchmarks/PWMJitterBenchmark.py --period 0.02 --load-threads 2 --switch-interval 0.001
+    args = parse_args()
+    if args.switch_interval > 0:
+        sys.setswitchinterval(args.switch_interval)
+    records = []
+    print('%-13s %5s %4s %7s %15s %15s %18s %10s' % (
+        'mode', 'load', 'ch', 'cycles', 'period p50(ms)', 'period p99(ms)', 'duty p99/max(%)', 'drift(ms)'
+    ))
+    for load_threads in args.load_threads:
+        for mode in args.modes:
+            results = run_mode(mode, args.seconds, args.period, args.duties, load_threads, args.spin_time)
+            records.append({'mode': mode, 'load_threads': load_threads, 'channels': results})
+            for channel, result in enumerate(results):
+                period_error = result['period_error_ms']
+                duty_error = result['duty_error_percent']
+                print('%-13s %5d %4d %7d %15.3f %15.3f %8.3f/%-9.3f %10.2f' % (
+                    mode, load_threads, channel, result['cycles'], period_error['p50'] or 0, period_error['p99'] or 0,
+                    duty_error['p99'] or 0, duty_error['max'] or 0, result['drift_ms'] or 0
+                ))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': strftime('%Y-%m-%d %H:%M:%S'),
+                'args': vars(args),
+                'records': records,
+            }, f, indent=2)
@@ -0,0 +1,228 @@
+import sys
+
+sys.path.append('.')
+import json
+import numpy as np
+from argparse import ArgumentParser
+from time import perf_counter, strftime
+from typing import List, Iterable, Union
+from nanoServer.Tracker import Tracker, IDGenerator, optimal_assign
+
+
+class LegacyBox:
+    def __init__(self, bbox: List):
+        self.x1 = bbox[0]
+        self.y1 = bbox[1]
+        self.x2 = bbox[2]
+        self.y2 = bbox[3]
+        self.class_id = bbox[4]
+        self.id = 0
+        self.gen = 0
+
+
+class LegacyTracker:
+    """
+    Tracker before the IoU matrix, a Python loop over every tracked box per new box
+    """
+
+    def __init__(self, iou_threshold: float, generation_limit=3):
+        self.iou_threshold = iou_threshold
+        self.tracked: List[LegacyBox] = []
+        self.id_generator = IDGenerator()
+        self.generation_limit = generation_limit
+
+    def get(self):
+        return [box for box in self.tracked if box.gen == 0]
+
+    def update(self, boxes: Iterable):
+        if len(self.tracked) == 0:
+            for box in boxes:
+                box = LegacyBox(box)
+                box.id = self.id_generator.get(box.class_id)
+                self.tracked.append(box)
+            return
+        tracked = []
+        for box in boxes:
+            box = LegacyBox(box)
+            match_box = self.pop_match_box(box)
+            if match_box is None:
+                box.id = self.id_generator.get(box.class_id)
+            else:
+                box.id = match_box.id
+            tracked.append(box)
+        for box in self.tracked:
+            box.gen += 1
+            if box.gen > self.generation_limit:
+                self.tracked.remove(box)
+        self.tracked.extend(tracked)
+
+    def pop_match_box(self, box: LegacyBox) -> Union[LegacyBox, None]:
+        max_iou_score = 0
+        exist_box_id = 0
+        for index, exist_box in enumerate(self.tracked):
+            if box.class_id != exist_box.class_id:
+                continue
+            iou_score = self.calc_iou(box, exist_box)
+            if iou_score > max_iou_score:
+                max_iou_score = iou_score
+                exist_box_id = index
+        if max_iou_score >= self.iou_threshold:
+            return self.tracked.pop(exist_box_id)
+        return None
+
+    @staticmethod
+    def calc_iou(box1: LegacyBox, box2: LegacyBox) -> float:
+        x_left = max(box1.x1, box2.x1)
+        y_top = max(box1.y1, box2.y1)
+        x_right = min(box1.x2, box2.x2)
+        y_bottom = min(box1.y2, box2.y2)
+        if x_right < x_left or y_bottom < y_top:
+            return 0.0
+        inter_area = (x_right - x_left) * (y_bottom - y_top)
+        box1_area = (box1.x2 - box1.x1) * (box1.y2 - box1.y1)
+        box2_area = (box2.x2 - box2.x1) * (box2.y2 - box2.y1)
+        return inter_area / (box1_area + box2_area - inter_area)
+
+
+def crowd_scene(num_boxes: int, num_frames: int, speed=0.05, num_classes=3, miss_rate=0.05, seed=0):
+    """
+    boxes walking across a 1280 x 720 frame, some missed by the detector each frame
+    :param speed: box sizes per frame
+    :return: per frame (boxes (N, 5), ground truth object index (N,), xyxy of every object)
+    """
+    rng = np.random.default_rng(seed)
+    # a crowd is denser, the boxes get smaller
+    size = np.clip(400 / np.sqrt(num_boxes), 8, 120)
+    wh = rng.uniform(0.6, 1.4, (num_boxes, 2)) * size
+    xy = rng.uniform(0, 1, (num_boxes, 2)) * (np.array([1280, 720]) - wh)
+    velocity = rng.normal(0, size * speed, (num_boxes, 2))
+    class_ids = rng.integers(0, num_classes, num_boxes)
+    frames = []
+    for _ in range(num_frames):
+        xy = xy + velocity + rng.normal(0, size * 0.02, (num_boxes, 2))
+        seen = np.nonzero(rng.uniform(0, 1, num_boxes) >= miss_rate)[0]
+        boxes = np.empty((len(seen), 5), dtype=np.float32)
+        boxes[:, :2] = xy[seen]
+        boxes[:, 2:4] = xy[seen] + wh[seen]
+        boxes[:, 4] = class_ids[seen]
+        frames.append((boxes, seen, np.concatenate((xy, xy + wh), axis=1)))
+    return frames
+
+
+def shown_boxes(tracker, dt: float, is_legacy: bool):
+    """
+    :return: (class id, track id) -> xyxy shown dt frames after the last detection
+    """
+    if is_legacy:
+        # no motion model, the last box stays until the next detection
+        return {(box.class_id, box.id): [box.x1, box.y1, box.x2, box.y2] for box in tracker.get()}
+    xyxy, class_ids, ids, _ = tracker.get_tracks(dt)
+    return dict(zip(zip(class_ids.tolist(), ids.tolist()), xyxy.tolist()))
+
+
+def box_iou(box1, box2) -> float:
+    return LegacyTracker.calc_iou(LegacyBox(list(box1) + [0]), LegacyBox(list(box2) + [0]))
+
+
+def run(tracker, frames, is_legacy: bool, detect_every=1) -> dict:
+    """
+    the detector sees every detect_every-th frame, the frames between show the tracked boxes
+    """
+    times = []
+    switches = 0
+    last_ids = {}
+    owners = {}
+    shown_ious = []
+    for index, (boxes, truth, objects) in enumerate(frames):
+        dt = index % detect_every
+        if dt:
+            for key, xyxy in shown_boxes(tracker, dt, is_legacy).items():
+                if key in owners:
+                    shown_ious.append(box_iou(xyxy, objects[owners[key]]))
+            continue
+        s = perf_counter()
+        if is_legacy:
+            tracker.update(boxes.tolist())
+        else:
+            tracker.update(boxes, detect_every)
+        times.append(perf_counter() - s)
+        # both trackers return the boxes of the last update in input order
+        owners = {}
+        for obj, box in zip(truth.tolist(), tracker.get()):
+            if obj in last_ids and last_ids[obj] != box.id:
+                switches += 1
+            last_ids[obj] = box.id
+            owners[(box.class_id, box.id)] = obj
+    times = np.array(times[1:] or times) * 1000
+    return {
+        'update_ms': {
+            'mean': float(times.mean()),
+            'p50': float(np.percentile(times, 50)),
+            'p99': float(np.percentile(times, 99)),
+        },
+        'id_switches': switches,
+        'shown_iou': float(np.mean(shown_ious)) if shown_ious else None,
+    }
+
+
+def build_trackers(methods: List[str], iou_threshold: float):
+    for method in methods:
+        if method == 'legacy':
+            yield method, LegacyTracker(iou_threshold), True
+        else:
+            if method == 'optimal':
+                # the first call imports scipy, not part of the update time
+                try:
+                    optimal_assign(np.ones((1, 1)), iou_threshold)
+                except ImportError:
+                    pass
+            yield method, Tracker(iou_threshold, method=method), False
+
+
+def parse_args():
+    parser = ArgumentParser(description='Tracker update time, ID switches and boxes between detections on synthetic crowd scenes')
+    parser.add_argument('--boxes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--legacy-frames', type=int, default=10, help='frames of the legacy tracker, slow at 1000 boxes')
+    parser.add_argument('--methods', nargs='+', default=['legacy', 'greedy', 'optimal'])
+    parser.add_argument('--iou-threshold', type=float, default=0.3)
+    parser.add_argument('--detect-every', type=int, default=1, help='detect one frame out of this many')
+    parser.add_argument('--speed', type=float, default=0.05, help='box sizes per frame')
+    parser.add_argument('--output', default=None, help='JSON result file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # python3 benchmarks/TrackerBenchmark.py --boxes 10 100 1000 --output benchmarks/tracker.json
+    # python3 benchmarks/TrackerBenchmark.py --boxes 100 --detect-every 4 --speed 0.05
+    args = parse_args()
+    records = []
+    print('%-8s %6s %7s %11s %10s %10s %9s %10s' % (
+        'method', 'boxes', 'frames', 'mean(ms)', 'p50(ms)', 'p99(ms)', 'switches', 'shown IoU'
+    ))
+    for num_boxes in args.boxes:
+        for method, tracker, is_legacy in build_trackers(args.methods, args.iou_threshold):
+            num_frames = (args.legacy_frames if is_legacy else args.frames) * args.detect_every
+            frames = crowd_scene(num_boxes, num_frames, args.speed)
+            try:
+                record = run(tracker, frames, is_legacy, args.detect_every)
+            except ImportError as E:
+                print(f'{method}: {E}')
+                continue
+            record.update({'method': method, 'boxes': num_boxes, 'frames': num_frames})
+            records.append(record)
+            update_ms = record['update_ms']
+            print('%-8s %6d %7d %11.3f %10.3f %10.3f %9d %10s' % (
+                method, num_boxes, num_frames, update_ms['mean'], update_ms['p50'], update_ms['p99'],
+                record['id_switches'], '-' if record['shown_iou'] is None else '%.3f' % record['shown_iou']
+            ))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': strftime('%Y-%m-%d %H:%M:%S'),
+                'iou_threshold': args.iou_threshold,
+                'detect_every': args.detect_every,
+                'speed': args.speed,
+                'records': records,
+            }, f, indent=2)
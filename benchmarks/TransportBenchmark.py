@@ -0,0 +1,131 @@
+import sys
+
+sys.path.append('.')
+import json
+import numpy as np
+from argparse import ArgumentParser
+from time import perf_counter, strftime
+from typing import List
+
+# name -> encoding, JPEG quality, None is the BASE64 JPEG of servers without a binary channel
+MODES = {
+    'legacy-b64': (None, 95),
+    'jpeg-50': ('JPEG', 50),
+    'jpeg-75': ('JPEG', 75),
+    'jpeg-90': ('JPEG', 90),
+    'raw': ('RAW', 0),
+}
+
+
+def load_frames(image_dir=None, video=None, num_frames=32) -> List[np.ndarray]:
+    import cv2
+    if image_dir is not None:
+        from nanoServer.Detector.core.converter import list_images
+        frames = [cv2.imread(str(p)) for p in list_images(image_dir)[:num_frames]]
+        return [frame for frame in frames if frame is not None]
+    frames = []
+    cap = cv2.VideoCapture(video if video is not None else 0)
+    while len(frames) < num_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def payload_size(mode: str, frame: np.ndarray, size: int) -> int:
+    from nanoServer.Detector.ImageCodec import encode_image
+    from nanoServer.Detector.RemoteConfigManager import encode_b64image
+    encoding, quality = MODES[mode]
+    if encoding is None:
+        return len(encode_b64image(frame, size, size))
+    _, payload, _ = encode_image(frame, size, encoding, quality)
+    return len(payload)
+
+
+def run_mode(ip: str, port: int, mode: str, frames: List[np.ndarray], iterations: int, warmup: int) -> dict:
+    from nanoServer.Detector.RemoteConfigManager import RemoteConfigManager, legacy_image_size
+    encoding, quality = MODES[mode]
+    manager = RemoteConfigManager(ip, port, 30, True, image_encoding=encoding or 'JPEG', jpeg_quality=quality)
+    manager.negotiate()
+    if encoding is None:
+        # the detect request of a client before the binary channel
+        manager.server_encodings = ()
+    elif encoding not in manager.server_encodings:
+        raise RuntimeError(f'Detect server does not accept {encoding} images')
+    size = manager.input_size or legacy_image_size
+
+    for i in range(warmup):
+        manager.detect(frames[i % len(frames)])
+    latencies = []
+    for i in range(iterations):
+        s = perf_counter()
+        manager.detect(frames[i % len(frames)])
+        latencies.append(perf_counter() - s)
+    manager.client.close()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'mode': mode,
+        'size': legacy_image_size if encoding is None else size,
+        'bytes_per_frame': float(np.mean([
+            payload_size(mode, frame, legacy_image_size if encoding is None else size) for frame in frames
+        ])),
+        'latency_ms': {
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'p99': float(np.percentile(latencies, 99)),
+        },
+        'fps': float(1000 / latencies.mean()),
+    }
+
+
+def parse_args():
+    parser = ArgumentParser(description='End-to-end DETECT latency of each image transport mode')
+    parser.add_argument('ip')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--images', default=None, help='image folder')
+    parser.add_argument('--video', default=None, help='recorded clip, the camera if neither is set')
+    parser.add_argument('--num-frames', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--output', default=None, help='JSON result file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # python3 detectServer.py --port 5050 (on the detect server, with a model loaded)
+    # python3 benchmarks/TransportBenchmark.py 192.168.0.2 5050 --video clip.mp4 --output benchmarks/transport.json
+    args = parse_args()
+    frames = load_frames(args.images, args.video, args.num_frames)
+    if not frames:
+        print('No frame to send')
+        exit(1)
+
+    records = []
+    print('%-12s %5s %10s %9s %9s %9s %8s' % ('mode', 'size', 'KB/frame', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'FPS'))
+    for mode in args.modes:
+        record = run_mode(args.ip, args.port, mode, frames, args.iterations, args.warmup)
+        records.append(record)
+        latency = record['latency_ms']
+        print('%-12s %5d %10.1f %9.2f %9.2f %9.2f %8.2f' % (
+            mode,
+            record['size'],
+            record['bytes_per_frame'] / 1024,
+            latency['p50'],
+            latency['p95'],
+            latency['p99'],
+            record['fps']
+        ))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': strftime('%Y-%m-%d %H:%M:%S'),
+                'server': f'{args.ip}:{args.port}',
+                'frame_shape': list(frames[0].shape),
+                'records': records,
+            }, f, indent=2)
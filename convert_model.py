@@ -0,0 +1,56 @@
+import logging as log
+from argparse import ArgumentParser
+from pathlib import Path
+from nanoServer.Detector.core.configer import YOLOConfiger
+from nanoServer.Detector.core.converter import (
+    TFLITE_QUANTIZE_TYPES,
+    EXPORT_FORMATS,
+    export_tflite,
+    export_onnx,
+    write_runtime_config
+)
+
+log.basicConfig(
+    format='%(asctime)s %(levelname)s:%(message)s',
+    datefmt='%Y/%m/%d %H:%M:%S',
+    level=log.INFO,
+)
+
+
+def parse_args():
+    parser = ArgumentParser(description='Convert a YOLO config and its .h5 weights to a runtime model')
+    parser.add_argument('config', help='YOLO config json file')
+    parser.add_argument('--format', default='tflite', choices=EXPORT_FORMATS)
+    parser.add_argument('--quantize', default='float16', choices=TFLITE_QUANTIZE_TYPES, help='tflite only')
+    parser.add_argument('--calibration-dir', default=None, help='image folder for int8 calibration')
+    parser.add_argument('--calibration-steps', type=int, default=100)
+    parser.add_argument('--opset', type=int, default=13, help='onnx opset')
+    parser.add_argument('--output-dir', default='weights', help='folder of the converted model')
+    parser.add_argument('--configs-dir', default='configs', help='folder of the generated config')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    configer = YOLOConfiger(args.config)
+    output_dir = Path(args.output_dir)
+    if args.format == 'tflite':
+        name = f'{configer.name}-{args.quantize}'
+        model_path = export_tflite(
+            configer,
+            output_dir / f'{name}.tflite',
+            quantize=args.quantize,
+            calibration_dir=args.calibration_dir,
+            calibration_steps=args.calibration_steps
+        )
+    else:
+        # cv2.dnn gets a fixed batch size and only the convolution heads, decoding runs in NumPy
+        name = f'{configer.name}-{args.format}'
+        model_path = export_onnx(
+            configer,
+            output_dir / f'{name}.onnx',
+            batch_size=1 if args.format == 'opencv' else None,
+            opset=args.opset,
+            is_head_only=args.format == 'opencv'
+        )
+    write_runtime_config(configer, name, args.format, model_path, Path(args.configs_dir) / f'{name}.json')
@@ -1,96 +1,203 @@
-import cv2
-import numpy as np
 import logging as log
-from base64 import b64decode
-from typing import Optional
+from argparse import ArgumentParser
+from concurrent.futures import Future
+from typing import Optional, Union
 from nanoServer.Detector.ConfigManager import ConfigManager
-from nanoServer.Detector.ConfigManagerAPI import RESULT, CONFIG, CONFIGS
+from nanoServer.Detector.DetectorPool import DetectorPool
+from nanoServer.Detector.DetectResult import DetectResult, ClassTable
+from nanoServer.Detector.ConfigManagerAPI import RESULT, BINARY_RESULT, CONFIG, CONFIGS, METRICS
+from nanoServer.Detector.ImageCodec import ENCODINGS, decode_message
+from nanoServer.Metrics import REGISTRY, MetricsWriter
+from nanoServer.ClientHandler import CloseSession
 from nanoServer.Server import Server
+from nanoServer.SessionRecorder import SessionRecorder
+from nanoServer.socketIO import PAYLOAD_KEY
 from nanoServer.utils.util import get_hostname
 
 
-def decode_b64image(b64image: str) -> Optional[np.ndarray]:
-    buf_image = b64decode(b64image)
-    image = cv2.imdecode(np.frombuffer(buf_image, dtype=np.uint8), cv2.IMREAD_COLOR)
-    return image
-
-
-log.basicConfig(
-    format='%(asctime)s %(levelname)s:%(message)s',
-    datefmt='%Y/%m/%d %H:%M:%S',
-    level=log.INFO,
-)
-
-s = Server(
-    ip=get_hostname(),
-    port=5050,
-    max_connection=1,
-    is_show_exc_info=True
-)
-detector = ConfigManager('./configs/', True, )
-
-
-@s.response('SET_CONFIG', detector)
-def load_model(message: dict, d: ConfigManager):
-    log.info('SET_CONFIG')
-    config_name = message.get('CONFIG_NAME')
-    d.set_config(config_name)
-
-
-@s.response('DETECT', detector)
-def detect(message: dict, d: ConfigManager):
-    log.info('Detect image')
+def result_message(detect_result: DetectResult, size: Optional[int] = None) -> dict:
     result = RESULT.copy()
-    b64image = message.get('IMAGE', '')
-    if len(b64image) < 1:
-        return result
-    image = decode_b64image(b64image)
-    detect_result = d.detect(image, is_cv2=True)
-    result['BBOX'] = detect_result.boxes
+    result['BBOX'] = detect_result.box_list()
     result['CLASS'] = detect_result.classes
-    result['SCORE'] = detect_result.scores
+    result['SCORE'] = detect_result.score_list()
+    result['SIZE'] = size or 0
     return result
 
 
-@s.response('RESET', detector)
-def reset(message, d: ConfigManager):
-    log.info('Reset')
-    d.reset()
-
-
-@s.response('CLOSE', detector)
-def close(message, d: ConfigManager):
-    log.info('close')
-    d.close()
-    raise RuntimeError('Close Detector')
+def binary_result_message(detect_result: DetectResult, class_table: ClassTable, size: Optional[int] = None) -> dict:
+    result = BINARY_RESULT.copy()
+    class_version = class_table.update(detect_result.classes)
+    result['RESULT'] = detect_result.to_b64(class_version)
+    result['CLASS_VERSION'] = class_version
+    result['SIZE'] = size or 0
+    return result
 
 
-@s.response('GET_CONFIG', detector)
-def get_config(message, d: ConfigManager):
-    log.info('Get config')
-    config = CONFIG.copy()
-    configer = d.get_config()
-    if configer is None:
+def map_future(future: Future, func, default=None) -> Future:
+    """
+    :param default: result of the mapped future if the future or func raises, it must always resolve
+    """
+    mapped = Future()
+
+    def done(f: Future):
+        try:
+            mapped.set_result(func(f.result()))
+        except Exception:
+            log.error('Map detect result fail', exc_info=True)
+            mapped.set_result(default)
+
+    future.add_done_callback(done)
+    return mapped
+
+
+def parse_args():
+    parser = ArgumentParser(description='YOLO detect server')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--configs-dir', default='./configs/')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='number of detector processes, 0 runs the model in the server process'
+    )
+    parser.add_argument(
+        '--max-connection',
+        type=int,
+        default=4,
+        help='clients served at once, more are answered SYS_BUSY'
+    )
+    parser.add_argument('--metrics-path', default='', help='Prometheus text file written every 10 seconds')
+    parser.add_argument('--record-path', default='', help='JSON lines of every inbound message, with the images')
+    return parser.parse_args()
+
+
+def build_server(port: int, detector: Union[ConfigManager, DetectorPool], max_connection=1) -> Server:
+    s = Server(
+        ip=get_hostname(),
+        port=port,
+        max_connection=max_connection,
+        is_show_exc_info=True
+    )
+    class_table = ClassTable()
+
+    @s.response('SET_CONFIG', detector)
+    def load_model(message: dict, d: ConfigManager):
+        log.info('SET_CONFIG')
+        config_name = message.get('CONFIG_NAME')
+        d.set_config(config_name)
+
+    @s.response('DETECT', detector)
+    def detect(message: dict, d: Union[ConfigManager, DetectorPool]):
+        log.info('Detect image')
+        configer = d.get_config()
+        size = None if configer is None else configer.size
+        try:
+            # JPEGs much larger than the model input are decoded at a reduced size
+            image, (x_scale, y_scale) = decode_message(message, message.get(PAYLOAD_KEY), size)
+        except ValueError:
+            log.warning('Decode image fail', exc_info=True)
+            return RESULT.copy()
+        if image is None:
+            return RESULT.copy()
+        if message.get('FORMAT') == 'BINARY':
+            to_message = lambda detect_result: binary_result_message(
+                detect_result.scaled(x_scale, y_scale), class_table, size
+            )
+        else:
+            to_message = lambda detect_result: result_message(detect_result.scaled(x_scale, y_scale), size)
+        if isinstance(d, DetectorPool):
+            # the sending thread waits for the worker, the next request is already handled
+            return map_future(d.detect_async(image, is_cv2=True), to_message, RESULT.copy())
+        # requests of other sessions queue for the model instead of getting an empty result
+        return to_message(d.detect(image, is_cv2=True, is_wait=True))
+
+    def is_last_session() -> bool:
+        # the model is shared, a client leaving must not unload it under the others
+        return s.session_count() <= 1
+
+    @s.response('RESET', detector)
+    def reset(message, d: ConfigManager):
+        if not is_last_session():
+            log.info('Reset skipped, other clients connected')
+            return
+        log.info('Reset')
+        d.reset()
+
+    @s.response('CLOSE', detector)
+    def close(message, d: ConfigManager):
+        log.info('close')
+        if is_last_session():
+            d.reset()
+        raise CloseSession('Client closed')
+
+    @s.response('GET_CONFIG', detector)
+    def get_config(message, d: ConfigManager):
+        log.info('Get config')
+        config = CONFIG.copy()
+        config['ENCODINGS'] = list(ENCODINGS)
+        configer = d.get_config()
+        if configer is None:
+            return config
+        config['CONFIG_NAME'] = configer.name
+        config['SIZE'] = configer.size
+        config['MODEL_TYPE'] = configer.model_type
+        config['TINY'] = configer.tiny
+        config['CLASSES'] = configer.classes
+        config['CLASS_VERSION'] = class_table.update(configer.classes)
         return config
-    config['CONFIG_NAME'] = configer.name
-    config['size'] = configer.size
-    config['MODEL_TYPE'] = configer.model_type
-    config['TINY'] = configer.tiny
-    config['CLASSES'] = configer.classes
-    return config
 
+    @s.response('GET_CONFIGS', detector)
+    def get_configs(message, d: ConfigManager):
+        log.info('Get configs')
+        configs = CONFIGS.copy()
+
+        configs['CONFIGS'] = {
+            k: v.config
+            for k, v in d.configer_group.items()
+        }
+        return configs
 
-@s.response('GET_CONFIGS', detector)
-def get_configs(message, d: ConfigManager):
-    log.info('Get configs')
-    configs = CONFIGS.copy()
+    @s.response('GET_METRICS')
+    def get_metrics(message):
+        metrics = METRICS.copy()
+        metrics['METRICS'] = REGISTRY.to_dict()
+        return metrics
 
-    configs['CONFIGS'] = {
-        k: v.config
-        for k, v in d.configer_group.items()
-    }
-    return configs
+    return s
 
 
 if __name__ == '__main__':
-    s.run()
+    # worker processes import this module again, so everything starts here
+    log.basicConfig(
+        format='%(asctime)s %(levelname)s:%(message)s',
+        datefmt='%Y/%m/%d %H:%M:%S',
+        level=log.INFO,
+    )
+    args = parse_args()
+    # a static camera sends near-duplicate frames, their results come from the cache
+    if args.workers > 0:
+        detector = DetectorPool(
+            args.configs_dir,
+            num_workers=args.workers,
+            is_show_exc_info=True,
+            cache_size=16,
+            cache_ttl=1.,
+            cache_distance=4
+        )
+    else:
+        detector = ConfigManager(args.configs_dir, True, cache_size=16, cache_ttl=1., cache_distance=4)
+    s = build_server(args.port, detector, args.max_connection)
+    recorder = SessionRecorder(args.record_path, is_record_payload=True) if args.record_path else None
+    s.set_recorder(recorder)
+    metrics_writer = MetricsWriter(args.metrics_path) if args.metrics_path else None
+    if metrics_writer is not None:
+        metrics_writer.start()
+    try:
+        s.run()
+    finally:
+        detector.close()
+        if recorder is not None:
+            recorder.close()
+        if metrics_writer is not None:
+            metrics_writer.close()
+            metrics_writer.join()
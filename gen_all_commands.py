@@ -36,6 +36,11 @@ get_config = cmd_dir / 'GET_CONFIG.json'
 set_config = cmd_dir / 'SET_CONFIG.json'
 set_infer = cmd_dir / 'SET_INFER.json'
 set_quality = cmd_dir / 'SET_QUALITY.json'
+set_result_format = cmd_dir / 'SET_RESULT_FORMAT.json'
+get_metrics = cmd_dir / 'GET_METRICS.json'
+profile_start = cmd_dir / 'PROFILE_START.json'
+profile_stop = cmd_dir / 'PROFILE_STOP.json'
+get_profile = cmd_dir / 'GET_PROFILE.json'
 mov = cmd_dir / 'MOV.json'
 sys_info = cmd_dir / 'SYS_INFO.json'
 login_info = cmd_dir / 'LOGIN_INFO.json'
@@ -44,16 +49,24 @@ configs = cmd_dir / 'CONFIGS.json'
 sys_log_out = cmd_dir / 'SYS_LOGOUT.json'
 sys_exit = cmd_dir / 'SYS_EXIT.json'
 sys_shutdown = cmd_dir / 'SYS_SHUTDOWN.json'
+sys_busy = cmd_dir / 'SYS_BUSY.json'
+metrics = cmd_dir / 'METRICS.json'
+profile = cmd_dir / 'PROFILE.json'
+profile_file = cmd_dir / 'PROFILE_FILE.json'
 frame = cmd_dir / 'FRAME.json'
+binary_frame = cmd_dir / 'BINARY_FRAME.json'
 
 PATH_GROUP = [
     login, logout, _exit, shutdown, reset, get_sys_info, set_stream, get_configs, get_config, set_config, set_infer,
-    set_quality, mov, sys_info, login_info, config, configs, sys_log_out, sys_exit, sys_shutdown, frame
+    set_quality, set_result_format, get_metrics, profile_start, profile_stop, get_profile, mov, sys_info, login_info,
+    config, configs, sys_log_out, sys_exit, sys_shutdown, sys_busy, metrics, profile, profile_file, frame, binary_frame
 ]
 
 DIC_GROUP = [
     LOGIN, LOGOUT, EXIT, SHUTDOWN, RESET, GET_SYS_INFO, SET_STREAM, GET_CONFIGS, GET_CONFIG, SET_CONFIG, SET_INFER,
-    SET_QUALITY, MOV, SYS_INFO, LOGIN_INFO, CONFIG, load_configs(), SYS_LOGOUT, SYS_EXIT, SYS_SHUTDOWN, FRAME
+    SET_QUALITY, SET_RESULT_FORMAT, GET_METRICS, PROFILE_START, PROFILE_STOP, GET_PROFILE, MOV, SYS_INFO, LOGIN_INFO,
+    CONFIG, load_configs(), SYS_LOGOUT, SYS_EXIT, SYS_SHUTDOWN, SYS_BUSY, METRICS, PROFILE, PROFILE_FILE, FRAME,
+    BINARY_FRAME
 ]
 
 
@@ -43,7 +43,7 @@ GET_CONFIGS = {
 GET_CONFIG = {
     MAIN_KEY: 'GET_CONFIG',
 }
-# 設定選擇的config檔 如果上個config檔載入完成 則該次設定不接受
+# 設定選擇的config檔 模型於背景載入, 載入完成前仍使用舊模型辨識, 連續設定只會載入最後一個
 SET_CONFIG = {
     MAIN_KEY: 'SET_CONFIG',
     'CONFIG': ''  # STR
@@ -59,6 +59,37 @@ SET_QUALITY = {
     'WIDTH': 1080,  # INT
     'HEIGHT': 720,  # INT
 }
+# 設定辨識結果格式 JSON: FRAME 每幀附加 BBOX 及 CLASS, BINARY: 回傳 BINARY_FRAME, 斷線後恢復為 JSON
+SET_RESULT_FORMAT = {
+    MAIN_KEY: 'SET_RESULT_FORMAT',
+    'FORMAT': 'JSON'  # STR (JSON, BINARY)
+}
+# 請求伺服器回傳統計數據
+GET_METRICS = {
+    MAIN_KEY: 'GET_METRICS'
+}
+# 開始效能分析(需要密碼) MODE: SAMPLE 每秒RATE次取樣執行緒堆疊, CPROFILE 以cProfile分析執行緒
+# THREADS 為執行緒名稱開頭(Camera, SocketRecv, SocketSend, ControlLane, stream, StreamPool...), 空陣列為所有執行緒
+# DURATION 秒後自動停止, 0 為直到 PROFILE_STOP, 回傳 PROFILE
+PROFILE_START = {
+    MAIN_KEY: 'PROFILE_START',
+    'PWD': 'None',  # STR
+    'MODE': 'SAMPLE',  # STR (SAMPLE, CPROFILE)
+    'THREADS': [],  # STR ARRAY
+    'RATE': 100,  # FLOAT
+    'DURATION': 0,  # FLOAT
+}
+# 停止效能分析(需要密碼), 結果寫入 logs/ 後回傳 PROFILE
+PROFILE_STOP = {
+    MAIN_KEY: 'PROFILE_STOP',
+    'PWD': 'None',  # STR
+}
+# 請求效能分析結果檔案(需要密碼), NAME 為空時回傳 PROFILE 列出所有檔案, 否則回傳 PROFILE_FILE
+GET_PROFILE = {
+    MAIN_KEY: 'GET_PROFILE',
+    'PWD': 'None',  # STR
+    'NAME': '',  # STR
+}
 # 設定移動
 MOV = {
     MAIN_KEY: 'MOV',
@@ -126,6 +157,30 @@ SYS_EXIT = {
 SYS_SHUTDOWN = {
     MAIN_KEY: 'SYS_SHUTDOWN'
 }
+# 連線數已達上限, 伺服器送出後即關閉連線
+SYS_BUSY = {
+    MAIN_KEY: 'SYS_BUSY',
+    'MAX_CONNECTION': 1,  # INT
+}
+# 回傳Client統計數據, 計數器及量表為數值, 直方圖為 {'COUNT': INT, 'SUM': FLOAT, 'BUCKETS': [[上界(秒), 累計次數], ...]}
+METRICS = {
+    MAIN_KEY: 'METRICS',
+    'METRICS': {},  # 名稱 => 數值或直方圖
+}
+# 回傳效能分析狀態, FILES 為 logs/ 內的結果檔案, .collapsed 為 flamegraph 格式, .pstats 為 pstats 格式
+PROFILE = {
+    MAIN_KEY: 'PROFILE',
+    'IS_RUNNING': False,  # BOOLEAN
+    'MODE': None,  # STR
+    'FILES': [],  # STR ARRAY
+    'ERROR': None,  # STR
+}
+# 回傳效能分析結果檔案
+PROFILE_FILE = {
+    MAIN_KEY: 'PROFILE_FILE',
+    'NAME': '',  # STR
+    'DATA': '',  # BASE64 String
+}
 # 回傳Client串流畫面，如果有附加辨識結果 'IS_INFER' 為TRUE 且附加 BBOX, 否則 IS_INFER 為FALSE.
 FRAME = {
     MAIN_KEY: 'FRAME',
@@ -133,3 +188,14 @@ FRAME = {
     'BBOX': [],  # ARRAY [[X1, Y1, X2, Y2, CLASS_INDEX], [X1, Y1, X2, Y2, CLASS_INDEX]...]
     'CLASS': []  # CLASS_NAMES
 }
+# SET_RESULT_FORMAT 為 BINARY 時的串流畫面, RESULT 為 BASE64 編碼的二進位辨識結果(little endian):
+# HEADER [FORMAT_VERSION: UINT8, CLASS_ID_BYTES: UINT8, CLASS_VERSION: UINT16, N: UINT16]
+# BOXES [X1, Y1, X2, Y2]: INT16 * 4N, CLASS_IDS: UINT8(或UINT16) * N, SCORES: FLOAT16 * N
+# CLASS 只在類別表版本(CLASS_VERSION)改變後的第一幀附加
+BINARY_FRAME = {
+    MAIN_KEY: 'FRAME',
+    'IMAGE': '',  # BASE64 String
+    'RESULT': '',  # BASE64 String
+    'CLASS_VERSION': 0,  # INT
+    # 'CLASS': []  # CLASS_NAMES
+}
@@ -0,0 +1,90 @@
+import os
+import logging as log
+from typing import Optional, Set, Iterable
+
+
+def parse_cpus(text: str) -> Optional[Set[int]]:
+    """
+    :param text: cpu list like '0-1,3', an empty string means no restriction
+    :return: set of cpu ids or None
+    """
+    text = text.strip()
+    if not text:
+        return None
+    cpus = set()
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def read_process_cpus() -> Set[int]:
+    """
+    cpus the process may use (taskset, cgroups)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        try:
+            return set(os.sched_getaffinity(0))
+        except OSError:
+            pass
+    return set(range(os.cpu_count() or 1))
+
+
+# read on import, before any thread is pinned, a pinned thread would report only its own set
+PROCESS_CPUS = read_process_cpus()
+
+
+def format_cpus(cpus: Optional[Iterable[int]]) -> str:
+    if cpus is None:
+        return ''
+    return ','.join(str(cpu) for cpu in sorted(cpus))
+
+
+def set_thread_affinity(cpus: Optional[Iterable[int]]):
+    """
+    pin the calling thread, threads it starts afterwards inherit the cpu set
+    """
+    if cpus is None:
+        return
+    if not hasattr(os, 'sched_setaffinity'):
+        log.warning('CPU affinity is not supported on this platform')
+        return
+    requested = set(cpus)
+    # the calling thread may be pinned to another set, a thread can move to any cpu of the process
+    cpus = requested & PROCESS_CPUS
+    if not cpus:
+        log.warning(
+            f'No available cpu in {format_cpus(requested)} of {format_cpus(PROCESS_CPUS)}, keep the default affinity'
+        )
+        return
+    if cpus != requested:
+        log.warning(f'CPU {format_cpus(requested - PROCESS_CPUS)} not available, use {format_cpus(cpus)}')
+    try:
+        # pid 0 is the calling thread on Linux
+        os.sched_setaffinity(0, cpus)
+    except OSError:
+        log.warning(f'Set CPU affinity {format_cpus(cpus)} fail', exc_info=True)
+
+
+def configure_tensorflow(intra_op_threads=0, inter_op_threads=0):
+    """
+    must run before Tensorflow creates its thread pools, 0 keeps the Tensorflow default
+    """
+    if intra_op_threads <= 0 and inter_op_threads <= 0:
+        return
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return
+    try:
+        if intra_op_threads > 0:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads > 0:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        log.info(f'Tensorflow threads intra-op: {intra_op_threads} inter-op: {inter_op_threads}')
+    except RuntimeError:
+        log.warning('Tensorflow is already initialized, thread settings ignored')
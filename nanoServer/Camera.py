@@ -4,6 +4,7 @@ import numpy as np
 from base64 import b64encode
 from typing import Optional
 from .RepeatTimer import RepeatTimer
+from .Trigger import Trigger
 
 _width = 1280
 _height = 720
@@ -55,6 +56,7 @@ class Camera(RepeatTimer):
         self.lightness_text = ' .:-=+*#%@'
         self.light_lv = len(self.lightness_text) - 1
         self.encode_quality = [cv2.IMWRITE_JPEG_QUALITY, encode_quality]
+        self.frame_trigger = Trigger('Camera frame')
 
     def __str__(self):
         s = 'FPS: %d  Delay: %f  Width: %d  Height: %d\n' % (self.__FPS, self.__delay, self.__width, self.__height)
@@ -81,6 +83,8 @@ class Camera(RepeatTimer):
         if not is_image:
             image = None
         self.__is_image, self.__image = is_image, image
+        if is_image:
+            self.frame_trigger.fire()
 
     def close_phase(self):
         self.__cap.release()
@@ -0,0 +1,60 @@
+import logging as log
+from threading import Lock
+from time import perf_counter
+
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+
+
+class CircuitBreaker:
+    """
+    CLOSED lets every call through, failure_threshold failures in a row open it.
+    OPEN rejects calls for reset_timeout seconds, then HALF_OPEN lets one probe
+    through, the probe closes the breaker on success or opens it again on failure.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=5., name='Circuit breaker'):
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold must greater than 0')
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.
+        self.lock = Lock()
+
+    def __str__(self):
+        with self.lock:
+            return f'{self.name}: {self.state}, failures: {self.failures}'
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and perf_counter() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            # open, or the half open probe is in flight
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                log.info(f'{self.name} closed')
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state == CLOSED:
+                    log.warning(f'{self.name} open after {self.failures} failures')
+                self.state = OPEN
+                self.opened_at = perf_counter()
+
+    def is_closed(self) -> bool:
+        with self.lock:
+            return self.state == CLOSED
@@ -2,32 +2,91 @@ import logging as log
 import json
 from socket import socket, AF_INET, SOCK_STREAM
 from threading import Lock
-from typing import Union
-from .socketIO import recv, send
+from time import perf_counter
+from typing import Optional, Union
+from .API import MAIN_KEY, SYS_BUSY
+from .socketIO import recv, send, send_binary
 
 
 class Client:
-    def __init__(self, ip: str, port: int, time_out: float, is_show_exc_info=False):
+    """
+    A failed exchange drops the connection, the stream may hold half a message.
+    The next call reconnects, a failed connect waits a doubling backoff
+    (min_backoff to max_backoff) before it is tried again.
+    """
+
+    def __init__(self, ip: str, port: int, time_out: float, is_show_exc_info=False, min_backoff=0.5, max_backoff=30.):
         self.ip = ip
         self.port = port
         self.header = '>i'
         self.encoding = 'utf-8'
         self.lock = Lock()
-        self.sock: socket = socket(AF_INET, SOCK_STREAM)
-        self.sock.settimeout(time_out)
+        self.time_out = time_out
+        self.sock: Optional[socket] = None
         self.is_show_exc_info = is_show_exc_info
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.next_connect = 0.
         self.connect()
 
-    def connect(self):
-        self.sock.connect((self.ip, self.port))
+    def connect(self, timeout: Optional[float] = None) -> bool:
+        """
+        :param timeout: of the connect, the client timeout if None
+        """
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.settimeout(self.time_out if timeout is None else timeout)
+        try:
+            sock.connect((self.ip, self.port))
+        except OSError as E:
+            sock.close()
+            log.warning(f'Connect {self.ip}:{self.port} fail {E.__class__.__name__}, retry in {self.backoff:.1f}s')
+            self.next_connect = perf_counter() + self.backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            return False
+        if self.backoff > self.min_backoff:
+            log.info(f'Reconnected {self.ip}:{self.port}')
+        self.sock = sock
+        self.backoff = self.min_backoff
+        return True
+
+    def is_connected(self) -> bool:
+        return self.sock is not None
+
+    def __connected_sock(self, timeout: Optional[float] = None) -> socket:
+        if self.sock is None and (perf_counter() < self.next_connect or not self.connect(timeout)):
+            raise ConnectionError(f'Not connected to {self.ip}:{self.port}')
+        self.sock.settimeout(self.time_out if timeout is None else timeout)
+        return self.sock
+
+    def __check_busy(self, ret_obj: dict) -> dict:
+        """
+        a full server answers SYS_BUSY and closes, retried after the backoff like a failed connect
+        """
+        if ret_obj.get(MAIN_KEY) != SYS_BUSY[MAIN_KEY]:
+            return ret_obj
+        log.warning(f'Server {self.ip}:{self.port} busy, retry in {self.backoff:.1f}s')
+        self.__disconnect()
+        self.next_connect = perf_counter() + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        return {}
+
+    def __disconnect(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.close()
+        finally:
+            self.sock = None
 
     def recv(self) -> Union[str, dict]:
         with self.lock:
             ret_obj = None
             try:
-                ret_obj = recv(self.sock, self.header, self.encoding)
+                ret_obj = recv(self.__connected_sock(), self.header, self.encoding)
                 ret_obj = json.loads(ret_obj)
             except Exception:
+                self.__disconnect()
                 log.error('Recv message fail', exc_info=self.is_show_exc_info)
         return ret_obj
 
@@ -38,11 +97,16 @@ class Client:
             try:
                 if type(obj) is dict:
                     obj = json.dumps(obj)
-                send(self.sock, obj, self.header, self.encoding)
+                send(self.__connected_sock(), obj, self.header, self.encoding)
             except Exception:
+                self.__disconnect()
                 log.error('Send message fail', exc_info=self.is_show_exc_info)
 
-    def send_and_recv(self, obj: Union[str, dict]) -> dict:
+    def send_and_recv(self, obj: Union[str, dict], timeout: Optional[float] = None) -> dict:
+        """
+        :param timeout: of this exchange, the client timeout if None
+        :return: {} on failure
+        """
         if obj is None:
             return {}
         ret_obj = {}
@@ -50,18 +114,38 @@ class Client:
             try:
                 if type(obj) is dict:
                     obj = json.dumps(obj)
-                send(self.sock, obj, self.header, self.encoding)
-                ret_obj = recv(self.sock, self.header, self.encoding)
+                sock = self.__connected_sock(timeout)
+                send(sock, obj, self.header, self.encoding)
+                ret_obj = recv(sock, self.header, self.encoding)
                 if type(ret_obj) is str:
                     ret_obj = json.loads(ret_obj)
-                if type(ret_obj) is not dict:
-                    ret_obj = {}
+                ret_obj = self.__check_busy(ret_obj) if type(ret_obj) is dict else {}
             except Exception:
+                self.__disconnect()
                 log.error('Send and Recv message fail', exc_info=self.is_show_exc_info)
         return ret_obj
 
+    def send_binary_and_recv(self, obj: dict, payload, timeout: Optional[float] = None) -> dict:
+        """
+        :param payload: bytes-like sent after the JSON message, without base64
+        :param timeout: of this exchange, the client timeout if None
+        :return: {} on failure
+        """
+        ret_obj = {}
+        with self.lock:
+            try:
+                sock = self.__connected_sock(timeout)
+                send_binary(sock, obj, payload, self.header, self.encoding)
+                ret_obj = json.loads(recv(sock, self.header, self.encoding))
+                ret_obj = self.__check_busy(ret_obj) if type(ret_obj) is dict else {}
+            except Exception:
+                self.__disconnect()
+                log.error('Send and Recv binary message fail', exc_info=self.is_show_exc_info)
+        return ret_obj
+
     def close(self):
-        self.sock.close()
+        with self.lock:
+            self.__disconnect()
 
     #     self.input_buffer = Queue()
     #     self.output_buffer = Queue()
@@ -1,18 +1,38 @@
 import json
 import logging as log
+from concurrent.futures import Future, TimeoutError
 from queue import Queue, Full, Empty
-from threading import Thread
-from typing import Dict, Callable, Union, Any, Tuple, List, Optional
+from threading import Thread, Condition
+from types import MappingProxyType
+from typing import Dict, Callable, Union, Any, Tuple, List, Optional, Mapping, FrozenSet, Set
 from socket import socket
 from .API import MAIN_KEY
+from .Metrics import REGISTRY
 from .RepeatTimer import RepeatTimer
-from .socketIO import recv, send
+from .Trigger import Trigger
+from .ThreadProfiler import checkpoint
+from .SessionRecorder import SessionRecorder
+from .socketIO import recv_message, send, PAYLOAD_KEY
+
+
+MESSAGES_RECEIVED = REGISTRY.counter('nano_messages_received_total', 'Messages received from clients')
+MESSAGES_SENT = REGISTRY.counter('nano_messages_sent_total', 'Messages sent to clients')
+BYTES_RECEIVED = REGISTRY.counter('nano_received_bytes_total', 'Bytes received from clients')
+BYTES_SENT = REGISTRY.counter('nano_sent_bytes_total', 'Bytes sent to clients')
+CONTROL_COALESCED = REGISTRY.counter('nano_control_coalesced_total', 'Last value commands replaced before handled')
 
 
 class ClientLoginFail(Exception):
     pass
 
 
+class CloseSession(Exception):
+    """
+    raised by a response to end its session after the client asked for it
+    """
+    pass
+
+
 class FunctionMap:
     def __init__(self, func: Callable[..., Any], args: tuple = (), kwargs=None):
         if kwargs is None:
@@ -25,19 +45,126 @@ class FunctionMap:
         return self.func, self.args, self.kwargs
 
 
+class RoutineFunctionMap(FunctionMap):
+    def __init__(
+            self,
+            func: Callable[..., Any],
+            args: tuple = (),
+            kwargs=None,
+            trigger: Optional[Trigger] = None
+    ):
+        FunctionMap.__init__(self, func, args, kwargs)
+        # None runs the routine in a loop
+        self.trigger = trigger
+
+
+# middleware(message, next_handler) -> response, next_handler(message) runs the rest of the chain
+Middleware = Callable[[dict, Callable[[dict], Any]], Any]
+
+
+def bind_response(func: Callable[..., Any], args: tuple, kwargs: dict) -> Callable[[dict], Any]:
+    if kwargs:
+        return lambda message: func(message, *args, **kwargs)
+    if args:
+        return lambda message: func(message, *args)
+    return func
+
+
+def chain_middleware(middleware: Middleware, handler: Callable[[dict], Any]) -> Callable[[dict], Any]:
+    return lambda message: middleware(message, handler)
+
+
+class Router:
+    """
+    responses frozen by EventHandler.compile(), bind() resolves the arguments and the
+    middleware chain of every command once per session, a message then costs one
+    dict lookup and one call
+    """
+    __slots__ = ('responses', 'middlewares', 'last_value_keys')
+
+    def __init__(
+            self,
+            responses: Dict[str, FunctionMap],
+            middlewares: Tuple[Middleware, ...] = (),
+            last_value_keys: FrozenSet[str] = frozenset()
+    ):
+        self.responses: Mapping[str, FunctionMap] = MappingProxyType(dict(responses))
+        self.middlewares = middlewares
+        self.last_value_keys = last_value_keys
+
+    def bind(self, address: Tuple[str, int]) -> Dict[str, Callable[[dict], Any]]:
+        """
+        :param address: passed to responses registered with pass_address
+        :return: CMD -> handler(message)
+        """
+        routes = {}
+        for key, func_map in self.responses.items():
+            func, args, kwargs = func_map.get_func_arg_kwargs()
+            if kwargs.get('pass_address'):
+                kwargs = dict(kwargs, address=address)
+            handler = bind_response(func, args, kwargs)
+            for middleware in reversed(self.middlewares):
+                handler = chain_middleware(middleware, handler)
+            routes[key] = handler
+        return routes
+
+
 class EventHandler:
     def __init__(self):
         self.login_func_map: Optional[FunctionMap] = None
         self.response_func_map: Dict[str, FunctionMap] = {}
         self.enter_func_map: List[FunctionMap] = []
         self.exit_func_map: List[FunctionMap] = []
-        self.routine_func_map: List[FunctionMap] = []
+        self.routine_func_map: List[RoutineFunctionMap] = []
+        self.middlewares: List[Middleware] = []
+        self.last_value_keys: Set[str] = set()
+        self.router: Optional[Router] = None
+        self.recorder: Optional[SessionRecorder] = None
 
     def set_login(self, func: Callable[..., Any], args: tuple = (), kwargs: Optional[dict] = None):
         self.login_func_map = FunctionMap(func, args, kwargs)
 
-    def add_response(self, key: str, func: Callable[..., Any], args: tuple = (), kwargs: Optional[dict] = None):
+    def add_response(
+            self,
+            key: str,
+            func: Callable[..., Any],
+            args: tuple = (),
+            kwargs: Optional[dict] = None,
+            is_last_value=False
+    ):
+        """
+        :param is_last_value: only the newest pending message of key matters,
+                              it is handled on the control lane of the session
+        """
         self.response_func_map[key] = FunctionMap(func, args, kwargs)
+        if is_last_value:
+            self.last_value_keys.add(key)
+        else:
+            self.last_value_keys.discard(key)
+        self.router = None
+
+    def add_middleware(self, middleware: Middleware):
+        """
+        the first added middleware is the outermost
+        """
+        self.middlewares.append(middleware)
+        self.router = None
+
+    def compile(self) -> Router:
+        self.router = Router(self.response_func_map, tuple(self.middlewares), frozenset(self.last_value_keys))
+        return self.router
+
+    def get_router(self) -> Router:
+        router = self.router
+        if router is None:
+            router = self.compile()
+        return router
+
+    def set_recorder(self, recorder: Optional[SessionRecorder]):
+        """
+        sessions started afterwards record their inbound messages
+        """
+        self.recorder = recorder
 
     def add_enter(self, func: Callable[..., Any], args: tuple = (), kwargs: Optional[dict] = None):
         self.enter_func_map.append(FunctionMap(func, args, kwargs))
@@ -45,8 +172,17 @@ class EventHandler:
     def add_exit(self, func: Callable[..., Any], args: tuple = (), kwargs: Optional[dict] = None):
         self.exit_func_map.append(FunctionMap(func, args, kwargs))
 
-    def add_routine(self, func: Callable[..., Any], args: tuple = (), kwargs: Optional[dict] = None):
-        self.routine_func_map.append(FunctionMap(func, args, kwargs))
+    def add_routine(
+            self,
+            func: Callable[..., Any],
+            args: tuple = (),
+            kwargs: Optional[dict] = None,
+            trigger: Optional[Trigger] = None
+    ):
+        """
+        :param trigger: the routine runs once per fire of trigger instead of in a loop
+        """
+        self.routine_func_map.append(RoutineFunctionMap(func, args, kwargs, trigger))
 
     def get_login_func_map(self) -> Optional[FunctionMap]:
         return self.login_func_map
@@ -60,7 +196,7 @@ class EventHandler:
     def get_exit_func_maps(self) -> List[FunctionMap]:
         return self.exit_func_map
 
-    def get_routine_func_maps(self) -> List[FunctionMap]:
+    def get_routine_func_maps(self) -> List[RoutineFunctionMap]:
         return self.routine_func_map
 
 
@@ -74,6 +210,8 @@ class ClientHandler(RepeatTimer):
         self.is_show_exc_info = is_show_exc_info
         self.last_cmd = None
         self.ip, self.port = self.sock.getpeername()
+        self.routes = event_handler.get_router().bind((self.ip, self.port))
+        self.recorder = event_handler.recorder
 
     def __str__(self):
         return f'Client address => {self.ip}:{self.port} | last CMD: {self.last_cmd}'
@@ -97,22 +235,36 @@ class ClientHandler(RepeatTimer):
     def put(self, message):
         pass
 
-    def recv(self):
-        return recv(self.sock, self.header, self.encoding)
+    def recv(self) -> Union[str, dict]:
+        # a binary frame arrives parsed, with its payload in the message
+        message = recv_message(self.sock, self.header, self.encoding)
+        if self.recorder is not None:
+            self.recorder.record('%s:%s' % (self.ip, self.port), message)
+        MESSAGES_RECEIVED.inc()
+        if type(message) is str:
+            # JSON text is ASCII, characters are bytes
+            BYTES_RECEIVED.inc(len(message) + 4)
+        else:
+            payload = message.get(PAYLOAD_KEY)
+            BYTES_RECEIVED.inc(0 if payload is None else payload.nbytes)
+        return message
 
     def send(self, message):
         if type(message) is dict:
             message = json.dumps(message)
         if type(message) is not str:
             raise TypeError('Cant parse object to json')
-        return send(self.sock, message, self.header, self.encoding)
+        send(self.sock, message, self.header, self.encoding)
+        MESSAGES_SENT.inc()
+        BYTES_SENT.inc(len(message) + 4)
 
     def login(self):
         func_map = self.event_handler.get_login_func_map()
         if func_map is None:
             return
         message = self.recv()
-        message = json.loads(message)
+        if type(message) is str:
+            message = json.loads(message)
         func, args, kwargs = func_map.get_func_arg_kwargs()
         kwargs = self.edit_kwargs(kwargs)
         args = (message, *args)
@@ -142,36 +294,37 @@ class ClientHandler(RepeatTimer):
 
     def execute_response(self, message: Union[str, dict]) -> Any:
         try:
-            self.last_cmd = message
             if type(message) is str:
                 message = json.loads(message)
             if type(message) is not dict:
                 raise TypeError('Get unexpected JSON message')
-            sub_key = message.get(MAIN_KEY, None)
-            if sub_key is None:
-                raise KeyError('Message dint define main key')
-            response_func_maps = self.event_handler.get_response_func_maps()
-            func_map = response_func_maps.get(sub_key, None)
-            if func_map is None:
-                raise KeyError('Main key not found')
-            func, args, kwargs = func_map.get_func_arg_kwargs()
-            self.edit_kwargs(kwargs)
-            args = (message, *args)
-            return func(*args, **kwargs)
+            sub_key = message.get(MAIN_KEY)
+            self.last_cmd = sub_key
+            handler = self.routes.get(sub_key)
+            if handler is None:
+                raise KeyError(f'Main key not found: {sub_key}')
+            return handler(message)
         except TypeError:
             log.warning('Get unexpected JSON message', exc_info=self.is_show_exc_info)
             return None
         except KeyError:
             log.warning('Key not found', exc_info=self.is_show_exc_info)
             return None
+        except CloseSession:
+            log.info('Close session %s:%s' % (self.ip, self.port))
+            self.close()
+            return None
         except Exception:
             log.warning('Get unexpected error', exc_info=True)
             self.close()
             return None
 
-    def edit_kwargs(self, kwargs: dict):
+    def edit_kwargs(self, kwargs: dict) -> dict:
+        """
+        :return: a copy with the address of this session, kwargs are shared by all sessions
+        """
         if kwargs.get('pass_address'):
-            kwargs.update({'address': self.sock.getpeername()})
+            kwargs = dict(kwargs, address=(self.ip, self.port))
         return kwargs
 
 
@@ -195,14 +348,34 @@ class SyncClientHandler(ClientHandler):
 
 
 class AsyncClientHandler(ClientHandler):
+    """
+    Last value commands (MOV) skip the input buffer, the newest pending message
+    of each is kept and handled by the control lane thread, so they never wait
+    behind a slow command and a flood of them coalesces instead of queueing.
+    """
+
     def __init__(self, sock: socket, event_handler: EventHandler, is_show_exc_info=False):
         ClientHandler.__init__(self, sock, event_handler, is_show_exc_info)
         self.input_buffer = Queue()
         self.output_buffer = Queue()
+        self.last_value_keys = event_handler.get_router().last_value_keys
+        self.pending_controls: Dict[str, dict] = {}
+        self.control_ready = Condition()
+        self.control_handled = 0
+        self.control_coalesced = 0
         self.routine_thread_pool: List[Thread] = [
             Thread(target=self.__receiving, name='SocketRecv'),
             Thread(target=self.__sending, name='SocketSend'),
         ]
+        if self.last_value_keys:
+            self.routine_thread_pool.append(Thread(target=self.__controlling, name='ControlLane'))
+
+    def __str__(self):
+        s = ClientHandler.__str__(self)
+        if self.last_value_keys:
+            with self.control_ready:
+                s += f' | control handled: {self.control_handled}, coalesced: {self.control_coalesced}'
+        return s
 
     def init_phase(self):
         log.info('Client connected address => %s:%s' % self.sock.getpeername())
@@ -214,7 +387,7 @@ class AsyncClientHandler(ClientHandler):
             if not callable(func):
                 continue
             kwargs = self.edit_kwargs(kwargs)
-            t = Thread(target=self.routine, args=(func, args, kwargs), name=func.__name__)
+            t = Thread(target=self.routine, args=(func, args, kwargs, func_map.trigger), name=func.__name__)
             self.routine_thread_pool.append(t)
 
         for t in self.routine_thread_pool:
@@ -227,13 +400,20 @@ class AsyncClientHandler(ClientHandler):
         self.routine_thread_pool.clear()
         with self.input_buffer.mutex:
             self.input_buffer.queue.clear()
+        with self.control_ready:
+            self.pending_controls.clear()
         with self.output_buffer.mutex:
             self.output_buffer.queue.clear()
 
     def __receiving(self):
         while self.is_running():
+            checkpoint()
             try:
                 message = self.recv()
+                if self.last_value_keys:
+                    message = self.route_control(message)
+                    if message is None:
+                        continue
                 self.input_buffer.put(message, True, 0.2)
             except Full:
                 self.close()
@@ -242,10 +422,50 @@ class AsyncClientHandler(ClientHandler):
                 self.close()
                 log.error('Receiving fail', exc_info=self.is_show_exc_info)
 
+    def route_control(self, message: Union[str, dict]) -> Union[str, dict, None]:
+        """
+        :return: the message if it goes through the input buffer, None if the control lane took it
+        """
+        if type(message) is str:
+            try:
+                message = json.loads(message)
+            except ValueError:
+                # execute_response reports it
+                return message
+        if type(message) is not dict:
+            return message
+        key = message.get(MAIN_KEY)
+        if type(key) is not str or key not in self.last_value_keys:
+            return message
+        with self.control_ready:
+            if key in self.pending_controls:
+                self.control_coalesced += 1
+                CONTROL_COALESCED.inc()
+            self.pending_controls[key] = message
+            self.control_ready.notify()
+        return None
+
+    def __controlling(self):
+        while self.is_running():
+            checkpoint()
+            with self.control_ready:
+                if not self.pending_controls:
+                    self.control_ready.wait(0.2)
+                messages = list(self.pending_controls.values())
+                self.pending_controls.clear()
+                self.control_handled += len(messages)
+            for message in messages:
+                self.put(self.execute_response(message))
+
     def __sending(self):
         while self.is_running():
+            checkpoint()
             try:
                 response = self.output_buffer.get(True, 0.2)
+                if isinstance(response, Future):
+                    response = self.wait_response(response)
+                if response is None:
+                    continue
                 self.send(response)
             except Empty:
                 continue
@@ -253,11 +473,34 @@ class AsyncClientHandler(ClientHandler):
                 self.close()
                 log.error('Sending fail', exc_info=self.is_show_exc_info)
 
-    def routine(self, func: Callable[..., Any], args: tuple = (), kwargs: Optional[dict] = None):
+    def wait_response(self, future: Future) -> Any:
+        """
+        responses keep the request order, a pending Future holds back the ones after it
+        """
+        while self.is_running():
+            try:
+                return future.result(0.2)
+            except TimeoutError:
+                continue
+        future.cancel()
+        return None
+
+    def routine(
+            self,
+            func: Callable[..., Any],
+            args: tuple = (),
+            kwargs: Optional[dict] = None,
+            trigger: Optional[Trigger] = None
+    ):
         if kwargs is None:
             kwargs = {}
+        waiter = trigger.waiter() if trigger is not None else None
         while self.is_running():
+            checkpoint()
             try:
+                # an idle session only wakes up to check it is still running
+                if waiter is not None and not waiter.wait(0.2):
+                    continue
                 obj = func(*args, **kwargs)
                 self.put(obj)
             except Exception:
@@ -276,6 +519,7 @@ class AsyncClientHandler(ClientHandler):
         try:
             if type(obj) is dict:
                 obj = json.dumps(obj)
+            # a Future is sent by the sending thread once it is done
             self.output_buffer.put(obj, True, 0.2)
         except TypeError:
             log.error(f'Cant parse object to json: {obj}', exc_info=self.is_show_exc_info)
@@ -1,4 +1,5 @@
 from configparser import ConfigParser
+from .Affinity import parse_cpus
 from .utils.util import get_hostname
 
 
@@ -22,6 +23,9 @@ class Configer:
         self.pwm_min_angle = float(config['PWM']['min_angle'])
         self.pwm_max_angle = float(config['PWM']['max_angle'])
         self.is_pwm_listen = config.getboolean('PWM', 'is_pwm_listen')
+        self.is_hardware_pwm = config.getboolean('PWM', 'is_hardware_pwm', fallback=True)
+        self.pwm_spin_time = config.getfloat('PWM', 'spin_time', fallback=0.0005)
+        self.pwm_switch_interval = config.getfloat('PWM', 'switch_interval', fallback=0.)
         self.max_fps = int(config['Streamer']['max_fps'])
         self.idle_interval = float(config['Streamer']['idle_interval'])
         self.stream_timeout = float(config['Streamer']['timeout'])
@@ -31,3 +35,24 @@ class Configer:
         self.remote_detector_ip = config['Detector']['detect_server_ip']
         self.remote_detector_port = int(config['Detector']['detect_server_port'])
         self.remote_detector_timeout = float(config['Detector']['timeout'])
+        self.remote_image_encoding = config.get('Detector', 'remote_image_encoding', fallback='JPEG')
+        self.remote_jpeg_quality = config.getint('Detector', 'remote_jpeg_quality', fallback=90)
+        self.remote_deadline = config.getfloat('Detector', 'remote_deadline', fallback=1.)
+        self.remote_failure_threshold = config.getint('Detector', 'remote_failure_threshold', fallback=3)
+        self.remote_retry_interval = config.getfloat('Detector', 'remote_retry_interval', fallback=5.)
+        self.remote_fallback_config = config.get('Detector', 'remote_fallback_config', fallback='')
+        self.cache_size = config.getint('Detector', 'cache_size', fallback=16)
+        self.cache_ttl = config.getfloat('Detector', 'cache_ttl', fallback=1.)
+        self.cache_distance = config.getint('Detector', 'cache_distance', fallback=4)
+        self.is_track = config.getboolean('Detector', 'track', fallback=False)
+        self.track_iou_threshold = config.getfloat('Detector', 'track_iou_threshold', fallback=0.3)
+        self.detector_threads = config.getint('Performance', 'detector_threads', fallback=0)
+        self.tf_inter_op_threads = config.getint('Performance', 'tf_inter_op_threads', fallback=0)
+        self.camera_cpus = parse_cpus(config.get('Performance', 'camera_cpus', fallback=''))
+        self.detector_cpus = parse_cpus(config.get('Performance', 'detector_cpus', fallback=''))
+        self.network_cpus = parse_cpus(config.get('Performance', 'network_cpus', fallback=''))
+        self.pwm_cpus = parse_cpus(config.get('Performance', 'pwm_cpus', fallback=''))
+        self.metrics_path = config.get('Metrics', 'path', fallback='')
+        self.metrics_interval = config.getfloat('Metrics', 'interval', fallback=10.)
+        self.record_path = config.get('Recorder', 'path', fallback='')
+        self.is_record_payload = config.getboolean('Recorder', 'is_record_payload', fallback=False)
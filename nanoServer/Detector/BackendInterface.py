@@ -0,0 +1,34 @@
+import numpy as np
+from typing import Tuple
+from .core.configer import YOLOConfiger
+
+
+class BackendInterface:
+    """
+    infer() takes a float32 batch (B, size, size, 3) in [0, 1] and returns
+    pred_xywh (B, N, 4) in model input pixels and pred_prob (B, N, num_class)
+    """
+
+    def __init__(self, configer: YOLOConfiger):
+        self.configer = configer
+
+    def load(self):
+        pass
+
+    def warm_up(self):
+        size = self.configer.size
+        self.infer(np.zeros((1, size, size, 3), dtype=np.float32))
+
+    def infer(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        pass
+
+    def release(self):
+        pass
+
+
+def split_outputs(outputs) -> Tuple[np.ndarray, np.ndarray]:
+    # exported runtimes do not keep the output order, the box tensor is the one with 4 channels
+    outputs = list(outputs)
+    if outputs[0].shape[-1] != 4:
+        outputs.reverse()
+    return outputs[0], outputs[1]
@@ -0,0 +1,163 @@
+import numpy as np
+from threading import Lock
+from time import perf_counter
+from typing import List, Tuple
+from .core.configer import YOLOConfiger
+from .core.postprocess import suppress
+from .Detector import Detector
+from .DetectResult import DetectResult
+
+
+def expand_box(box, margin: float, width: int, height: int) -> Tuple[int, int, int, int]:
+    x1, y1, x2, y2 = box[:4]
+    w = (x2 - x1) * margin
+    h = (y2 - y1) * margin
+    return (
+        int(max(x1 - w, 0)),
+        int(max(y1 - h, 0)),
+        int(min(x2 + w, width)),
+        int(min(y2 + h, height)),
+    )
+
+
+class CascadeDetector:
+    """
+    The light model of `configer` runs on every frame, the full model of
+    `full_configer` runs on frames (mode 'frame') or crops (mode 'crop') where
+    a light detection score falls in [cascade_low, cascade_high), and on whole
+    frames whenever the time budget of cascade_target_fps has room for it.
+    """
+
+    def __init__(self, configer: YOLOConfiger, full_configer: YOLOConfiger):
+        if configer.classes != full_configer.classes:
+            raise ValueError(f'Cascade models {configer.name} and {full_configer.name} have different classes')
+        if configer.cascade_mode not in ('crop', 'frame'):
+            raise ValueError('Cascade mode must be crop or frame')
+        self.light = Detector(configer)
+        self.full = Detector(full_configer)
+        self.classes = configer.classes
+        self.mode = configer.cascade_mode
+        self.low = configer.cascade_low
+        self.high = configer.cascade_high
+        self.max_crops = configer.cascade_max_crops
+        self.frame_budget = 1 / configer.cascade_target_fps if configer.cascade_target_fps > 0 else 0
+        self.crop_margin = 0.5
+        self.iou_threshold = full_configer.iou_threshold
+        self.max_output_size_per_class = full_configer.max_output_size_per_class
+        self.max_total_size = full_configer.max_total_size
+        self.lock = Lock()
+        self.budget = 0.
+        self.light_time = 0.
+        self.full_time = 0.
+        self.frames = 0
+        self.full_frames = 0
+        self.crop_frames = 0
+
+    def __str__(self):
+        with self.lock:
+            return 'Cascade frames: %d, full: %d, crop: %d, light: %.1fms, full: %.1fms' % (
+                self.frames,
+                self.full_frames,
+                self.crop_frames,
+                self.light_time * 1000,
+                self.full_time * 1000,
+            )
+
+    def warm_up(self):
+        self.light.warm_up()
+        self.full.warm_up()
+        # first estimate of the full model cost for the idle budget
+        size = self.full.size
+        s = perf_counter()
+        self.full.detect(np.zeros((size, size, 3), dtype=np.uint8))
+        self.full_time = perf_counter() - s
+
+    def release(self):
+        self.light.release()
+        self.full.release()
+
+    def detect(self, image: np.ndarray, is_cv2=True) -> DetectResult:
+        height, width = image.shape[:2]
+        s = perf_counter()
+        light_result = self.light.detect(image, is_cv2=is_cv2)
+        light_time = perf_counter() - s
+        boxes = light_result.boxes.astype(np.int64)
+        scores = light_result.scores.astype(np.float32)
+        uncertain = (scores >= self.low) & (scores < self.high)
+
+        with self.lock:
+            self.frames += 1
+            self.light_time = self.ema(self.light_time, light_time)
+            # every frame earns the part of its time slot the light model did not use
+            self.budget = min(self.budget + self.frame_budget - light_time, self.frame_budget * 4)
+            is_idle = self.full_time > 0 and self.budget >= self.full_time
+
+        if is_idle or (np.any(uncertain) and self.mode == 'frame'):
+            full_boxes, full_scores = self.detect_full_frame(image, is_cv2)
+            with self.lock:
+                self.full_frames += 1
+            return self.merge((boxes, full_boxes), (scores, full_scores))
+        if not np.any(uncertain):
+            return light_result
+
+        # best uncertain detections first, at most max_crops of them in one batch
+        candidates = np.flatnonzero(uncertain)
+        candidates = candidates[np.argsort(-scores[candidates])][:self.max_crops]
+        regions = [expand_box(boxes[i], self.crop_margin, width, height) for i in candidates]
+        full_boxes, full_scores = self.detect_crops(image, regions, is_cv2)
+        with self.lock:
+            self.crop_frames += 1
+        # the full model decides about the uncertain boxes it has seen
+        keep = np.ones(len(boxes), dtype=bool)
+        keep[candidates] = False
+        return self.merge((boxes[keep], full_boxes), (scores[keep], full_scores))
+
+    def detect_full_frame(self, image: np.ndarray, is_cv2=True) -> Tuple[np.ndarray, np.ndarray]:
+        s = perf_counter()
+        result = self.full.detect(image, is_cv2=is_cv2)
+        self.spend(perf_counter() - s)
+        return result.boxes.astype(np.int64), result.scores.astype(np.float32)
+
+    def detect_crops(
+            self,
+            image: np.ndarray,
+            regions: List[Tuple[int, int, int, int]],
+            is_cv2=True
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        s = perf_counter()
+        results = self.full.detect_batch([image[y1:y2, x1:x2] for x1, y1, x2, y2 in regions], is_cv2=is_cv2)
+        self.spend(perf_counter() - s, is_full_frame=False)
+        all_boxes = []
+        all_scores = []
+        for (x1, y1, x2, y2), result in zip(regions, results):
+            boxes = result.boxes.astype(np.int64)
+            boxes[:, [0, 2]] += x1
+            boxes[:, [1, 3]] += y1
+            all_boxes.append(boxes)
+            all_scores.append(result.scores.astype(np.float32))
+        return np.concatenate(all_boxes), np.concatenate(all_scores)
+
+    def spend(self, elapsed: float, is_full_frame=True):
+        with self.lock:
+            self.budget -= elapsed
+            if is_full_frame:
+                self.full_time = self.ema(self.full_time, elapsed)
+
+    def merge(self, boxes_group, scores_group) -> DetectResult:
+        boxes = np.concatenate(boxes_group)
+        scores = np.concatenate(scores_group)
+        keep, scores = suppress(
+            boxes[:, :4].astype(np.float32),
+            scores,
+            boxes[:, 4],
+            self.iou_threshold,
+            self.max_output_size_per_class,
+            self.max_total_size
+        )
+        return DetectResult(boxes=boxes[keep], scores=scores, classes=self.classes)
+
+    @staticmethod
+    def ema(average: float, value: float, alpha=0.2) -> float:
+        if average <= 0:
+            return value
+        return average * (1 - alpha) + value * alpha
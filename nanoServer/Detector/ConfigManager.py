@@ -1,13 +1,24 @@
 import logging as log
 import numpy as np
-import tensorflow as tf
 from pathlib import Path
-from threading import Lock
-from typing import Union, Dict, Optional
+from threading import Lock, Thread
+from typing import Union, Dict, Optional, Set
+from time import perf_counter
+from ..Affinity import set_thread_affinity
+from ..Metrics import REGISTRY
 from .core.configer import YOLOConfiger
 from .DetectResult import DetectResult
 from .ConfigManagerInterface import ConfigManagerInterface
 from .Detector import Detector
+from .CascadeDetector import CascadeDetector
+from .DetectCache import DetectCache
+
+DETECT_SECONDS = REGISTRY.histogram('nano_detect_seconds', 'Model inference of one image, cache hits excluded')
+DETECT_CACHE_HITS = REGISTRY.counter('nano_detect_cache_hits_total', 'Detects served from the cache')
+DETECT_SKIPPED = REGISTRY.counter('nano_detect_skipped_total', 'Frames given an empty result while the model was busy')
+DETECT_ERRORS = REGISTRY.counter('nano_detect_errors_total', 'Detects that raised')
+MODEL_LOAD_SECONDS = REGISTRY.histogram('nano_model_load_seconds', 'Model build and warm up')
+MODEL_LOAD_FAILURES = REGISTRY.counter('nano_model_load_failures_total', 'Models failed to build or warm up')
 
 
 def load_configer(configs_dir: Union[Path, str], config_suffix='*.json') -> Dict[str, YOLOConfiger]:
@@ -26,76 +37,196 @@ def load_configer(configs_dir: Union[Path, str], config_suffix='*.json') -> Dict
 
 
 class ConfigManager(ConfigManagerInterface):
-    def __init__(self, configs_dir: Union[Path, str], is_show_exc_info=True) -> None:
+    """
+    Models are built and warmed up by a background loader thread, the active
+    (configer, detector) pair is swapped in only when the new model is ready,
+    so the previous model keeps serving detect() while loading.
+    Pending set_config() requests coalesce to the latest config name.
+    Results of near-duplicate frames are served from a DetectCache, cache_size=0 disables it.
+    """
+
+    def __init__(
+            self,
+            configs_dir: Union[Path, str],
+            is_show_exc_info=True,
+            cache_size=16,
+            cache_ttl=1.,
+            cache_distance=4,
+            num_threads=0,
+            cpus: Optional[Set[int]] = None
+    ) -> None:
         self.configer_group: Dict[str, YOLOConfiger] = load_configer(configs_dir)
+        if num_threads > 0:
+            for configer in self.configer_group.values():
+                configer.num_threads = num_threads
+        self.cpus = cpus
         self.configer: Optional[YOLOConfiger] = None
-        self.detector: Optional[Detector] = None
+        self.detector: Optional[Union[Detector, CascadeDetector]] = None
         self.__lock = Lock()
-        self.__timeout = 1
-        self.__is_available = False
+        self.__detect_lock = Lock()
+        self.__load_lock = Lock()
+        self.__pending_config: Optional[str] = None
+        self.__loading_config: Optional[str] = None
+        self.__is_loader_running = False
+        self.__generation = 0
         self.__is_show_exc_info = is_show_exc_info
+        self.cache = DetectCache(cache_size, cache_ttl, cache_distance)
 
     def __str__(self):
         with self.__lock:
             configer = self.configer
+        with self.__load_lock:
+            loading_config = self.__loading_config
 
+        s = ''
         if configer is None:
-            return '**No Configer Selected**'
-        return 'Size: %d, Classes: %s, Score Threshold: %f' % (
-            configer.size,
-            configer.classes,
-            configer.score_threshold
-        )
+            s += '**No Configer Selected**'
+        else:
+            s += 'Size: %d, Classes: %s, Score Threshold: %f' % (
+                configer.size,
+                configer.classes,
+                configer.score_threshold
+            )
+        if loading_config is not None:
+            s += f'\nLoading model: {loading_config}'
+        if self.cache.is_enable():
+            s += '\n' + str(self.cache)
+        return s
 
     def set_config(self, config_name):
-        configer = self.configer_group.get(config_name)
-        if not configer:
+        if config_name not in self.configer_group:
             log.warning(f'Config not exist: {config_name}')
             return
         log.info(f'Load model {config_name}')
-        acquired = self.__lock.acquire(True, self.__timeout)
-        if not acquired:
-            log.warning(f'Loading model {config_name} timeout. another model is loading')
-            return
+        with self.__load_lock:
+            if self.__pending_config is not None:
+                log.info(f'Pending model {self.__pending_config} replaced by {config_name}')
+            self.__pending_config = config_name
+            # cleared by the loader under the same lock once it sees no pending config
+            if self.__is_loader_running:
+                return
+            self.__is_loader_running = True
+        Thread(target=self.__loading, name='ModelLoader', daemon=True).start()
 
+    def __loading(self):
         try:
-            tf.keras.backend.clear_session()
-            self.detector = Detector(configer)
-            self.configer = configer
+            self.__load_pending()
+        except BaseException:
+            with self.__load_lock:
+                self.__loading_config = None
+                self.__is_loader_running = False
+            raise
+
+    def __load_pending(self):
+        # the inference thread pools inherit the cpu set of the thread that creates them
+        set_thread_affinity(self.cpus)
+        while True:
+            with self.__load_lock:
+                config_name = self.__pending_config
+                self.__pending_config = None
+                self.__loading_config = config_name
+                if config_name is None:
+                    self.__is_loader_running = False
+                    return
+            with self.__lock:
+                generation = self.__generation
+
+            configer = self.configer_group.get(config_name)
+            s = perf_counter()
+            try:
+                detector = self.build_detector(configer)
+                detector.warm_up()
+            except Exception:
+                MODEL_LOAD_FAILURES.inc()
+                log.error(f'Loading model {config_name} error', exc_info=True)
+                continue
+            MODEL_LOAD_SECONDS.observe(perf_counter() - s)
+
+            with self.__lock:
+                if generation != self.__generation:
+                    log.info(f'Loading model {config_name} discarded by reset')
+                    detector.release()
+                    continue
+                detector, self.detector = self.detector, detector
+                self.configer = configer
+                self.cache.clear()
             log.info(f'Loading model {config_name} finish')
-        except Exception:
-            log.error('Loading model error', exc_info=True)
-        finally:
-            self.__lock.release()
+            self.release(detector)
 
-    def detect(self, image: np.ndarray, is_cv2=True) -> DetectResult:
-        acquired = self.__lock.acquire(False)
+    def build_detector(self, configer: YOLOConfiger) -> Union[Detector, CascadeDetector]:
+        if configer.cascade_config is None:
+            return Detector(configer)
+        full_configer = self.configer_group.get(configer.cascade_config)
+        if full_configer is None:
+            raise KeyError(f'Cascade config not exist: {configer.cascade_config}')
+        return CascadeDetector(configer, full_configer)
+
+    def detect(self, image: np.ndarray, is_cv2=True, is_wait=False) -> DetectResult:
+        """
+        :param is_wait: wait for a running detect, otherwise the frame gets an empty result
+        """
+        signature = None
+        if self.cache.is_enable():
+            signature = self.cache.signature(image)
+            with self.__lock:
+                cached_result = self.cache.get(signature) if self.detector is not None else None
+            if cached_result is not None:
+                DETECT_CACHE_HITS.inc()
+                return cached_result
+
+        acquired = self.__detect_lock.acquire(is_wait)
         if not acquired:
+            DETECT_SKIPPED.inc()
             return DetectResult()
-        if self.detector is None:
-            self.__lock.release()
-            return DetectResult()
+        with self.__lock:
+            detector = self.detector
         try:
-            detect_result = self.detector.detect(image, is_cv2=is_cv2)
+            if detector is None:
+                return DetectResult()
+            with DETECT_SECONDS.time():
+                detect_result = detector.detect(image, is_cv2=is_cv2)
+            if signature is not None:
+                with self.__lock:
+                    # a result of a swapped out model must not reach the cache
+                    if self.detector is detector:
+                        self.cache.put(signature, detect_result)
             return detect_result
         except Exception:
+            DETECT_ERRORS.inc()
             log.error(f'Detect image fail', exc_info=self.__is_show_exc_info)
             return DetectResult()
         finally:
-            self.__lock.release()
+            self.__detect_lock.release()
 
     def reset(self):
+        with self.__load_lock:
+            self.__pending_config = None
         with self.__lock:
+            self.__generation += 1
+            detector = self.detector
             self.configer = None
             self.detector = None
-            tf.keras.backend.clear_session()
+            self.cache.clear()
+        self.release(detector)
+
+    def release(self, detector: Optional[Union[Detector, CascadeDetector]]):
+        if detector is None:
+            return
+        # wait for an in-flight detect() still holding the old detector
+        with self.__detect_lock:
+            detector.release()
 
     def close(self):
         self.reset()
         self.configer_group = {}
 
+    def is_loading(self) -> bool:
+        with self.__load_lock:
+            return self.__loading_config is not None
+
     def get_configs(self) -> Dict[str, YOLOConfiger]:
         return self.configer_group
 
     def get_config(self) -> Optional[YOLOConfiger]:
-        return self.configer
+        with self.__lock:
+            return self.configer
@@ -10,7 +10,11 @@ SET_CONFIG = {
 
 DETECT = {
     MAIN_KEY: 'DETECT',
-    'IMAGE': ''
+    'IMAGE': '',  # BASE64 JPEG, only without a binary payload
+    'FORMAT': 'JSON',  # JSON => RESULT, BINARY => BINARY_RESULT
+    # of the binary frame payload, JPEG => JPEG file, RAW => uint8 BGR pixels of SHAPE
+    'ENCODING': 'JPEG',
+    'SHAPE': [],  # [HEIGHT, WIDTH, 3]
 }
 
 RESET = {
@@ -29,6 +33,10 @@ GET_CONFIGS = {
     MAIN_KEY: 'GET_CONFIGS'
 }
 
+GET_METRICS = {
+    MAIN_KEY: 'GET_METRICS'
+}
+
 """
 RECV
 """
@@ -36,7 +44,16 @@ RESULT = {
     MAIN_KEY: 'RESULT',
     'BBOX': [],
     'CLASS': [],
-    'SCORE': []
+    'SCORE': [],
+    'SIZE': 0,  # model input size, images larger than it only cost bandwidth
+}
+
+# BASE64 packed DetectResult, class ids refer to the CLASSES of CONFIG with the same CLASS_VERSION
+BINARY_RESULT = {
+    MAIN_KEY: 'RESULT',
+    'RESULT': '',
+    'CLASS_VERSION': 0,
+    'SIZE': 0,
 }
 
 CONFIG = {
@@ -46,6 +63,8 @@ CONFIG = {
     'MODEL_TYPE': None,  # STR
     'TINY': False,
     'CLASSES': [],  # STR ARRAY
+    'CLASS_VERSION': 0,
+    'ENCODINGS': [],  # image encodings DETECT accepts in a binary payload
     # 'FRAME_WORK': None,  # STR
 }
 
@@ -53,3 +72,8 @@ CONFIGS = {
     MAIN_KEY: 'CONFIGS',
     'CONFIGS': {}
 }
+
+METRICS = {
+    MAIN_KEY: 'METRICS',
+    'METRICS': {},  # same as METRICS of nanoServer.API
+}
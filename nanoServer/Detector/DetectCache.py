@@ -0,0 +1,106 @@
+import numpy as np
+from threading import Lock
+from time import perf_counter
+from typing import Optional, Tuple
+from .DetectResult import DetectResult
+
+# (image shape, frame_signature), boxes are in pixels so only frames of the same shape share a result
+Signature = Tuple[tuple, np.ndarray]
+
+
+def frame_signature(image: np.ndarray, hash_size=16, sample_size=64) -> np.ndarray:
+    """
+    block-mean hash of a sample_size * sample_size grid of pixels
+
+    :param image: HxW or HxWxC image
+    :param hash_size: the hash has hash_size ** 2 bits
+    :param sample_size: pixels sampled per axis, a multiple of hash_size
+    :return: packed bits, uint8 array of hash_size ** 2 / 8 bytes
+    """
+    height, width = image.shape[:2]
+    rows = np.linspace(0, height - 1, sample_size).astype(np.intp)
+    cols = np.linspace(0, width - 1, sample_size).astype(np.intp)
+    sample = image[np.ix_(rows, cols)].astype(np.float32)
+    if sample.ndim == 3:
+        sample = sample.mean(axis=2)
+    step = sample_size // hash_size
+    blocks = sample.reshape(hash_size, step, hash_size, step).mean(axis=(1, 3))
+    return np.packbits(blocks > blocks.mean())
+
+
+class DetectCache:
+    """
+    Results of recent frames, a frame hits when its signature is within
+    max_distance bits of an entry of the same image shape younger than ttl seconds.
+    The least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, size=16, ttl=1., max_distance=4, hash_size=16):
+        self.size = size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.signatures = np.zeros((size, hash_size * hash_size // 8), dtype=np.uint8)
+        self.shapes = [None] * size
+        self.created = np.full(size, -np.inf)
+        self.used = np.full(size, -np.inf)
+        self.results = [None] * size
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return 'Cache hits: %d, misses: %d, hit rate: %.2f' % (
+                self.hits,
+                self.misses,
+                self.hits / total if total > 0 else 0
+            )
+
+    def is_enable(self) -> bool:
+        return self.size > 0
+
+    def signature(self, image: np.ndarray) -> Signature:
+        return image.shape, frame_signature(image, self.hash_size)
+
+    def get(self, signature: Signature) -> Optional[DetectResult]:
+        shape, bits = signature
+        now = perf_counter()
+        with self.lock:
+            valid = (now - self.created < self.ttl) & np.array([s == shape for s in self.shapes])
+            if not np.any(valid):
+                self.misses += 1
+                return None
+            distances = np.unpackbits(self.signatures ^ bits, axis=1).sum(axis=1)
+            distances[~valid] = self.max_distance + 1
+            index = int(np.argmin(distances))
+            if distances[index] > self.max_distance:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.used[index] = now
+            return self.results[index]
+
+    def put(self, signature: Signature, result: DetectResult):
+        shape, bits = signature
+        now = perf_counter()
+        with self.lock:
+            # expired entries have -inf use time after the reset below, so they go first
+            self.used[now - self.created >= self.ttl] = -np.inf
+            index = int(np.argmin(self.used))
+            if self.results[index] is not None and self.used[index] > -np.inf:
+                self.evictions += 1
+            self.signatures[index] = bits
+            self.shapes[index] = shape
+            self.created[index] = now
+            self.used[index] = now
+            self.results[index] = result
+
+    def clear(self):
+        with self.lock:
+            self.created[:] = -np.inf
+            self.used[:] = -np.inf
+            self.results = [None] * self.size
+            self.shapes = [None] * self.size
@@ -1,11 +1,126 @@
+import struct
+import numpy as np
+from base64 import b64encode, b64decode
+from threading import Lock
+from typing import List, Optional, Tuple
+
+# format version, bytes per class id, class table version, number of boxes
+BLOB_HEADER = struct.Struct('<BBHH')
+BLOB_VERSION = 1
+
+
 class DetectResult:
+    """
+    boxes are int16 [x1, y1, x2, y2], class ids uint8 (uint16 above 256 classes)
+    and scores float16, `classes` is the class name table of the model
+    """
+    __slots__ = ('xyxy', 'class_ids', 'scores', 'classes')
+
     def __init__(self, boxes=None, scores=None, classes=None):
-        if boxes is None:
-            boxes = []
-        if scores is None:
-            scores = []
+        """
+        :param boxes: (N, 5) [x1, y1, x2, y2, class id], array or nested list
+        :param scores: (N,)
+        :param classes: class names
+        """
         if classes is None:
             classes = []
-        self.boxes = boxes
+        boxes = np.asarray(boxes if boxes is not None else (), dtype=np.int64).reshape((-1, 5))
+        self.xyxy = boxes[:, :4].astype(np.int16)
+        self.class_ids = boxes[:, 4].astype(class_id_dtype(len(classes)))
+        self.scores = np.asarray(scores if scores is not None else (), dtype=np.float16).reshape(-1)
         self.classes = classes
-        self.scores = scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    @classmethod
+    def from_arrays(cls, xyxy: np.ndarray, class_ids: np.ndarray, scores: np.ndarray, classes: List[str]):
+        result = cls.__new__(cls)
+        result.xyxy = xyxy
+        result.class_ids = class_ids
+        result.scores = scores
+        result.classes = classes
+        return result
+
+    @property
+    def boxes(self) -> np.ndarray:
+        """
+        (N, 5) int32 [x1, y1, x2, y2, class id]
+        """
+        boxes = np.empty((len(self.xyxy), 5), dtype=np.int32)
+        boxes[:, :4] = self.xyxy
+        boxes[:, 4] = self.class_ids
+        return boxes
+
+    def scaled(self, x_scale: float, y_scale: float) -> 'DetectResult':
+        """
+        a copy with scaled boxes, cached results are shared so they are never changed in place
+        """
+        if x_scale == 1 and y_scale == 1:
+            return self
+        scale = np.array((x_scale, y_scale) * 2)
+        xyxy = np.round(self.xyxy * scale).astype(np.int16)
+        return DetectResult.from_arrays(xyxy, self.class_ids, self.scores, self.classes)
+
+    def box_list(self) -> List[List[int]]:
+        return self.boxes.tolist()
+
+    def score_list(self) -> List[float]:
+        return self.scores.astype(np.float32).tolist()
+
+    def to_bytes(self, class_version=0) -> bytes:
+        id_dtype = class_id_dtype(len(self.classes))
+        return b''.join((
+            BLOB_HEADER.pack(BLOB_VERSION, np.dtype(id_dtype).itemsize, class_version, len(self)),
+            self.xyxy.astype('<i2').tobytes(),
+            self.class_ids.astype(np.dtype(id_dtype).newbyteorder('<')).tobytes(),
+            self.scores.astype('<f2').tobytes(),
+        ))
+
+    def to_b64(self, class_version=0) -> str:
+        return b64encode(self.to_bytes(class_version)).decode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, classes: Optional[List[str]] = None) -> Tuple['DetectResult', int]:
+        """
+        :return: result, class table version the class ids refer to
+        """
+        version, id_size, class_version, n = BLOB_HEADER.unpack_from(data)
+        if version != BLOB_VERSION:
+            raise ValueError(f'Unknown detect result format {version}')
+        offset = BLOB_HEADER.size
+        xyxy = np.frombuffer(data, dtype='<i2', count=n * 4, offset=offset).reshape((n, 4))
+        offset += n * 8
+        class_ids = np.frombuffer(data, dtype='<u1' if id_size == 1 else '<u2', count=n, offset=offset)
+        offset += n * id_size
+        scores = np.frombuffer(data, dtype='<f2', count=n, offset=offset)
+        return cls.from_arrays(xyxy, class_ids, scores, [] if classes is None else classes), class_version
+
+    @classmethod
+    def from_b64(cls, blob: str, classes: Optional[List[str]] = None) -> Tuple['DetectResult', int]:
+        return cls.from_bytes(b64decode(blob), classes)
+
+
+def class_id_dtype(num_class: int):
+    return np.uint8 if num_class <= 256 else np.uint16
+
+
+class ClassTable:
+    """
+    version of the class name table, it changes only when the names change,
+    so clients get the names once per config change
+    """
+    __slots__ = ('classes', 'version', 'lock')
+
+    def __init__(self):
+        self.classes: List[str] = []
+        self.version = 0
+        self.lock = Lock()
+
+    def update(self, classes: List[str]) -> int:
+        with self.lock:
+            # an empty result (no model yet) keeps the current table
+            if classes and classes is not self.classes and classes != self.classes:
+                self.classes = classes
+                self.version = (self.version + 1) % 65536
+            return self.version
@@ -1,15 +1,54 @@
 import cv2
 import numpy as np
-import tensorflow as tf
+from importlib import import_module
 from pathlib import Path
-from typing import Union, Optional
+from typing import Union, Optional, List, Tuple
 from .core.configer import YOLOConfiger
-from .core.models import build_model
+from .core.postprocess import postprocess, filter_boxes, suppress
+from .BackendInterface import BackendInterface
 from .DetectResult import DetectResult
 
+# frame_work -> backend module, imported only when a config selects it
+BACKENDS = {
+    'tf': 'KerasBackend',
+    'trt': 'KerasBackend',
+    'tflite': 'TFLiteBackend',
+    'onnx': 'ONNXBackend',
+    'opencv': 'OpenCVBackend',
+}
+
+
+def load_backend(configer: YOLOConfiger) -> BackendInterface:
+    backend_name = BACKENDS.get(configer.frame_work)
+    if backend_name is None:
+        raise ValueError(f'Unknown frame work {configer.frame_work}, must be one of {tuple(BACKENDS)}')
+    module = import_module(f'.{backend_name}', __package__)
+    return getattr(module, backend_name)(configer)
+
+
+def tile_regions(width: int, height: int, rows: int, cols: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    split the frame into rows * cols tiles, neighbours share `overlap` of a tile
+    :return: [(x1, y1, x2, y2), ...]
+    """
+    regions = []
+    tile_w = width / (cols - (cols - 1) * overlap)
+    tile_h = height / (rows - (rows - 1) * overlap)
+    for row in range(rows):
+        y1 = round(row * tile_h * (1 - overlap))
+        y2 = min(round(y1 + tile_h), height)
+        for col in range(cols):
+            x1 = round(col * tile_w * (1 - overlap))
+            x2 = min(round(x1 + tile_w), width)
+            regions.append((x1, y1, x2, y2))
+    return regions
+
 
 class Detector:
-    def __init__(self, config: Union[str, Path, YOLOConfiger]):
+    def __init__(self, config: Union[str, Path, YOLOConfiger], backend: Optional[BackendInterface] = None):
+        """
+        :param backend: loaded in place of the frame_work backend of the config
+        """
         config_type = type(config)
         configer: Optional[YOLOConfiger] = None
         if config_type is str or config_type is Path:
@@ -17,51 +56,101 @@ class Detector:
         elif config_type is YOLOConfiger:
             configer = config
 
-        self.model = build_model(configer, training=False)
+        self.backend = load_backend(configer) if backend is None else backend
+        self.backend.load()
+        self.frame_work = configer.frame_work
         self.size = configer.size
         self.classes = configer.classes
         self.score_threshold = configer.score_threshold
         self.iou_threshold = configer.iou_threshold
         self.max_total_size = configer.max_total_size
         self.max_output_size_per_class = configer.max_output_size_per_class
+        self.nms_method = configer.nms_method
+        self.tile_rows = configer.tile_rows
+        self.tile_cols = configer.tile_cols
+        self.tile_overlap = configer.tile_overlap
+        self.tile_full_frame = configer.tile_full_frame
+
+    def warm_up(self):
+        self.backend.warm_up()
 
-    def detect(self, image: np.ndarray, is_cv2=True):
+    def is_tiled(self) -> bool:
+        return self.tile_rows * self.tile_cols > 1
+
+    def detect(self, image: np.ndarray, is_cv2=True) -> DetectResult:
+        if self.is_tiled():
+            return self.detect_tiled(image, is_cv2=is_cv2)
+        return self.detect_batch([image], is_cv2=is_cv2)[0]
+
+    def detect_tiled(self, image: np.ndarray, is_cv2=True) -> DetectResult:
+        """
+        all tiles run as one batch, boxes are mapped back to the frame and merged by a cross-tile NMS
+        """
         height, width = image.shape[:2]
-        data = self.normalization(image, is_cv2=is_cv2)
-        pred = self.model(data)
-        batch_size, num_boxes = pred.shape[:2]
-
-        nms_boxes, nms_scores, nms_classes, valid_detections = tf.image.combined_non_max_suppression(
-            boxes=tf.reshape(pred[:, :, :4], (batch_size, num_boxes, 1, 4)),
-            scores=pred[:, :, 4:],
-            max_output_size_per_class=self.max_output_size_per_class,
-            max_total_size=self.max_total_size,
-            iou_threshold=self.iou_threshold,
-            score_threshold=self.score_threshold,
+        regions = tile_regions(width, height, self.tile_rows, self.tile_cols, self.tile_overlap)
+        if self.tile_full_frame:
+            # objects larger than a tile are only found on the full frame
+            regions.insert(0, (0, 0, width, height))
+        batch = np.concatenate([
+            self.normalization(image[y1:y2, x1:x2], is_cv2=is_cv2)
+            for x1, y1, x2, y2 in regions
+        ])
+        pred_xywh, pred_prob = self.backend.infer(batch)
+
+        tile_boxes = []
+        tile_scores = []
+        tile_class_ids = []
+        for (x1, y1, x2, y2), xywh, prob in zip(regions, pred_xywh, pred_prob):
+            boxes, scores, class_ids = filter_boxes(xywh, prob, self.score_threshold)
+            scale = np.array(((x2 - x1) / self.size, (y2 - y1) / self.size) * 2, dtype=np.float32)
+            offset = np.array((x1, y1) * 2, dtype=np.float32)
+            tile_boxes.append(boxes * scale + offset)
+            tile_scores.append(scores)
+            tile_class_ids.append(class_ids)
+        boxes = np.clip(np.concatenate(tile_boxes), 0, (width, height, width, height))
+        scores = np.concatenate(tile_scores)
+        class_ids = np.concatenate(tile_class_ids)
+        keep, scores = suppress(
+            boxes,
+            scores,
+            class_ids,
+            self.iou_threshold,
+            self.max_output_size_per_class,
+            self.max_total_size,
+            self.nms_method,
+            self.score_threshold
         )
-        valid_detections = valid_detections[0]
-        nms_boxes = tf.reshape(nms_boxes, (-1, 4))
-        nms_classes = tf.reshape(nms_classes, (-1, 1))
-        nms_scores = tf.reshape(nms_scores, (-1))[:valid_detections].numpy().tolist()
-
-        valid_data = tf.concat(
-            (nms_boxes, nms_classes),
-            axis=1
-        )[:valid_detections]
-        result = np.empty(valid_data.shape, dtype=np.int)
-        for index, valid in enumerate(valid_data):
-            # pred boxes = [y1, x1, y2, x2]
-            # true boxes = [x1, y1, x2, y2]
-            result[index][0] = valid[1] * width
-            result[index][1] = valid[0] * height
-            result[index][2] = valid[3] * width
-            result[index][3] = valid[2] * height
-            result[index][4] = valid[4]
-
-        return DetectResult(boxes=result.tolist(), scores=nms_scores, classes=self.classes)
+        result = np.empty((len(keep), 5), dtype=np.int64)
+        result[:, :4] = boxes[keep]
+        result[:, 4] = class_ids[keep]
+        return DetectResult(boxes=result, scores=scores, classes=self.classes)
+
+    def detect_batch(self, images: List[np.ndarray], is_cv2=True) -> List[DetectResult]:
+        batch = np.concatenate([self.normalization(image, is_cv2=is_cv2) for image in images])
+        pred_xywh, pred_prob = self.backend.infer(batch)
+        results = []
+        for image, xywh, prob in zip(images, pred_xywh, pred_prob):
+            height, width = image.shape[:2]
+            boxes, scores = postprocess(
+                xywh,
+                prob,
+                self.size,
+                width,
+                height,
+                self.score_threshold,
+                self.iou_threshold,
+                self.max_output_size_per_class,
+                self.max_total_size,
+                self.nms_method
+            )
+            results.append(DetectResult(boxes=boxes, scores=scores, classes=self.classes))
+        return results
+
+    def release(self):
+        self.backend.release()
 
     def normalization(self, image: np.ndarray, is_cv2=True) -> np.ndarray:
         if is_cv2:
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-        return cv2.resize(image, (self.size, self.size))[np.newaxis, :] / 255.
+        return (cv2.resize(image, (self.size, self.size))[np.newaxis, :] / 255.).astype(np.float32)
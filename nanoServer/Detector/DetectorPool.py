@@ -0,0 +1,334 @@
+import os
+import numpy as np
+import logging as log
+import multiprocessing as mp
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple, Union
+from ..RepeatTimer import RepeatTimer
+from .core.configer import YOLOConfiger
+from .DetectCache import DetectCache, Signature
+from .DetectResult import DetectResult
+from .ConfigManager import ConfigManager, load_configer
+from .ConfigManagerInterface import ConfigManagerInterface
+
+DETECT = 'DETECT'
+SET_CONFIG = 'SET_CONFIG'
+RESET = 'RESET'
+CLOSE = 'CLOSE'
+CONFIG = 'CONFIG'
+
+
+def worker_loop(
+        worker_id: int,
+        configs_dir: str,
+        shm_name: str,
+        num_slots: int,
+        slot_size: int,
+        num_threads: int,
+        tasks,
+        results,
+        log_level=log.INFO,
+        is_show_exc_info=False
+):
+    """
+    entry of a worker process, the worker owns one ConfigManager and reads
+    images from the shared memory slot named by each DETECT task
+    """
+    log.basicConfig(
+        format=f'%(asctime)s %(levelname)s:[Worker-{worker_id}] %(message)s',
+        datefmt='%Y/%m/%d %H:%M:%S',
+        level=log_level,
+    )
+    shm = SharedMemory(name=shm_name)
+    slots = np.ndarray((num_slots, slot_size), dtype=np.uint8, buffer=shm.buf)
+    # the cores are shared by all workers
+    manager = ConfigManager(configs_dir, is_show_exc_info, cache_size=0, num_threads=num_threads)
+    config_name = None
+    try:
+        while True:
+            try:
+                task = tasks.get(True, 0.5)
+            except Empty:
+                task = None
+
+            configer = manager.get_config()
+            name = None if configer is None else configer.name
+            if name != config_name:
+                config_name = name
+                results.put((CONFIG, worker_id, config_name))
+            if task is None:
+                continue
+
+            cmd = task[0]
+            if cmd == DETECT:
+                _, request_id, slot, shape, is_cv2 = task
+                image = slots[slot, :int(np.prod(shape))].reshape(shape)
+                detect_result = manager.detect(image, is_cv2=is_cv2)
+                results.put((
+                    DETECT,
+                    request_id,
+                    detect_result.xyxy,
+                    detect_result.class_ids,
+                    detect_result.scores,
+                    detect_result.classes
+                ))
+            elif cmd == SET_CONFIG:
+                manager.set_config(task[1])
+            elif cmd == RESET:
+                manager.reset()
+            elif cmd == CLOSE:
+                manager.close()
+                break
+    finally:
+        del slots
+        shm.close()
+
+
+class DetectorPool(ConfigManagerInterface):
+    """
+    K worker processes, each with its own copy of the model. The front process
+    copies decoded images into shared memory ring slots and sends only the slot
+    index, detect_async() resolves when a worker posts the result.
+    A watchdog checks the workers every check_interval seconds, requests of a
+    dead worker resolve to an empty result and new requests skip it.
+    """
+
+    def __init__(
+            self,
+            configs_dir: Union[Path, str],
+            num_workers=2,
+            slots_per_worker=2,
+            max_width=1920,
+            max_height=1080,
+            timeout=10.,
+            is_show_exc_info=True,
+            cache_size=16,
+            cache_ttl=1.,
+            cache_distance=4,
+            check_interval=0.5
+    ):
+        if num_workers < 1:
+            raise ValueError('num_workers must greater than 0')
+        self.configer_group: Dict[str, YOLOConfiger] = load_configer(configs_dir)
+        self.configer: Optional[YOLOConfiger] = None
+        self.num_workers = num_workers
+        self.num_slots = num_workers * slots_per_worker
+        self.slot_size = max_width * max_height * 3
+        self.timeout = timeout
+        self.is_show_exc_info = is_show_exc_info
+        self.cache = DetectCache(cache_size, cache_ttl, cache_distance)
+        self.lock = Lock()
+        self.shm = SharedMemory(create=True, size=self.num_slots * self.slot_size)
+        self.slots = np.ndarray((self.num_slots, self.slot_size), dtype=np.uint8, buffer=self.shm.buf)
+        self.free_slots = Queue()
+        for slot in range(self.num_slots):
+            self.free_slots.put(slot)
+        self.futures: Dict[int, Tuple[Future, int, int]] = {}
+        self.in_flight = [0] * num_workers
+        self.loaded_configs: List[Optional[str]] = [None] * num_workers
+        self.request_id = 0
+        self.is_running = True
+
+        # TF is not fork safe, workers start from a fresh interpreter
+        context = mp.get_context('spawn')
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(num_workers)]
+        num_threads = max((os.cpu_count() or 1) // num_workers, 1)
+        self.workers = [
+            context.Process(
+                target=worker_loop,
+                args=(
+                    worker_id,
+                    str(configs_dir),
+                    self.shm.name,
+                    self.num_slots,
+                    self.slot_size,
+                    num_threads,
+                    self.tasks[worker_id],
+                    self.results,
+                    log.getLogger().getEffectiveLevel(),
+                    is_show_exc_info
+                ),
+                name=f'DetectWorker-{worker_id}',
+                daemon=True
+            )
+            for worker_id in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.collector = Thread(target=self.__collecting, name='PoolCollector', daemon=True)
+        self.collector.start()
+        self.watchdog = RepeatTimer(self.check_workers, interval=check_interval, name='PoolWatchdog')
+        self.watchdog.daemon = True
+        self.watchdog.start()
+
+    def __str__(self):
+        with self.lock:
+            configer = self.configer
+            in_flight = sum(self.in_flight)
+            alive = sum(worker.is_alive() for worker in self.workers)
+        s = f'Detector pool workers: {alive}/{self.num_workers}, in flight: {in_flight}'
+        if configer is None:
+            s += '\n**No Configer Selected**'
+        else:
+            s += '\nSize: %d, Classes: %s, Score Threshold: %f' % (
+                configer.size,
+                configer.classes,
+                configer.score_threshold
+            )
+        if self.cache.is_enable():
+            s += '\n' + str(self.cache)
+        return s
+
+    def __collecting(self):
+        while self.is_running:
+            try:
+                message = self.results.get(True, 0.5)
+            except Empty:
+                continue
+            except (EOFError, OSError):
+                return
+
+            if message[0] == CONFIG:
+                _, worker_id, config_name = message
+                with self.lock:
+                    self.loaded_configs[worker_id] = config_name
+                    # the pool switches model once every living worker has swapped
+                    if all(
+                            name == config_name
+                            for worker, name in zip(self.workers, self.loaded_configs)
+                            if worker.is_alive()
+                    ):
+                        self.configer = self.configer_group.get(config_name)
+                        self.cache.clear()
+                continue
+
+            _, request_id, xyxy, class_ids, scores, classes = message
+            with self.lock:
+                item = self.futures.pop(request_id, None)
+                if item is None:
+                    continue
+                future, worker_id, slot = item
+                self.in_flight[worker_id] -= 1
+            self.free_slots.put(slot)
+            future.set_result(DetectResult.from_arrays(xyxy, class_ids, scores, classes))
+
+    def check_workers(self):
+        """
+        requests of a dead worker resolve to an empty result
+        """
+        with self.lock:
+            dead = {worker_id for worker_id, worker in enumerate(self.workers) if not worker.is_alive()}
+            if not dead:
+                return
+            lost = [
+                (request_id, future, slot)
+                for request_id, (future, worker_id, slot) in self.futures.items()
+                if worker_id in dead
+            ]
+            for request_id, _, _ in lost:
+                self.futures.pop(request_id)
+            for worker_id in dead:
+                self.in_flight[worker_id] = 0
+        for request_id, future, slot in lost:
+            log.error(f'Detect worker died, drop request {request_id}')
+            self.free_slots.put(slot)
+            future.set_result(DetectResult())
+
+    def detect_async(self, image: np.ndarray, is_cv2=True) -> Future:
+        future = Future()
+        signature = None
+        if self.cache.is_enable():
+            signature = self.cache.signature(image)
+            with self.lock:
+                cached_result = self.cache.get(signature) if self.configer is not None else None
+            if cached_result is not None:
+                future.set_result(cached_result)
+                return future
+
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        if image.nbytes > self.slot_size:
+            log.warning(f'Image shape {image.shape} exceeds the shared memory slot')
+            future.set_result(DetectResult())
+            return future
+        try:
+            slot = self.free_slots.get(True, self.timeout)
+        except Empty:
+            log.warning('No free shared memory slot')
+            future.set_result(DetectResult())
+            return future
+
+        self.slots[slot, :image.nbytes] = image.reshape(-1)
+        with self.lock:
+            self.request_id += 1
+            request_id = self.request_id
+            alive = [worker_id for worker_id, worker in enumerate(self.workers) if worker.is_alive()]
+            if alive:
+                worker_id = min(alive, key=self.in_flight.__getitem__)
+                self.in_flight[worker_id] += 1
+                self.futures[request_id] = (future, worker_id, slot)
+            configer = self.configer
+        if not alive:
+            log.error('No detect worker alive')
+            self.free_slots.put(slot)
+            future.set_result(DetectResult())
+            return future
+        if signature is not None:
+            future.add_done_callback(lambda f: self.cache_result(signature, configer, f.result()))
+        self.tasks[worker_id].put((DETECT, request_id, slot, image.shape, is_cv2))
+        return future
+
+    def cache_result(self, signature: Signature, configer: Optional[YOLOConfiger], detect_result: DetectResult):
+        with self.lock:
+            # a result of a swapped out model must not reach the cache
+            if configer is not None and self.configer is configer:
+                self.cache.put(signature, detect_result)
+
+    def detect(self, image: np.ndarray, is_cv2=True) -> DetectResult:
+        try:
+            return self.detect_async(image, is_cv2).result(self.timeout)
+        except Exception:
+            log.error(f'Detect image fail', exc_info=self.is_show_exc_info)
+            return DetectResult()
+
+    def broadcast(self, task: tuple):
+        for tasks in self.tasks:
+            tasks.put(task)
+
+    def set_config(self, config_name):
+        if config_name not in self.configer_group:
+            log.warning(f'Config not exist: {config_name}')
+            return
+        log.info(f'Load model {config_name} on {self.num_workers} workers')
+        self.broadcast((SET_CONFIG, config_name))
+
+    def reset(self):
+        self.broadcast((RESET,))
+
+    def close(self):
+        if not self.is_running:
+            return
+        self.watchdog.close()
+        self.broadcast((CLOSE,))
+        for worker in self.workers:
+            worker.join(self.timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self.is_running = False
+        self.collector.join()
+        self.check_workers()
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
+        self.configer_group = {}
+
+    def get_configs(self) -> Dict[str, YOLOConfiger]:
+        return self.configer_group
+
+    def get_config(self) -> Optional[YOLOConfiger]:
+        with self.lock:
+            return self.configer
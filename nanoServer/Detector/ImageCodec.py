@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+from base64 import b64decode
+from typing import Optional, Tuple
+
+RAW = 'RAW'
+JPEG = 'JPEG'
+ENCODINGS = (RAW, JPEG)
+
+# decoded size divisor -> imread flag, libjpeg scales the DCT instead of decoding every pixel
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+# start of frame markers, 0xC4 / 0xC8 / 0xCC share the range but are not frames
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(buf) -> Optional[Tuple[int, int]]:
+    """
+    reads the frame header only
+    :return: width, height or None if buf is not a JPEG
+    """
+    buf = memoryview(buf).cast('B')
+    if len(buf) < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= len(buf):
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            if i + 9 > len(buf):
+                return None
+            height = (buf[i + 5] << 8) | buf[i + 6]
+            width = (buf[i + 7] << 8) | buf[i + 8]
+            return width, height
+        i += 2 + ((buf[i + 2] << 8) | buf[i + 3])
+    return None
+
+
+def reduced_flag(width: int, height: int, size: Optional[int]) -> Tuple[int, int]:
+    """
+    the largest reduction that still keeps both sides at least the model input size
+    :return: imread flag, divisor
+    """
+    if size:
+        for divisor, flag in REDUCED_FLAGS:
+            if width >= size * divisor and height >= size * divisor:
+                return flag, divisor
+    return cv2.IMREAD_COLOR, 1
+
+
+def decode_jpeg(buf, size: Optional[int] = None) -> Tuple[Optional[np.ndarray], Tuple[float, float]]:
+    """
+    :param size: model input size, a JPEG much larger than it is decoded at 1/2, 1/4 or 1/8
+    :return: image, (x, y) scale from the decoded image to the JPEG pixels
+    """
+    flag = cv2.IMREAD_COLOR
+    jpeg_wh = jpeg_size(buf)
+    if jpeg_wh is not None:
+        flag, _ = reduced_flag(*jpeg_wh, size)
+    image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), flag)
+    if image is None or jpeg_wh is None or flag == cv2.IMREAD_COLOR:
+        return image, (1., 1.)
+    height, width = image.shape[:2]
+    return image, (jpeg_wh[0] / width, jpeg_wh[1] / height)
+
+
+def decode_raw(buf, shape) -> np.ndarray:
+    """
+    uint8 BGR pixels, the array shares memory with buf
+    """
+    shape = tuple(int(s) for s in shape)
+    if len(shape) != 3 or shape[2] != 3:
+        raise ValueError(f'Raw image must be (height, width, 3), got {shape}')
+    return np.frombuffer(buf, dtype=np.uint8, count=int(np.prod(shape))).reshape(shape)
+
+
+def decode_message(message: dict, payload=None, size: Optional[int] = None):
+    """
+    image of a DETECT message, from the binary payload or the BASE64 IMAGE of older clients
+    :return: image or None, (x, y) scale from the image to the pixels the client sent
+    """
+    if payload is None:
+        b64image = message.get('IMAGE', '')
+        if len(b64image) < 1:
+            return None, (1., 1.)
+        return decode_jpeg(b64decode(b64image), size)
+    encoding = message.get('ENCODING', JPEG)
+    if encoding == RAW:
+        return decode_raw(payload, message.get('SHAPE', ())), (1., 1.)
+    if encoding == JPEG:
+        return decode_jpeg(payload, size)
+    raise ValueError(f'Unknown image encoding {encoding}, must be one of {ENCODINGS}')
+
+
+def encode_image(image: np.ndarray, size: int, encoding=JPEG, quality=90) -> Tuple[dict, bytes, Tuple[float, float]]:
+    """
+    shrinks the image to the model input size first, the model squashes it to
+    size x size anyway, so sending more pixels only costs bandwidth
+    :return: DETECT fields, payload, (x, y) scale from the sent image to the original
+    """
+    height, width = image.shape[:2]
+    sent_w, sent_h = min(width, size), min(height, size)
+    if (sent_w, sent_h) != (width, height):
+        image = cv2.resize(image, (sent_w, sent_h), interpolation=cv2.INTER_AREA)
+    scale = (width / sent_w, height / sent_h)
+    if encoding == RAW:
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        return {'ENCODING': RAW, 'SHAPE': list(image.shape)}, image.data, scale
+    if encoding == JPEG:
+        ret, jpg = cv2.imencode('.jpg', image, (cv2.IMWRITE_JPEG_QUALITY, int(quality)))
+        if not ret:
+            raise RuntimeError('JPEG encode fail')
+        return {'ENCODING': JPEG}, jpg.data, scale
+    raise ValueError(f'Unknown image encoding {encoding}, must be one of {ENCODINGS}')
@@ -0,0 +1,24 @@
+import gc
+import numpy as np
+from typing import Tuple
+from .core.configer import YOLOConfiger
+from .core.models import load_inference_model
+from .BackendInterface import BackendInterface
+
+
+class KerasBackend(BackendInterface):
+    def __init__(self, configer: YOLOConfiger):
+        BackendInterface.__init__(self, configer)
+        self.model = None
+
+    def load(self):
+        # deserialized from the SavedModel cache beside the weights after the first build
+        self.model = load_inference_model(self.configer)
+
+    def infer(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        pred_xywh, pred_prob = self.model(batch)
+        return pred_xywh.numpy(), pred_prob.numpy()
+
+    def release(self):
+        self.model = None
+        gc.collect()
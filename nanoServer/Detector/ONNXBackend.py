@@ -0,0 +1,29 @@
+import numpy as np
+import onnxruntime as ort
+from typing import Tuple
+from .core.configer import YOLOConfiger
+from .BackendInterface import BackendInterface, split_outputs
+
+
+class ONNXBackend(BackendInterface):
+    def __init__(self, configer: YOLOConfiger):
+        BackendInterface.__init__(self, configer)
+        self.session = None
+        self.input_name = None
+
+    def load(self):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.configer.num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            self.configer.model_path,
+            sess_options=options,
+            providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def infer(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return split_outputs(self.session.run(None, {self.input_name: batch.astype(np.float32)}))
+
+    def release(self):
+        self.session = None
@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+from typing import Tuple
+from .core.configer import YOLOConfiger
+from .core.postprocess import YOLODecoder
+from .BackendInterface import BackendInterface
+
+
+class OpenCVBackend(BackendInterface):
+    """
+    runs the raw YOLO heads exported by convert_model.py --format opencv,
+    the box decoder is not in the graph and runs in NumPy
+    """
+
+    def __init__(self, configer: YOLOConfiger):
+        BackendInterface.__init__(self, configer)
+        self.decoder = YOLODecoder(configer)
+        self.net = None
+        self.output_names = None
+
+    def load(self):
+        cv2.setNumThreads(self.configer.num_threads)
+        self.net = cv2.dnn.readNetFromONNX(self.configer.model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.output_names = self.net.getUnconnectedOutLayersNames()
+
+    def infer(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # the exported graph is fixed to batch size 1
+        pred_xywh = []
+        pred_prob = []
+        for data in batch:
+            self.net.setInput(data[np.newaxis].astype(np.float32))
+            feature_maps = self.net.forward(self.output_names)
+            # output layer order is not kept, the decoder wants the largest grid first
+            feature_maps = sorted(feature_maps, key=lambda fm: fm.shape[1], reverse=True)
+            xywh, prob = self.decoder.decode(feature_maps)
+            pred_xywh.append(xywh)
+            pred_prob.append(prob)
+        return np.concatenate(pred_xywh), np.concatenate(pred_prob)
+
+    def release(self):
+        self.net = None
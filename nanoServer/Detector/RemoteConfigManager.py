@@ -1,16 +1,30 @@
 import cv2
 import numpy as np
 import logging as log
-from typing import Dict, Optional
 from base64 import b64encode
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import perf_counter
+from typing import Dict, Optional
 from .ConfigManagerInterface import ConfigManagerInterface
 from .DetectResult import DetectResult
 from .ConfigManagerAPI import SET_CONFIG, DETECT, RESET, CLOSE, GET_CONFIG, GET_CONFIGS
+from .ImageCodec import JPEG, ENCODINGS, encode_image
 from .core import YOLOConfiger
+from ..CircuitBreaker import CircuitBreaker
 from ..Client import Client
 
-image_resize_w = 416
-image_resize_h = 416
+# servers without a binary channel get this size as BASE64 JPEG
+legacy_image_size = 416
+
+
+def time_left(expire_time: float) -> float:
+    """
+    :raise ConnectionError: the deadline passed
+    """
+    remaining = expire_time - perf_counter()
+    if remaining <= 0:
+        raise ConnectionError('Remote detect deadline passed')
+    return remaining
 
 
 def encode_b64image(image: np.ndarray, width, height) -> str:
@@ -20,49 +34,174 @@ def encode_b64image(image: np.ndarray, width, height) -> str:
 
 
 class RemoteConfigManager(ConfigManagerInterface):
-    def __init__(self, ip, port, timeout, is_show_exc_info):
-        self.client = Client(ip, port, timeout, is_show_exc_info)
+    """
+    DETECT requests run one at a time on a sender thread, detect_async() resolves
+    by the request deadline. A late or failed request counts against a circuit
+    breaker, while it is open no request is sent. Late, failed and rejected
+    requests are answered by the optional local fallback manager, otherwise empty.
+    """
+
+    def __init__(
+            self,
+            ip,
+            port,
+            timeout,
+            is_show_exc_info,
+            image_encoding=JPEG,
+            jpeg_quality=90,
+            deadline: Optional[float] = None,
+            failure_threshold=3,
+            retry_interval=5.,
+            fallback: Optional[ConfigManagerInterface] = None
+    ):
+        """
+        :param image_encoding: JPEG or RAW pixels, RAW skips both codecs at ~size*size*3 bytes per frame
+        :param jpeg_quality: 0 - 100
+        :param deadline: seconds a detect request may take, timeout if None
+        :param failure_threshold: failures in a row that open the circuit breaker
+        :param retry_interval: seconds the breaker stays open before a probe request
+        :param fallback: local manager answering while the remote is late or down
+        """
+        if image_encoding not in ENCODINGS:
+            raise ValueError(f'Unknown image encoding {image_encoding}, must be one of {ENCODINGS}')
+        self.client = Client(ip, port, timeout, is_show_exc_info, max_backoff=retry_interval)
         self.is_show_exc_info = is_show_exc_info
+        self.image_encoding = image_encoding
+        self.jpeg_quality = jpeg_quality
+        self.deadline = timeout if deadline is None else deadline
+        self.breaker = CircuitBreaker(failure_threshold, retry_interval, name='Remote detector')
+        self.fallback = fallback
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='RemoteDetect')
+        self.classes = []
+        self.class_version = None
+        # negotiated by the first GET_CONFIG, the size follows the SIZE of every result
+        self.input_size: Optional[int] = None
+        self.server_encodings = ()
 
     def __str__(self):
-        return 'Remote Detector address => %s:%s' % (self.client.ip, self.client.port)
+        s = 'Remote Detector address => %s:%s\n%s' % (self.client.ip, self.client.port, self.breaker)
+        if self.fallback is not None:
+            s += '\nFallback: ' + str(self.fallback)
+        return s
 
     def set_config(self, config_name):
         cmd = SET_CONFIG.copy()
         cmd['CONFIG_NAME'] = config_name
         self.client.send(cmd)
 
+    def negotiate(self, timeout: Optional[float] = None):
+        config = self.client.send_and_recv(GET_CONFIG.copy(), timeout)
+        if not config:
+            # tried again on the next frame
+            return
+        self.server_encodings = tuple(config.get('ENCODINGS', ()))
+        self.input_size = config.get('SIZE') or legacy_image_size
+        if self.server_encodings and self.image_encoding not in self.server_encodings:
+            log.warning(f'Detect server does not accept {self.image_encoding} images, use {JPEG}')
+            self.image_encoding = JPEG
+
     def detect(self, image: np.ndarray) -> DetectResult:
-        original_h, original_w = image.shape[:2]
-        cmd = DETECT.copy()
-        cmd['IMAGE'] = encode_b64image(image, image_resize_w, image_resize_h)
-        result = self.client.send_and_recv(cmd)
-        bbox = result.get('BBOX', [])
-        scores = result.get('SCORE', [])
-        classes = result.get('CLASS', [])
-        x_scale = original_w / image_resize_w
-        y_scale = original_h / image_resize_h
-        real_boxes = [
-            [
-                round(box[0] * x_scale),
-                round(box[1] * y_scale),
-                round(box[2] * x_scale),
-                round(box[3] * y_scale),
-                box[4]
-            ]
-            for box in bbox
-        ]
-        detect_result = DetectResult(boxes=real_boxes, scores=scores, classes=classes)
+        return self.detect_async(image).result()
+
+    def detect_async(self, image: np.ndarray, deadline: Optional[float] = None) -> Future:
+        """
+        :param deadline: seconds from now, the deadline of the manager if None
+        """
+        expire_time = perf_counter() + (self.deadline if deadline is None else deadline)
+        return self.executor.submit(self.__detecting, image, expire_time)
+
+    def __detecting(self, image: np.ndarray, expire_time: float) -> DetectResult:
+        remaining = expire_time - perf_counter()
+        # a request that waited past its deadline is not worth sending
+        if remaining <= 0 or not self.breaker.allow():
+            return self.fallback_detect(image)
+        try:
+            detect_result = self.remote_detect(image, remaining)
+        except ConnectionError:
+            self.breaker.record_failure()
+            return self.fallback_detect(image)
+        except Exception:
+            # a half open probe must finish, otherwise the breaker never closes again
+            log.error('Remote detect error', exc_info=True)
+            self.breaker.record_failure()
+            return self.fallback_detect(image)
+        self.breaker.record_success()
         return detect_result
 
+    def remote_detect(self, image: np.ndarray, timeout: Optional[float] = None) -> DetectResult:
+        """
+        :param timeout: of the whole detect, every exchange gets what is left, the client timeout if None
+        :raise ConnectionError: no answer within timeout
+        """
+        expire_time = perf_counter() + (self.client.time_out if timeout is None else timeout)
+        if self.input_size is None:
+            self.negotiate(time_left(expire_time))
+            if self.input_size is None:
+                raise ConnectionError('Get config of detect server fail')
+        cmd = DETECT.copy()
+        cmd['FORMAT'] = 'BINARY'
+        if self.server_encodings:
+            fields, payload, scale = encode_image(image, self.input_size, self.image_encoding, self.jpeg_quality)
+            cmd.update(fields)
+            del cmd['IMAGE']
+            result = self.client.send_binary_and_recv(cmd, payload, time_left(expire_time))
+        else:
+            original_h, original_w = image.shape[:2]
+            cmd['IMAGE'] = encode_b64image(image, legacy_image_size, legacy_image_size)
+            scale = (original_w / legacy_image_size, original_h / legacy_image_size)
+            result = self.client.send_and_recv(cmd, time_left(expire_time))
+        if not result:
+            # every answer has a CMD, an empty one is a dropped connection or a timeout
+            raise ConnectionError('Remote detect fail')
+        if result.get('SIZE'):
+            # the next frame follows a model swap on the server
+            self.input_size = result['SIZE']
+        blob = result.get('RESULT')
+        if blob is None:
+            # a server without the binary format answers with JSON arrays
+            detect_result = DetectResult(
+                boxes=result.get('BBOX', []),
+                scores=result.get('SCORE', []),
+                classes=result.get('CLASS', [])
+            )
+        else:
+            detect_result, class_version = DetectResult.from_b64(blob)
+            detect_result.classes = self.get_classes(class_version, time_left(expire_time))
+        return detect_result.scaled(*scale)
+
+    def fallback_detect(self, image: np.ndarray) -> DetectResult:
+        if self.fallback is None:
+            return DetectResult()
+        try:
+            return self.fallback.detect(image)
+        except Exception:
+            log.error('Fallback detect fail', exc_info=self.is_show_exc_info)
+            return DetectResult()
+
+    def get_classes(self, class_version: int, timeout: Optional[float] = None):
+        """
+        the class table is fetched once per version
+        :raise ConnectionError: no answer within timeout, the table is fetched again next time
+        """
+        if class_version != self.class_version:
+            config = self.client.send_and_recv(GET_CONFIG.copy(), timeout)
+            if not config:
+                raise ConnectionError('Get class table of detect server fail')
+            self.classes = config.get('CLASSES', [])
+            self.class_version = config.get('CLASS_VERSION')
+        return self.classes
+
     def reset(self):
         cmd = RESET.copy()
         self.client.send(cmd)
 
     def close(self):
+        self.executor.shutdown(True)
         cmd = CLOSE.copy()
         self.client.send(cmd)
         self.client.close()
+        if self.fallback is not None:
+            self.fallback.close()
 
     def get_configs(self) -> Dict[str, YOLOConfiger]:
         cmd = GET_CONFIGS.copy()
@@ -0,0 +1,58 @@
+import numpy as np
+from typing import Tuple
+from .core.configer import YOLOConfiger
+from .BackendInterface import BackendInterface, split_outputs
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    import tensorflow as tf
+
+    Interpreter = tf.lite.Interpreter
+
+
+class TFLiteBackend(BackendInterface):
+    def __init__(self, configer: YOLOConfiger):
+        BackendInterface.__init__(self, configer)
+        self.interpreter = None
+        self.input_detail = None
+        self.output_details = None
+
+    def load(self):
+        self.interpreter = Interpreter(model_path=self.configer.model_path, num_threads=self.configer.num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()
+
+    def infer(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # decode_tflite is built for a single image, run the batch image by image
+        pred_xywh = []
+        pred_prob = []
+        for data in batch:
+            self.interpreter.set_tensor(self.input_detail['index'], self.quantize(data[np.newaxis], self.input_detail))
+            self.interpreter.invoke()
+            xywh, prob = split_outputs(
+                self.dequantize(self.interpreter.get_tensor(detail['index']), detail)
+                for detail in self.output_details
+            )
+            pred_xywh.append(xywh)
+            pred_prob.append(prob)
+        return np.concatenate(pred_xywh), np.concatenate(pred_prob)
+
+    def release(self):
+        self.interpreter = None
+
+    @staticmethod
+    def quantize(data: np.ndarray, detail: dict) -> np.ndarray:
+        dtype = detail['dtype']
+        if dtype == np.float32:
+            return data
+        scale, zero_point = detail['quantization']
+        return np.clip(np.round(data / scale + zero_point), np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+
+    @staticmethod
+    def dequantize(data: np.ndarray, detail: dict) -> np.ndarray:
+        if data.dtype == np.float32:
+            return data
+        scale, zero_point = detail['quantization']
+        return (data.astype(np.float32) - zero_point) * scale
@@ -35,7 +35,20 @@ class YOLOConfiger:
         self.max_total_size = self.config['max_total_size']
         self.iou_threshold = self.config['iou_threshold']
         self.score_threshold = self.config['score_threshold']
+        self.nms_method = self.config.get('nms_method', 'nms')
+        self.tile_rows = self.config.get('tile_rows', 1)
+        self.tile_cols = self.config.get('tile_cols', 1)
+        self.tile_overlap = self.config.get('tile_overlap', 0.2)
+        self.tile_full_frame = self.config.get('tile_full_frame', True)
+        self.cascade_config = self.config.get('cascade_config')
+        self.cascade_mode = self.config.get('cascade_mode', 'crop')
+        self.cascade_low = self.config.get('cascade_low', 0.3)
+        self.cascade_high = self.config.get('cascade_high', 0.6)
+        self.cascade_max_crops = self.config.get('cascade_max_crops', 4)
+        self.cascade_target_fps = self.config.get('cascade_target_fps', 10)
         self.logdir = self.config['logdir']
+        self.num_threads = self.config.get('num_threads', os.cpu_count())
+        self.model_cache = self.config.get('model_cache', True)
         self.classes = self.config['YOLO']['CLASSES']
         self.anchor_per_scale = self.config['YOLO']['ANCHOR_PER_SCALE']
         self.iou_loss_thresh = self.config['YOLO']['IOU_LOSS_THRESH']
@@ -78,12 +91,12 @@ class YOLOConfiger:
         self.fix_path()
 
     def fix_path(self):
-        self.model_path = os.path.join(*Path(self.model_path).parts)
-        self.weight_path = os.path.join(*Path(self.weight_path).parts)
-        self.train_annot_path = os.path.join(*Path(self.train_annot_path).parts)
-        self.test_annot_path = os.path.join(*Path(self.test_annot_path).parts)
+        self.model_path = fix_path(self.model_path)
+        self.weight_path = fix_path(self.weight_path)
+        self.train_annot_path = fix_path(self.train_annot_path)
+        self.test_annot_path = fix_path(self.test_annot_path)
         if self.pre_train_file_path is not None:
-            self.pre_train_file_path = os.path.join(*Path(self.pre_train_file_path).parts)
+            self.pre_train_file_path = fix_path(self.pre_train_file_path)
 
         self.config['model_path'] = self.model_path
         self.config['weight_path'] = self.weight_path
@@ -102,3 +115,13 @@ class YOLOConfiger:
     def save(self):
         with open(self.config_path, 'w') as f:
             json.dump(self.config, f)
+
+
+def fix_path(path: str) -> str:
+    """
+    separators of the current os, an empty path stays empty
+    """
+    parts = Path(path).parts
+    if not parts:
+        return path
+    return os.path.join(*parts)
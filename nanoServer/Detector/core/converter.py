@@ -0,0 +1,118 @@
+import cv2
+import json
+import logging as log
+import numpy as np
+import tensorflow as tf
+from pathlib import Path
+from typing import Union, Optional, Iterator, List
+from .configer import YOLOConfiger
+from .models import build_model, build_head_model
+
+TFLITE_QUANTIZE_TYPES = ('float32', 'float16', 'int8')
+EXPORT_FORMATS = ('tflite', 'onnx', 'opencv')
+_image_suffixes = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def copy_configer(configer: YOLOConfiger, **kwargs) -> YOLOConfiger:
+    config = json.loads(json.dumps(configer.config))
+    config.update(kwargs)
+    return YOLOConfiger(config)
+
+
+def list_images(image_dir: Union[str, Path]) -> List[Path]:
+    image_dir = Path(image_dir)
+    return sorted(p for p in image_dir.iterdir() if p.suffix.lower() in _image_suffixes)
+
+
+def calibration_dataset(configer: YOLOConfiger, calibration_dir: Union[str, Path], steps=100):
+    image_paths = list_images(calibration_dir)[:steps]
+    if len(image_paths) < 1:
+        raise FileNotFoundError(f'No calibration image in {calibration_dir}')
+    size = configer.size
+
+    def generator() -> Iterator[List[np.ndarray]]:
+        for image_path in image_paths:
+            image = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+            if image is None:
+                log.warning(f'Read calibration image {image_path} fail')
+                continue
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            image = cv2.resize(image, (size, size))[np.newaxis, :] / 255.
+            yield [image.astype(np.float32)]
+
+    return generator
+
+
+def export_tflite(
+        configer: YOLOConfiger,
+        output_path: Union[str, Path],
+        quantize='float16',
+        calibration_dir: Optional[Union[str, Path]] = None,
+        calibration_steps=100
+) -> Path:
+    if quantize not in TFLITE_QUANTIZE_TYPES:
+        raise ValueError(f'Quantize type must be one of {TFLITE_QUANTIZE_TYPES}')
+    if quantize == 'int8' and calibration_dir is None:
+        raise ValueError('int8 quantization need a calibration image folder')
+
+    tflite_configer = copy_configer(configer, frame_work='tflite')
+    model = build_model(tflite_configer, training=False)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = calibration_dataset(configer, calibration_dir, calibration_steps)
+        # ops without an int8 kernel (exp in the box decoder) fall back to float
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+        ]
+
+    tflite_model = converter.convert()
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_bytes(tflite_model)
+    log.info(f'Write {quantize} TFLite model to {output_path} ({len(tflite_model)} bytes)')
+    return output_path
+
+
+def write_runtime_config(
+        configer: YOLOConfiger,
+        name: str,
+        frame_work: str,
+        model_path: Union[str, Path],
+        config_path: Union[str, Path]
+) -> YOLOConfiger:
+    runtime_configer = copy_configer(configer, name=name, frame_work=frame_work, model_path=str(model_path))
+    runtime_configer.config_path = str(config_path)
+    Path(config_path).parent.mkdir(parents=True, exist_ok=True)
+    runtime_configer.save()
+    log.info(f'Write {frame_work} config to {config_path}')
+    return runtime_configer
+
+
+def export_onnx(
+        configer: YOLOConfiger,
+        output_path: Union[str, Path],
+        batch_size: Optional[int] = None,
+        opset=13,
+        is_head_only=False
+) -> Path:
+    """
+    :param is_head_only: export the raw heads only, the runtime decodes them with postprocess.YOLODecoder
+    """
+    import tf2onnx
+
+    if is_head_only:
+        model = build_head_model(configer)
+    else:
+        model = build_model(copy_configer(configer, frame_work='tf'), training=False, is_filter=False)
+    size = configer.size
+    input_signature = (tf.TensorSpec((batch_size, size, size, 3), tf.float32, name='input'),)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset, output_path=str(output_path))
+    log.info(f'Write ONNX model to {output_path}')
+    return output_path
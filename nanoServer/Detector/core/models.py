@@ -1,8 +1,23 @@
 from .yolov4 import YOLO, decode_train, decode, filter_boxes
 from .configer import YOLOConfiger
+from . import utils
+from pathlib import Path
+import os
+import json
+import shutil
+import hashlib
+import logging as log
 import tensorflow as tf
 
 
+def load_model_weights(model, configer: YOLOConfiger):
+    # darknet .weights go through the memory-mapped loader and its npz cache
+    if str(configer.weight_path).endswith('.weights'):
+        utils.load_weights(model, configer.weight_path, configer.model_type, configer.tiny)
+    else:
+        model.load_weights(configer.weight_path)
+
+
 def build_train_model(configer: YOLOConfiger):
     tiny = configer.tiny
     size = configer.size
@@ -40,7 +55,7 @@ def build_train_model(configer: YOLOConfiger):
     return tf.keras.Model(input_layer, bbox_tensors)
 
 
-def build_model(configer: YOLOConfiger, training=False):
+def build_model(configer: YOLOConfiger, training=False, is_filter=True, is_load_weights=True):
     if training:
         return build_train_model(configer)
 
@@ -50,7 +65,6 @@ def build_model(configer: YOLOConfiger, training=False):
     model_type = configer.model_type
     score_threshold = configer.score_threshold
     num_class = configer.num_class
-    weight_path = configer.weight_path
     strides = configer.strides
     anchors = configer.anchors
     xyscale = configer.xyscale
@@ -79,13 +93,85 @@ def build_model(configer: YOLOConfiger, training=False):
             prob_tensors.append(output_tensors[1])
     pred_bbox = tf.concat(bbox_tensors, axis=1)
     pred_prob = tf.concat(prob_tensors, axis=1)
-    if frame_work == 'tflite':
+    if frame_work == 'tflite' or not is_filter:
         pred = (pred_bbox, pred_prob)
     else:
         boxes, pred_conf = filter_boxes(pred_bbox, pred_prob, score_threshold=score_threshold,
                                         input_shape=tf.constant([size, size]))
         pred = tf.concat([boxes, pred_conf], axis=-1)
     model = tf.keras.Model(input_layer, pred)
-    model.load_weights(weight_path)
+    if is_load_weights:
+        load_model_weights(model, configer)
+
+    return model
+
+
+def build_head_model(configer: YOLOConfiger):
+    """
+    raw YOLO heads without the decoder, decode with postprocess.YOLODecoder
+    """
+    input_layer = tf.keras.layers.Input([configer.size, configer.size, 3])
+    feature_maps = YOLO(input_layer, configer.num_class, configer.model_type, configer.tiny)
+    model = tf.keras.Model(input_layer, feature_maps)
+    load_model_weights(model, configer)
 
     return model
+
+
+def inference_cache_path(configer: YOLOConfiger) -> Path:
+    """
+    SavedModel folder beside the weights, keyed by the config content and the weight file mtime
+    """
+    weight_path = Path(configer.weight_path)
+    stat = weight_path.stat()
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(json.dumps(configer.config, sort_keys=True).encode())
+    digest.update(f'{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return weight_path.parent / f'{configer.name}.{digest.hexdigest()}.savedmodel'
+
+
+def save_inference_model(model, configer: YOLOConfiger, path: Path):
+    module = tf.Module()
+    module.model = model
+    module.infer = tf.function(
+        lambda batch: model(batch, training=False),
+        input_signature=[tf.TensorSpec([None, configer.size, configer.size, 3], tf.float32)]
+    )
+    tmp_path = path.parent / f'{path.name}.{os.getpid()}.tmp'
+    tf.saved_model.save(module, str(tmp_path))
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # another detector process wrote the cache first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+    # caches of older configs or weights of this model
+    for stale_path in path.parent.glob(f'{configer.name}.*.savedmodel'):
+        if stale_path != path:
+            shutil.rmtree(stale_path, ignore_errors=True)
+
+
+def load_inference_model(configer: YOLOConfiger):
+    """
+    :return: function batch -> (pred_bbox, pred_prob), deserialized from the
+             SavedModel cache when it exists, otherwise built and cached
+    """
+    if not configer.model_cache:
+        model = build_model(configer, training=False, is_filter=False)
+        return lambda batch: model(batch, training=False)
+
+    path = inference_cache_path(configer)
+    if path.is_dir():
+        try:
+            return tf.saved_model.load(str(path)).infer
+        except Exception:
+            log.warning(f'Load model cache {path} fail, rebuild it', exc_info=True)
+            shutil.rmtree(path, ignore_errors=True)
+
+    model = build_model(configer, training=False, is_filter=False)
+    try:
+        save_inference_model(model, configer, path)
+        log.info(f'Write model cache {path}')
+    except Exception:
+        log.warning(f'Write model cache {path} fail', exc_info=True)
+    return lambda batch: model(batch, training=False)
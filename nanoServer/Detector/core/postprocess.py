@@ -0,0 +1,247 @@
+"""
+NumPy implementation of the inference tail of the TF model (decode -> filter -> NMS),
+lightweight runtimes use it without importing Tensorflow.
+boxes are [x1, y1, x2, y2] unless the name says xywh
+"""
+import numpy as np
+from typing import List, Tuple
+from .configer import YOLOConfiger
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1. / (1. + np.exp(-x))
+
+
+class YOLODecoder:
+    def __init__(self, configer: YOLOConfiger):
+        self.size = configer.size
+        self.num_class = configer.num_class
+        self.strides = np.array(configer.strides, dtype=np.float32)
+        self.anchors = np.array(configer.anchors, dtype=np.float32)
+        self.xyscale = np.array(configer.xyscale, dtype=np.float32)
+        self.output_sizes = [self.size // int(stride) for stride in configer.strides]
+        self.grids = []
+        for output_size in self.output_sizes:
+            x, y = np.meshgrid(np.arange(output_size), np.arange(output_size))
+            # [gy, gx, 1, 2] like yolov4.decode_tf
+            self.grids.append(np.stack((x, y), axis=-1)[:, :, np.newaxis, :].astype(np.float32))
+
+    def decode(self, feature_maps: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param feature_maps: raw heads (B, S, S, 3 * (5 + num_class)) sorted from the largest grid
+        :return: pred_xywh (B, N, 4) in model input pixels, pred_prob (B, N, num_class)
+        """
+        pred_xywh = []
+        pred_prob = []
+        for i, (fm, output_size, grid) in enumerate(zip(feature_maps, self.output_sizes, self.grids)):
+            batch_size = fm.shape[0]
+            fm = fm.reshape((batch_size, output_size, output_size, 3, 5 + self.num_class))
+            xyscale = self.xyscale[i]
+            xy = (sigmoid(fm[..., 0:2]) * xyscale - 0.5 * (xyscale - 1) + grid) * self.strides[i]
+            wh = np.exp(fm[..., 2:4]) * self.anchors[i]
+            prob = sigmoid(fm[..., 4:5]) * sigmoid(fm[..., 5:])
+            pred_xywh.append(np.concatenate((xy, wh), axis=-1).reshape((batch_size, -1, 4)))
+            pred_prob.append(prob.reshape((batch_size, -1, self.num_class)))
+        return np.concatenate(pred_xywh, axis=1), np.concatenate(pred_prob, axis=1)
+
+
+def xywh_to_xyxy(xywh: np.ndarray) -> np.ndarray:
+    half_wh = xywh[..., 2:4] / 2
+    return np.concatenate((xywh[..., 0:2] - half_wh, xywh[..., 0:2] + half_wh), axis=-1)
+
+
+def filter_boxes(
+        pred_xywh: np.ndarray,
+        pred_prob: np.ndarray,
+        score_threshold: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    every (box, class) pair over the threshold is a candidate, as in combined_non_max_suppression
+    :param pred_xywh: (N, 4)
+    :param pred_prob: (N, num_class)
+    :return: boxes (M, 4), scores (M,), class_ids (M,)
+    """
+    box_ids, class_ids = np.nonzero(pred_prob >= score_threshold)
+    return xywh_to_xyxy(pred_xywh[box_ids]), pred_prob[box_ids, class_ids], class_ids
+
+
+def box_area(boxes: np.ndarray) -> np.ndarray:
+    return (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    IoU of one box against (N, 4) boxes
+    """
+    left_up = np.maximum(box[:2], boxes[:, :2])
+    right_down = np.minimum(box[2:4], boxes[:, 2:4])
+    inter_section = np.maximum(right_down - left_up, 0.)
+    inter_area = inter_section[:, 0] * inter_section[:, 1]
+    union_area = box_area(box) + box_area(boxes) - inter_area
+    return np.divide(inter_area, union_area, out=np.zeros_like(inter_area), where=union_area > 0)
+
+
+def iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    left_up = np.maximum(boxes1[:, np.newaxis, :2], boxes2[np.newaxis, :, :2])
+    right_down = np.minimum(boxes1[:, np.newaxis, 2:4], boxes2[np.newaxis, :, 2:4])
+    inter_section = np.maximum(right_down - left_up, 0.)
+    inter_area = inter_section[..., 0] * inter_section[..., 1]
+    union_area = box_area(boxes1)[:, np.newaxis] + box_area(boxes2)[np.newaxis, :] - inter_area
+    return np.divide(inter_area, union_area, out=np.zeros_like(inter_area), where=union_area > 0)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, max_output_size=None) -> np.ndarray:
+    """
+    greedy NMS over a score-sorted suppression mask, each kept box suppresses
+    the remaining boxes in one vectorized IoU row
+    :return: indices of kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.empty((0,), dtype=np.int64)
+    order = np.argsort(-scores, kind='stable')
+    boxes = boxes[order]
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        if max_output_size is not None and len(keep) >= max_output_size:
+            break
+        rest = i + 1 + np.flatnonzero(~suppressed[i + 1:])
+        if len(rest) == 0:
+            break
+        suppressed[rest[box_iou(boxes[i], boxes[rest]) > iou_threshold]] = True
+    return order[np.array(keep, dtype=np.int64)]
+
+
+def soft_nms(
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        iou_threshold: float,
+        sigma=0.3,
+        score_threshold=0.001,
+        method='gaussian'
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    soft-nms, https://arxiv.org/pdf/1704.04503.pdf
+    :param method: 'gaussian' or 'linear'
+    :return: indices of kept boxes and their decayed scores, highest score first
+    """
+    if method not in ('gaussian', 'linear'):
+        raise ValueError('Soft-NMS method must be gaussian or linear')
+    scores = scores.astype(np.float32).copy()
+    alive = scores >= score_threshold
+    keep = []
+    keep_scores = []
+    while np.any(alive):
+        best = int(np.argmax(np.where(alive, scores, -np.inf)))
+        keep.append(best)
+        keep_scores.append(scores[best])
+        alive[best] = False
+        iou = box_iou(boxes[best], boxes)
+        if method == 'gaussian':
+            weight = np.exp(-(iou ** 2) / sigma)
+        else:
+            weight = np.where(iou > iou_threshold, 1 - iou, 1.)
+        scores = np.where(alive, scores * weight, scores)
+        alive &= scores >= score_threshold
+    return np.array(keep, dtype=np.int64), np.array(keep_scores, dtype=np.float32)
+
+
+def batched_nms(
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        class_ids: np.ndarray,
+        iou_threshold: float,
+        max_output_size_per_class=None,
+        max_total_size=None
+) -> np.ndarray:
+    """
+    class-aware NMS in one pass: every class is moved to its own coordinate area
+    so boxes of different classes never overlap
+    :return: indices of kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.empty((0,), dtype=np.int64)
+    boxes = boxes.astype(np.float64)
+    offset = class_ids[:, np.newaxis] * (boxes.max() - boxes.min() + 1)
+    keep = nms(boxes + offset, scores, iou_threshold)
+    if max_output_size_per_class is not None:
+        kept_classes = class_ids[keep]
+        rank = np.zeros(len(keep), dtype=np.int64)
+        for class_id in np.unique(kept_classes):
+            class_mask = kept_classes == class_id
+            rank[class_mask] = np.arange(np.count_nonzero(class_mask))
+        keep = keep[rank < max_output_size_per_class]
+    if max_total_size is not None:
+        keep = keep[:max_total_size]
+    return keep
+
+
+def batched_soft_nms(
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        class_ids: np.ndarray,
+        iou_threshold: float,
+        sigma=0.3,
+        score_threshold=0.001,
+        method='gaussian'
+) -> Tuple[np.ndarray, np.ndarray]:
+    if len(boxes) == 0:
+        return np.empty((0,), dtype=np.int64), np.empty((0,), dtype=np.float32)
+    boxes = boxes.astype(np.float64)
+    offset = class_ids[:, np.newaxis] * (boxes.max() - boxes.min() + 1)
+    return soft_nms(boxes + offset, scores, iou_threshold, sigma, score_threshold, method)
+
+
+def suppress(
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        class_ids: np.ndarray,
+        iou_threshold: float,
+        max_output_size_per_class: int,
+        max_total_size: int,
+        method='nms',
+        score_threshold=1e-3
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param method: 'nms' or 'soft-nms'
+    :param score_threshold: soft-nms drops boxes decayed under it
+    :return: indices of kept boxes and their scores
+    """
+    if method == 'soft-nms':
+        keep, scores = batched_soft_nms(boxes, scores, class_ids, iou_threshold, score_threshold=score_threshold)
+        return keep[:max_total_size], scores[:max_total_size]
+    keep = batched_nms(boxes, scores, class_ids, iou_threshold, max_output_size_per_class, max_total_size)
+    return keep, scores[keep]
+
+
+def postprocess(
+        pred_xywh: np.ndarray,
+        pred_prob: np.ndarray,
+        size: int,
+        width: int,
+        height: int,
+        score_threshold: float,
+        iou_threshold: float,
+        max_output_size_per_class: int,
+        max_total_size: int,
+        method='nms'
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param pred_xywh: (N, 4) in model input pixels
+    :param pred_prob: (N, num_class)
+    :param method: 'nms' or 'soft-nms'
+    :return: boxes (M, 5) [x1, y1, x2, y2, class_id] in image pixels clipped to the image, scores (M,)
+    """
+    boxes, scores, class_ids = filter_boxes(pred_xywh, pred_prob, score_threshold)
+    keep, scores = suppress(
+        boxes, scores, class_ids, iou_threshold, max_output_size_per_class, max_total_size, method, score_threshold
+    )
+    scale = np.array((width / size, height / size, width / size, height / size), dtype=np.float32)
+    result = np.empty((len(keep), 5), dtype=np.int64)
+    # the model input covers the image, clipped to it the boxes stay inside (0, 0, width, height)
+    result[:, :4] = np.clip(boxes[keep], 0, size) * scale
+    result[:, 4] = class_ids[keep]
+    return result, scores
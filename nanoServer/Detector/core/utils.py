@@ -1,6 +1,11 @@
+import os
 import cv2
+import hashlib
 import numpy as np
+import logging as log
 import tensorflow as tf
+from pathlib import Path
+from . import postprocess
 
 
 def load_freeze_layer(model='yolov4', tiny=False):
@@ -17,58 +22,128 @@ def load_freeze_layer(model='yolov4', tiny=False):
     return freeze_layouts
 
 
-def load_weights(model, weights_file, model_name='yolov4', is_tiny=False):
+def darknet_layer_size(model_name='yolov4', is_tiny=False):
+    """
+    :return: number of conv layers, conv layers with bias instead of batch norm
+    """
     if is_tiny:
         if model_name == 'yolov3':
-            layer_size = 13
-            output_pos = [9, 12]
-        else:
-            layer_size = 21
-            output_pos = [17, 20]
-    else:
-        if model_name == 'yolov3':
-            layer_size = 75
-            output_pos = [58, 66, 74]
-        else:
-            layer_size = 110
-            output_pos = [93, 101, 109]
-    wf = open(weights_file, 'rb')
-    major, minor, revision, seen, _ = np.fromfile(wf, dtype=np.int32, count=5)
+            return 13, [9, 12]
+        return 21, [17, 20]
+    if model_name == 'yolov3':
+        return 75, [58, 66, 74]
+    return 110, [93, 101, 109]
 
-    j = 0
-    for i in range(layer_size):
-        conv_layer_name = 'conv2d_%d' % i if i > 0 else 'conv2d'
-        bn_layer_name = 'batch_normalization_%d' % j if j > 0 else 'batch_normalization'
 
-        conv_layer = model.get_layer(conv_layer_name)
+def layers_in_creation_order(model, layer_type, prefix: str):
+    """
+    Keras names layers conv2d, conv2d_1, ... in the order they are created, which is
+    the darknet order. The numbers keep counting in a session that built models before.
+    """
+    layers = [layer for layer in model.layers if isinstance(layer, layer_type)]
+    return sorted(layers, key=lambda layer: int(layer.name[len(prefix) + 1:] or 0))
+
+
+def darknet_weight_plan(model, model_name='yolov4', is_tiny=False):
+    """
+    offsets of every layer in the darknet weight file, computed from the layer shapes
+
+    :return: list of (tf variables, offset, filters, kernel size, input dim, is_bn), total float count
+    """
+    layer_size, output_pos = darknet_layer_size(model_name, is_tiny)
+    conv_layers = layers_in_creation_order(model, tf.keras.layers.Conv2D, 'conv2d')
+    bn_layers = layers_in_creation_order(model, tf.keras.layers.BatchNormalization, 'batch_normalization')
+    if len(conv_layers) != layer_size:
+        raise ValueError(f'{model_name} needs {layer_size} conv layers, the model has {len(conv_layers)}')
+    plan = []
+    offset = 0
+    j = 0
+    for i, conv_layer in enumerate(conv_layers):
         filters = conv_layer.filters
         k_size = conv_layer.kernel_size[0]
         in_dim = conv_layer.input_shape[-1]
-
-        if i not in output_pos:
-            # darknet weights: [beta, gamma, mean, variance]
-            bn_weights = np.fromfile(wf, dtype=np.float32, count=4 * filters)
-            # tf weights: [gamma, beta, mean, variance]
-            bn_weights = bn_weights.reshape((4, filters))[[1, 0, 2, 3]]
-            bn_layer = model.get_layer(bn_layer_name)
+        is_bn = i not in output_pos
+        if is_bn:
+            bn_layer = bn_layers[j]
             j += 1
+            variables = conv_layer.weights + bn_layer.weights
         else:
-            conv_bias = np.fromfile(wf, dtype=np.float32, count=filters)
+            variables = conv_layer.weights
+        plan.append((variables, offset, filters, k_size, in_dim, is_bn))
+        # batch norm: 4 * filters, bias: filters
+        offset += (4 if is_bn else 1) * filters + filters * in_dim * k_size * k_size
+    return plan, offset
 
-        # darknet shape (out_dim, in_dim, height, width)
-        conv_shape = (filters, in_dim, k_size, k_size)
-        conv_weights = np.fromfile(wf, dtype=np.float32, count=np.product(conv_shape))
-        # tf shape (height, width, in_dim, out_dim)
-        conv_weights = conv_weights.reshape(conv_shape).transpose([2, 3, 1, 0])
 
-        if i not in output_pos:
-            conv_layer.set_weights([conv_weights])
-            bn_layer.set_weights(bn_weights)
+def convert_darknet_weights(weights_file, plan, total_size: int):
+    """
+    darknet layer [beta, gamma, mean, variance] (or [bias]), kernel (out_dim, in_dim, height, width)
+    -> tf [kernel (height, width, in_dim, out_dim), gamma, beta, mean, variance] (or [kernel, bias])
+    """
+    # header: major, minor, revision, seen
+    data = np.memmap(weights_file, dtype=np.float32, mode='r', offset=20, shape=(total_size,))
+    values = []
+    for variables, offset, filters, k_size, in_dim, is_bn in plan:
+        head_size = (4 if is_bn else 1) * filters
+        kernel = data[offset + head_size:offset + head_size + filters * in_dim * k_size * k_size]
+        values.append(np.ascontiguousarray(kernel.reshape((filters, in_dim, k_size, k_size)).transpose([2, 3, 1, 0])))
+        if is_bn:
+            values.extend(data[offset:offset + head_size].reshape((4, filters))[[1, 0, 2, 3]])
         else:
-            conv_layer.set_weights([conv_weights, conv_bias])
+            values.append(np.array(data[offset:offset + head_size]))
+    del data
+    return values
+
+
+def file_hash(file_path, chunk_size=1 << 24) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    # assert len(wf.read()) == 0, 'failed to read all data'
-    wf.close()
+
+def load_weights(model, weights_file, model_name='yolov4', is_tiny=False, cache_dir=None):
+    """
+    load darknet weights, the converted arrays are cached in an npz file beside
+    the weights (or in cache_dir) keyed by the weight file hash
+
+    :return: path of the cache file
+    """
+    plan, total_size = darknet_weight_plan(model, model_name, is_tiny)
+    variables = [variable for layer_variables, *_ in plan for variable in layer_variables]
+    weights_file = Path(weights_file)
+    cache_dir = weights_file.parent if cache_dir is None else Path(cache_dir)
+    cache_name = '%s.%s-%s%s.npz' % (weights_file.stem, file_hash(weights_file), model_name, '-tiny' if is_tiny else '')
+    cache_path = cache_dir / cache_name
+
+    values = None
+    if cache_path.is_file():
+        with np.load(cache_path) as cache:
+            if len(cache.files) == len(variables):
+                values = [cache['arr_%d' % i] for i in range(len(variables))]
+            else:
+                log.warning(f'Weight cache {cache_path} does not match the model, convert again')
+    if values is None:
+        if weights_file.stat().st_size < 20 + total_size * 4:
+            raise ValueError(f'{weights_file} is smaller than the model needs')
+        values = convert_darknet_weights(weights_file, plan, total_size)
+        os.makedirs(cache_dir, exist_ok=True)
+        # detector processes of a pool convert at the same time, each writes its own file
+        tmp_path = cache_dir / f'{cache_name}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, *values)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # another detector process wrote the cache first
+            tmp_path.unlink(missing_ok=True)
+        else:
+            log.info(f'Write weight cache {cache_path}')
+
+    # one call instead of set_weights per layer
+    tf.keras.backend.batch_set_value(list(zip(variables, values)))
+    return cache_path
 
 
 """
@@ -345,35 +420,23 @@ def nms(bboxes, iou_threshold, sigma=0.3, method='nms'):
     Note: soft-nms, https://arxiv.org/pdf/1704.04503.pdf
           https://github.com/bharatsingh430/soft-nms
     """
-    classes_in_img = list(set(bboxes[:, 5]))
-    best_bboxes = []
-
-    for cls in classes_in_img:
-        cls_mask = (bboxes[:, 5] == cls)
-        cls_bboxes = bboxes[cls_mask]
-
-        while len(cls_bboxes) > 0:
-            max_ind = np.argmax(cls_bboxes[:, 4])
-            best_bbox = cls_bboxes[max_ind]
-            best_bboxes.append(best_bbox)
-            cls_bboxes = np.concatenate([cls_bboxes[: max_ind], cls_bboxes[max_ind + 1:]])
-            iou = bbox_iou(best_bbox[np.newaxis, :4], cls_bboxes[:, :4])
-            weight = np.ones((len(iou),), dtype=np.float32)
+    assert method in ['nms', 'soft-nms']
 
-            assert method in ['nms', 'soft-nms']
+    bboxes = np.asarray(bboxes, dtype=np.float32)
+    if len(bboxes) == 0:
+        return []
+    boxes, scores, classes = bboxes[:, :4], bboxes[:, 4], bboxes[:, 5]
 
-            if method == 'nms':
-                iou_mask = iou > iou_threshold
-                weight[iou_mask] = 0.0
+    if method == 'nms':
+        keep = postprocess.batched_nms(boxes, scores, classes, iou_threshold)
+        return list(bboxes[keep])
 
-            if method == 'soft-nms':
-                weight = np.exp(-(1.0 * iou ** 2 / sigma))
-
-            cls_bboxes[:, 4] = cls_bboxes[:, 4] * weight
-            score_mask = cls_bboxes[:, 4] > 0.
-            cls_bboxes = cls_bboxes[score_mask]
-
-    return best_bboxes
+    keep, keep_scores = postprocess.batched_soft_nms(
+        boxes, scores, classes, iou_threshold, sigma=sigma, score_threshold=np.finfo(np.float32).tiny
+    )
+    best_bboxes = bboxes[keep]
+    best_bboxes[:, 4] = keep_scores
+    return list(best_bboxes)
 
 
 def freeze_all(model, frozen=True):
@@ -0,0 +1,97 @@
+from threading import Lock
+from time import perf_counter
+from typing import Iterable, List, Tuple, Dict
+
+"""
+The part of Jetson.GPIO used by the PWM code, every output is recorded with its time,
+for running PWM without a Jetson and for measuring edge jitter
+"""
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+HIGH = 1
+LOW = 0
+
+
+class FakeGPIO:
+    BOARD = BOARD
+    BCM = BCM
+    OUT = OUT
+    IN = IN
+    HIGH = HIGH
+    LOW = LOW
+
+    def __init__(self, hardware_channels: Iterable[int] = (), is_record=True):
+        """
+        :param hardware_channels: channels GPIO.PWM accepts, others raise ValueError as Jetson.GPIO does
+        :param is_record: keep every edge in edges
+        """
+        self.hardware_channels = set(hardware_channels)
+        self.is_record = is_record
+        self.lock = Lock()
+        self.mode = None
+        self.levels: Dict[int, int] = {}
+        # (perf_counter time, channel, level)
+        self.edges: List[Tuple[float, int, int]] = []
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, channel: int, direction, initial=LOW):
+        with self.lock:
+            self.levels[channel] = initial
+
+    def output(self, channel: int, level):
+        t = perf_counter()
+        level = int(bool(level))
+        with self.lock:
+            if channel not in self.levels:
+                raise RuntimeError(f'Channel {channel} is not set up')
+            self.levels[channel] = level
+            if self.is_record:
+                self.edges.append((t, channel, level))
+
+    def input(self, channel: int) -> int:
+        with self.lock:
+            return self.levels[channel]
+
+    def cleanup(self, channel=None):
+        with self.lock:
+            if channel is None:
+                self.levels.clear()
+            else:
+                self.levels.pop(channel, None)
+
+    def PWM(self, channel: int, frequency_hz: float) -> 'FakeHardwarePWM':
+        if channel not in self.hardware_channels:
+            raise ValueError(f'Channel {channel} is not a PWM')
+        return FakeHardwarePWM(self, channel, frequency_hz)
+
+    def get_edges(self, channel: int) -> List[Tuple[float, int]]:
+        """
+        :return: [(time, level)] of channel
+        """
+        with self.lock:
+            return [(t, level) for t, ch, level in self.edges if ch == channel]
+
+
+class FakeHardwarePWM:
+    def __init__(self, gpio: FakeGPIO, channel: int, frequency_hz: float):
+        self.gpio = gpio
+        self.channel = channel
+        self.frequency_hz = frequency_hz
+        self.duty_cycle_percent = 0.
+
+    def start(self, duty_cycle_percent: float):
+        self.duty_cycle_percent = duty_cycle_percent
+
+    def ChangeDutyCycle(self, duty_cycle_percent: float):
+        self.duty_cycle_percent = duty_cycle_percent
+
+    def ChangeFrequency(self, frequency_hz: float):
+        self.frequency_hz = frequency_hz
+
+    def stop(self):
+        self.duty_cycle_percent = 0.
@@ -0,0 +1,212 @@
+import os
+import logging as log
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Tuple, Callable, Optional, Union, List
+from .RepeatTimer import RepeatTimer
+
+# seconds, from a cached detect to a model load
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+
+class Counter:
+    __slots__ = ('name', 'help', 'value', 'lock')
+    type = 'counter'
+
+    def __init__(self, name: str, help_text=''):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, n: Union[int, float] = 1):
+        with self.lock:
+            self.value += n
+
+    def get(self) -> Union[int, float]:
+        return self.value
+
+    def to_prometheus(self) -> List[str]:
+        return [f'{self.name} {self.value}']
+
+
+class Gauge:
+    """
+    set() by the owner, or read from set_function() when collected, e.g. a queue depth
+    """
+    __slots__ = ('name', 'help', 'value', 'function')
+    type = 'gauge'
+
+    def __init__(self, name: str, help_text=''):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.function: Optional[Callable[[], Union[int, float]]] = None
+
+    def set(self, value: Union[int, float]):
+        # a single store, no lock needed
+        self.value = value
+
+    def set_function(self, function: Optional[Callable[[], Union[int, float]]]):
+        self.function = function
+
+    def get(self) -> Union[int, float]:
+        function = self.function
+        if function is None:
+            return self.value
+        try:
+            return function()
+        except Exception:
+            log.warning(f'Read gauge {self.name} fail', exc_info=True)
+            return self.value
+
+    def to_prometheus(self) -> List[str]:
+        return [f'{self.name} {self.get()}']
+
+
+class Histogram:
+    """
+    fixed buckets, observe() is one bisect and one locked add
+    """
+    __slots__ = ('name', 'help', 'bounds', 'counts', 'sum', 'count', 'lock')
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text='', buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        if list(buckets) != sorted(buckets):
+            raise ValueError('buckets must be sorted')
+        self.name = name
+        self.help = help_text
+        self.bounds = tuple(buckets)
+        # the last one is +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> 'Timer':
+        """
+        with histogram.time(): ... observes the seconds of the block
+        """
+        return Timer(self)
+
+    def get(self) -> dict:
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        buckets = []
+        for bound, n in zip(self.bounds + (float('inf'),), counts):
+            cumulative += n
+            buckets.append(['+Inf' if bound == float('inf') else bound, cumulative])
+        return {'COUNT': count, 'SUM': total, 'BUCKETS': buckets}
+
+    def to_prometheus(self) -> List[str]:
+        value = self.get()
+        lines = [f'{self.name}_bucket{{le="{bound}"}} {n}' for bound, n in value['BUCKETS']]
+        lines.append(f'{self.name}_sum {value["SUM"]}')
+        lines.append(f'{self.name}_count {value["COUNT"]}')
+        return lines
+
+
+class Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class Registry:
+    """
+    Metrics are created once at import or construction time and kept by their
+    owner, the hot path only touches the metric itself, never the registry.
+    Asking again for a name returns the registered metric.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = Lock()
+
+    def __register(self, cls, name: str, *args) -> Metric:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args)
+                self.metrics[name] = metric
+            elif type(metric) is not cls:
+                raise TypeError(f'Metric {name} is registered as a {metric.type}')
+            return metric
+
+    def counter(self, name: str, help_text='') -> Counter:
+        return self.__register(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text='') -> Gauge:
+        return self.__register(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text='', buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.__register(Histogram, name, help_text, buckets)
+
+    def get_metrics(self) -> List[Metric]:
+        with self.lock:
+            return sorted(self.metrics.values(), key=lambda m: m.name)
+
+    def to_dict(self) -> dict:
+        return {metric.name: metric.get() for metric in self.get_metrics()}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for metric in self.get_metrics():
+            if metric.help:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.to_prometheus())
+        return '\n'.join(lines) + '\n'
+
+
+# the process wide registry
+REGISTRY = Registry()
+
+
+class MetricsWriter(RepeatTimer):
+    """
+    writes the Prometheus text format to path every interval seconds,
+    for the textfile collector of node_exporter, the file is replaced at once
+    """
+
+    def __init__(self, path: str, interval=10., registry: Registry = REGISTRY):
+        RepeatTimer.__init__(self, interval=interval, name='MetricsWriter')
+        self.path = path
+        self.registry = registry
+
+    def execute_phase(self):
+        self.write()
+
+    def close_phase(self):
+        self.write()
+
+    def write(self):
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                f.write(self.registry.to_prometheus())
+            os.replace(temp_path, self.path)
+        except OSError:
+            log.error(f'Write metrics to {self.path} fail', exc_info=True)
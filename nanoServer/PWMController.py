@@ -1,11 +1,18 @@
 from Jetson import GPIO
 from .RepeatTimer import RepeatTimer
+from .PWMEngine import PWMEngine
+from .Metrics import REGISTRY
 from threading import Lock
 from collections import deque
 from typing import Iterable, Tuple
 from time import sleep, perf_counter
 import logging as log
 
+PWM_SETS = REGISTRY.counter('nano_pwm_sets_total', 'Speed and angle updates')
+PWM_WATCHDOG_STOPS = REGISTRY.counter('nano_pwm_watchdog_stops_total', 'Moving stopped because no MOV came in time')
+PWM_SPEED = REGISTRY.gauge('nano_pwm_speed_duty_percent', 'Duty cycle of the speed channel')
+PWM_ANGLE = REGISTRY.gauge('nano_pwm_angle_duty_percent', 'Duty cycle of the angle channel')
+
 
 class PWMSimulator(RepeatTimer):
     def __init__(self, channel, frequency, name='PWM'):
@@ -156,18 +163,32 @@ class PWMListener(RepeatTimer):
         print('\r%s' % self.__str__())
 
 
-class PWMController(RepeatTimer):
+class PWMController(PWMEngine):
+    """
+    Speed and angle channels, the watchdog and the listener all run in the
+    thread of the PWM engine
+    """
+
     def __init__(
             self, channels: Tuple[int, int],
             frequency: float = 0.25,
             min_angle=45,
             max_angle=135,
             is_listen=False,
+            is_hardware_pwm=True,
+            spin_time=0.0005,
+            switch_interval=0.,
     ):
-        RepeatTimer.__init__(self, interval=0.25, name='PWM_RESET')
+        """
+        :param frequency: seconds of one PWM cycle
+        :param is_hardware_pwm: use hardware PWM on pins that support it
+        :param spin_time: seconds of busy waiting before a software PWM edge
+        :param switch_interval: thread switch interval of the process, 0 keeps the default
+        """
         GPIO.setmode(GPIO.BOARD)
-        self.speed = PWMSimulator(channels[0], frequency, name='PWM_SP')
-        self.angle = PWMSimulator(channels[1], frequency, name='PWM_AG')
+        PWMEngine.__init__(self, GPIO, spin_time, switch_interval, name='PWM')
+        self.speed = self.add_channel(channels[0], frequency, 'PWM_SP', is_hardware_pwm)
+        self.angle = self.add_channel(channels[1], frequency, 'PWM_AG', is_hardware_pwm)
         self.init_time = perf_counter()
         self.reset_interval = 1.
         self.is_listen = is_listen
@@ -176,6 +197,9 @@ class PWMController(RepeatTimer):
         )
         self.min_angle = min_angle
         self.max_angle = max_angle
+        self.add_timer(0.25, self.check_reset)
+        if is_listen:
+            self.add_timer(self.listener.get_interval(), self.listener.execute_phase)
 
     def __str__(self):
         if self.is_listen:
@@ -183,25 +207,15 @@ class PWMController(RepeatTimer):
         return "%s\n%s" % (str(self.speed), str(self.angle))
 
     def init_phase(self) -> None:
-        self.speed.start()
-        self.angle.start()
         self.reset_time()
-        if self.is_listen:
-            self.listener.start()
+        PWMEngine.init_phase(self)
 
-    def execute_phase(self):
+    def check_reset(self):
         if perf_counter() - self.init_time > self.reset_interval:
+            if PWM_SPEED.get() > 0:
+                PWM_WATCHDOG_STOPS.inc()
             self.reset()
 
-    def close_phase(self):
-        self.speed.close()
-        self.angle.close()
-        self.speed.join()
-        self.angle.join()
-        if self.listener.is_alive():
-            self.listener.close()
-            self.listener.join()
-
     def set(self, r, theta):
         self.reset_time()
         if r < 0:
@@ -223,6 +237,9 @@ class PWMController(RepeatTimer):
 
         self.speed.change_duty_cycle_percent(r / 1 * 100)
         self.angle.change_duty_cycle_percent(theta / 180 * 100)
+        PWM_SETS.inc()
+        PWM_SPEED.set(r / 1 * 100)
+        PWM_ANGLE.set(theta / 180 * 100)
 
     def reset(self):
         self.set(0, 90)
@@ -0,0 +1,325 @@
+import sys
+import logging as log
+from math import floor
+from threading import Lock, Event
+from time import perf_counter
+from typing import List, Callable, Union
+from .RepeatTimer import RepeatTimer
+from .Metrics import REGISTRY
+
+# PWM edges are late by microseconds to milliseconds, far below LATENCY_BUCKETS
+EDGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+
+PWM_EDGE_LATENESS = REGISTRY.histogram(
+    'nano_pwm_edge_lateness_seconds',
+    'Time from the deadline of a software PWM edge to its output',
+    EDGE_BUCKETS
+)
+PWM_SKIPPED_CYCLES = REGISTRY.counter(
+    'nano_pwm_skipped_cycles_total',
+    'Software PWM cycles skipped because the engine was late by a whole period'
+)
+# sleep of an engine without channels or timers, a new one wakes it
+IDLE_WAIT = 1.
+
+
+class SoftwarePWMChannel:
+    """
+    A GPIO pin toggled by the PWMEngine thread. Period and duty cycle changes
+    take effect at the start of the next cycle, the cycle in progress is never cut.
+    """
+
+    def __init__(self, gpio, channel: int, period: float, name='PWM'):
+        """
+        :param period: seconds of one cycle
+        """
+        if period <= 0:
+            raise ValueError('Period must greater than 0')
+        self.gpio = gpio
+        self.channel = channel
+        self.name = name
+        self.lock = Lock()
+        self.__period = period
+        self.__duty_cycle_percent = 0.
+        # only touched by the engine thread
+        self.level = gpio.LOW
+        self.cycle_start = 0.
+        self.cycle_period = period
+        self.next_edge = 0.
+        self.is_rising_next = True
+        gpio.setup(channel, gpio.OUT, initial=gpio.LOW)
+
+    def __str__(self):
+        with self.lock:
+            period = self.__period
+            duty_cycle_percent = self.__duty_cycle_percent
+        return 'name: %s ch: %d frequency: %4.2f duty_cycle: %5.2f%%' % (
+            self.name, self.channel, period, duty_cycle_percent
+        )
+
+    def start(self, now: float):
+        self.cycle_start = now
+        self.next_edge = now
+        self.is_rising_next = True
+
+    def on_edge(self, now: float) -> float:
+        """
+        outputs the edge due at next_edge, rising edges stay on the grid of the first cycle
+        :return: seconds the edge is late
+        """
+        lateness = now - self.next_edge
+        if self.is_rising_next:
+            with self.lock:
+                self.cycle_period = self.__period
+                duty_cycle_percent = self.__duty_cycle_percent
+            high_time = self.cycle_period * duty_cycle_percent / 100
+            self.output(self.gpio.HIGH if high_time > 0 else self.gpio.LOW)
+            if 0 < high_time < self.cycle_period:
+                # the width counts from the actual rise, a late rise keeps its duty cycle
+                self.next_edge = min(now + high_time, self.cycle_start + self.cycle_period)
+                self.is_rising_next = False
+            else:
+                # 0% and 100% have no falling edge
+                self.next_cycle(now)
+        else:
+            self.output(self.gpio.LOW)
+            self.next_cycle(now)
+        return lateness
+
+    def next_cycle(self, now: float):
+        self.cycle_start += self.cycle_period
+        behind = now - self.cycle_start
+        if behind >= self.cycle_period:
+            # keep the phase, a cycle that already passed is not worth outputting
+            missed = floor(behind / self.cycle_period)
+            self.cycle_start += missed * self.cycle_period
+            PWM_SKIPPED_CYCLES.inc(missed)
+        self.next_edge = self.cycle_start
+        self.is_rising_next = True
+
+    def output(self, level):
+        if level != self.level:
+            self.gpio.output(self.channel, level)
+            self.level = level
+
+    def close(self):
+        self.gpio.output(self.channel, self.gpio.LOW)
+        self.level = self.gpio.LOW
+        self.gpio.cleanup(self.channel)
+
+    def get_status(self):
+        return self.level
+
+    def change_duty_cycle_percent(self, duty_cycle_percent):
+        if duty_cycle_percent < 0 or duty_cycle_percent > 100:
+            raise ValueError('Duty cycle percent must between 0 and 100')
+        with self.lock:
+            self.__duty_cycle_percent = duty_cycle_percent
+
+    def change_frequency(self, frequency):
+        """
+        :param frequency: seconds of one cycle, the frequency of sys.ini
+        """
+        if frequency <= 0:
+            raise ValueError('Frequency must greater than 0')
+        with self.lock:
+            self.__period = frequency
+
+
+class HardwarePWMChannel:
+    """
+    A pin with a PWM controller, GPIO.PWM keeps the waveform without any thread
+    """
+
+    def __init__(self, gpio, channel: int, period: float, name='PWM'):
+        """
+        :raise ValueError: channel has no hardware PWM
+        """
+        if period <= 0:
+            raise ValueError('Period must greater than 0')
+        self.gpio = gpio
+        self.channel = channel
+        self.name = name
+        self.lock = Lock()
+        self.__period = period
+        self.__duty_cycle_percent = 0.
+        gpio.setup(channel, gpio.OUT, initial=gpio.LOW)
+        self.pwm = gpio.PWM(channel, 1 / period)
+        self.pwm.start(0)
+
+    def __str__(self):
+        with self.lock:
+            period = self.__period
+            duty_cycle_percent = self.__duty_cycle_percent
+        return 'name: %s ch: %d frequency: %4.2f duty_cycle: %5.2f%% (hardware)' % (
+            self.name, self.channel, period, duty_cycle_percent
+        )
+
+    def close(self):
+        self.pwm.stop()
+        self.gpio.cleanup(self.channel)
+
+    def get_status(self):
+        # the pin is driven by the PWM controller, the level follows from the time
+        with self.lock:
+            period = self.__period
+            duty_cycle_percent = self.__duty_cycle_percent
+        return int(perf_counter() % period < period * duty_cycle_percent / 100)
+
+    def change_duty_cycle_percent(self, duty_cycle_percent):
+        if duty_cycle_percent < 0 or duty_cycle_percent > 100:
+            raise ValueError('Duty cycle percent must between 0 and 100')
+        with self.lock:
+            self.__duty_cycle_percent = duty_cycle_percent
+            self.pwm.ChangeDutyCycle(duty_cycle_percent)
+
+    def change_frequency(self, frequency):
+        """
+        :param frequency: seconds of one cycle, the frequency of sys.ini
+        """
+        if frequency <= 0:
+            raise ValueError('Frequency must greater than 0')
+        with self.lock:
+            self.__period = frequency
+            self.pwm.ChangeFrequency(1 / frequency)
+
+
+class EngineTimer:
+    __slots__ = ('deadline', 'interval', 'function')
+
+    def __init__(self, interval: float, function: Callable[[], None]):
+        self.deadline = perf_counter() + interval
+        self.interval = interval
+        self.function = function
+
+
+class PWMEngine(RepeatTimer):
+    """
+    One thread for every PWM channel. The engine sleeps until the earliest
+    deadline of all software channels and timers, spins the last spin_time
+    seconds so the edge does not depend on the sleep granularity, outputs
+    every edge that is due and schedules the next one from the cycle start,
+    so a late edge never shifts the cycles after it. Pins with hardware PWM
+    are handed to GPIO.PWM and need no edges at all.
+    A thread holding the GIL still delays an edge until the interpreter
+    switches threads, switch_interval shortens that wait for the whole process.
+    """
+
+    def __init__(self, gpio=None, spin_time=0.0005, switch_interval=0., name='PWM'):
+        """
+        :param gpio: Jetson.GPIO if None, FakeGPIO to run without a Jetson
+        :param spin_time: seconds of busy waiting before an edge, 0 only sleeps
+        :param switch_interval: sys.setswitchinterval on start, 0 keeps the interpreter default
+        """
+        RepeatTimer.__init__(self, interval=0, name=name)
+        if gpio is None:
+            from Jetson import GPIO as gpio
+        self.gpio = gpio
+        self.spin_time = spin_time
+        self.switch_interval = switch_interval
+        self.lock = Lock()
+        self.wake = Event()
+        self.channels: List[SoftwarePWMChannel] = []
+        self.hardware_channels: List[HardwarePWMChannel] = []
+        self.timers: List[EngineTimer] = []
+        self.is_started = False
+
+    def add_channel(
+            self,
+            channel: int,
+            period: float,
+            name='PWM',
+            is_hardware=True
+    ) -> Union[SoftwarePWMChannel, HardwarePWMChannel]:
+        """
+        :param is_hardware: use hardware PWM when the pin supports it
+        """
+        if is_hardware:
+            try:
+                pwm = HardwarePWMChannel(self.gpio, channel, period, name)
+            except (ValueError, RuntimeError, AttributeError) as E:
+                log.info(f'{name} Channel: {channel} software PWM, no hardware PWM: {E}')
+            else:
+                log.info(f'{name} Channel: {channel} hardware PWM')
+                with self.lock:
+                    self.hardware_channels.append(pwm)
+                return pwm
+        pwm = SoftwarePWMChannel(self.gpio, channel, period, name)
+        with self.lock:
+            if self.is_started:
+                pwm.start(perf_counter())
+            self.channels.append(pwm)
+        self.wake.set()
+        return pwm
+
+    def add_timer(self, interval: float, function: Callable[[], None]):
+        """
+        calls function every interval seconds in the engine thread, it must be short
+        """
+        if interval <= 0:
+            raise ValueError('interval must greater than 0')
+        with self.lock:
+            self.timers.append(EngineTimer(interval, function))
+        self.wake.set()
+
+    def init_phase(self):
+        if self.switch_interval > 0:
+            log.info(f'Thread switch interval {sys.getswitchinterval()} => {self.switch_interval}')
+            sys.setswitchinterval(self.switch_interval)
+        now = perf_counter()
+        with self.lock:
+            for channel in self.channels:
+                channel.start(now)
+            for timer in self.timers:
+                timer.deadline = now + timer.interval
+            self.is_started = True
+
+    def execute_phase(self):
+        with self.lock:
+            deadline = min(
+                [channel.next_edge for channel in self.channels] + [timer.deadline for timer in self.timers],
+                default=perf_counter() + IDLE_WAIT
+            )
+        if not self.wait_until(deadline):
+            return
+        now = perf_counter()
+        due_timers = []
+        with self.lock:
+            for channel in self.channels:
+                if channel.next_edge <= now:
+                    PWM_EDGE_LATENESS.observe(channel.on_edge(now))
+            for timer in self.timers:
+                if timer.deadline <= now:
+                    timer.deadline += timer.interval
+                    if timer.deadline <= now:
+                        timer.deadline = now + timer.interval
+                    due_timers.append(timer)
+        # outside the lock, a timer may add channels
+        for timer in due_timers:
+            try:
+                timer.function()
+            except Exception as E:
+                log.error(f'PWM timer error {E.__class__.__name__}: {E}')
+
+    def wait_until(self, deadline: float) -> bool:
+        """
+        :return: False if woken before the deadline by close or a new channel
+        """
+        remaining = deadline - perf_counter() - self.spin_time
+        if remaining > 0 and self.wake.wait(remaining):
+            self.wake.clear()
+            return False
+        while perf_counter() < deadline:
+            pass
+        return True
+
+    def close(self):
+        RepeatTimer.close(self)
+        self.wake.set()
+
+    def close_phase(self):
+        with self.lock:
+            for channel in self.channels:
+                channel.close()
+            for channel in self.hardware_channels:
+                channel.close()
@@ -0,0 +1,164 @@
+import os
+import re
+import sys
+import pstats
+import logging as log
+from pathlib import Path
+from threading import Lock, Timer, enumerate as enumerate_threads, get_ident
+from time import strftime
+from typing import Dict, Tuple, List, Optional, Iterable
+from .RepeatTimer import RepeatTimer
+from .ThreadProfiler import THREAD_PROFILER, match_thread
+
+SAMPLE = 'SAMPLE'
+CPROFILE = 'CPROFILE'
+MODES = (SAMPLE, CPROFILE)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler(RepeatTimer):
+    """
+    Samples the stacks of the matching threads rate times a second with
+    sys._current_frames(), the profiled threads run untouched.
+    The result is in the collapsed stack format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_names: Tuple[str, ...] = (), rate=100.):
+        if rate <= 0:
+            raise ValueError('rate must greater than 0')
+        RepeatTimer.__init__(self, interval=1 / rate, name='SamplingProfiler')
+        self.thread_names = tuple(thread_names)
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+
+    def execute_phase(self):
+        names = {t.ident: t.name.replace(';', '_') for t in enumerate_threads()}
+        own_ident = get_ident()
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident, str(ident))
+            if ident == own_ident or not match_thread(name, self.thread_names):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(name)
+            stack = ';'.join(reversed(labels))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def write(self, path: Path):
+        # read after join(), no lock needed
+        with path.open('w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+
+class ProfilerManager:
+    """
+    One profiling session at a time, started and stopped over the protocol.
+    Nothing runs while it is stopped, the cProfile checkpoints cost an attribute test.
+    Output files go to output_dir, only those can be read back by read().
+    """
+
+    def __init__(self, output_dir='logs'):
+        self.output_dir = Path(output_dir)
+        self.lock = Lock()
+        self.mode: Optional[str] = None
+        self.sampler: Optional[SamplingProfiler] = None
+        self.stop_timer: Optional[Timer] = None
+        self.files: List[str] = []
+
+    def __str__(self):
+        with self.lock:
+            if self.mode is None:
+                return f'Profiler: stopped, {len(self.files)} files'
+            if self.mode == SAMPLE:
+                return f'Profiler: {self.mode}, {self.sampler.samples} samples'
+            return f'Profiler: {self.mode}'
+
+    def start(self, mode: str, thread_names: Iterable[str] = (), rate=100., duration=0.):
+        """
+        :param thread_names: prefixes of thread names, e.g. Camera, SocketRecv, StreamPool, empty for all threads
+        :param duration: seconds before it stops by itself, 0 waits for stop()
+        """
+        if mode not in MODES:
+            raise ValueError(f'Profile mode must be one of {MODES}')
+        thread_names = tuple(str(name) for name in thread_names)
+        with self.lock:
+            if self.mode is not None:
+                raise RuntimeError(f'Profiler {self.mode} is running')
+            if mode == SAMPLE:
+                self.sampler = SamplingProfiler(thread_names, rate)
+                self.sampler.start()
+            else:
+                THREAD_PROFILER.start(thread_names)
+            self.mode = mode
+            if duration > 0:
+                self.stop_timer = Timer(duration, self.stop)
+                self.stop_timer.daemon = True
+                self.stop_timer.start()
+        log.info(f'Profiler {mode} start, threads: {thread_names or "all"}')
+
+    def stop(self) -> List[str]:
+        """
+        :return: names of the written files
+        """
+        with self.lock:
+            mode, self.mode = self.mode, None
+            sampler, self.sampler = self.sampler, None
+            stop_timer, self.stop_timer = self.stop_timer, None
+        if stop_timer is not None:
+            stop_timer.cancel()
+        if mode is None:
+            return []
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = strftime('profile_%YY-%mM-%dD_%HH-%Mm-%Ss')
+        names = []
+        if mode == SAMPLE:
+            sampler.close()
+            sampler.join()
+            name = f'{prefix}.collapsed'
+            sampler.write(self.output_dir / name)
+            names.append(name)
+        else:
+            for thread_name, ident, profile in THREAD_PROFILER.stop():
+                # session threads are named after the client address
+                name = '%s_%s_%d.pstats' % (prefix, re.sub(r'[^\w.-]', '_', thread_name), ident)
+                try:
+                    pstats.Stats(profile).dump_stats(str(self.output_dir / name))
+                except TypeError:
+                    # a profile that never saw a call has no stats
+                    continue
+                names.append(name)
+        with self.lock:
+            self.files.extend(names)
+        log.info(f'Profiler {mode} stop, files: {names}')
+        return names
+
+    def close(self):
+        self.stop()
+
+    def is_running(self) -> bool:
+        with self.lock:
+            return self.mode is not None
+
+    def get_mode(self) -> Optional[str]:
+        with self.lock:
+            return self.mode
+
+    def get_files(self) -> List[str]:
+        with self.lock:
+            return list(self.files)
+
+    def read(self, name: str) -> bytes:
+        with self.lock:
+            if name not in self.files:
+                raise KeyError(f'Profile file not found: {name}')
+        with (self.output_dir / name).open('rb') as f:
+            return f.read()
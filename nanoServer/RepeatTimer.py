@@ -1,4 +1,6 @@
 from threading import Thread, Event
+from .Affinity import set_thread_affinity
+from .ThreadProfiler import checkpoint
 
 """
 init phase -> wait for period -> execute phase -> close -> close phase
@@ -15,10 +17,13 @@ class RepeatTimer(Thread):
         self.__kwargs = kwargs
         self.__interval = interval
         self.__event = Event()
+        self.cpus = None
 
     def run(self) -> None:
+        set_thread_affinity(self.cpus)
         self.init_phase()
         while not self.__event.wait(self.__interval):
+            checkpoint()
             self.execute_phase()
         self.close_phase()
 
@@ -35,6 +40,12 @@ class RepeatTimer(Thread):
     def close_phase(self):
         pass
 
+    def set_cpus(self, cpus):
+        """
+        cpu set of this thread and the threads it starts, call before start()
+        """
+        self.cpus = cpus
+
     def set_interval(self, interval: float):
         if interval < 0:
             raise ValueError('interval must greater than 0')
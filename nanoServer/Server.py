@@ -1,8 +1,21 @@
+import json
 import logging as log
-from socket import socket, AF_INET, SOCK_STREAM
-from typing import Optional, Callable, Tuple
+from socket import socket, timeout, AF_INET, SOCK_STREAM, SHUT_RDWR, SHUT_WR
+from threading import Lock, Thread
+from typing import Dict, Optional, Callable, Tuple, List
+from .API import SYS_BUSY
 from .ClientHandler import AsyncClientHandler, EventHandler, ClientLoginFail
+from .Metrics import REGISTRY
 from .RepeatTimer import RepeatTimer
+from .SessionRecorder import SessionRecorder
+from .Trigger import Trigger
+from .socketIO import send
+
+SESSIONS = REGISTRY.gauge('nano_sessions', 'Connected clients')
+INPUT_QUEUE_DEPTH = REGISTRY.gauge('nano_input_queue_depth', 'Received messages waiting for a response, all sessions')
+OUTPUT_QUEUE_DEPTH = REGISTRY.gauge('nano_output_queue_depth', 'Messages waiting to be sent, all sessions')
+SESSIONS_ACCEPTED = REGISTRY.counter('nano_sessions_accepted_total', 'Clients accepted')
+SESSIONS_REJECTED = REGISTRY.counter('nano_sessions_rejected_total', 'Clients answered SYS_BUSY')
 
 
 class ServerBuilder:
@@ -39,6 +52,14 @@ class ServerBuilder:
 
 
 class Server(RepeatTimer):
+    """
+    This thread only accepts clients, every client gets an AsyncClientHandler
+    on its own session thread, at most max_connection at once. A client over
+    the limit receives SYS_BUSY and is closed instead of waiting in the backlog.
+    Handlers of all sessions share the objects passed to the decorators,
+    those must be thread safe when max_connection > 1.
+    """
+
     def __init__(
             self,
             ip,
@@ -49,7 +70,9 @@ class Server(RepeatTimer):
             client_timeout: Optional[float] = None,
             is_show_exc_info=False
     ):
-        RepeatTimer.__init__(self)
+        RepeatTimer.__init__(self, interval=0, name='ServerAccept')
+        if max_connection < 1:
+            raise ValueError('max_connection must greater than 0')
         self.server_sock = socket(AF_INET, SOCK_STREAM)
         self.server_sock.bind((ip, port))
         self.ip, self.port = self.server_sock.getsockname()
@@ -59,19 +82,27 @@ class Server(RepeatTimer):
         self.max_connection = max_connection
         self.server_timeout = server_timeout
         self.client_timeout = client_timeout
-        self.client_handler: Optional[AsyncClientHandler] = None
+        self.client_handlers: Dict[Tuple[str, int], AsyncClientHandler] = {}
+        self.lock = Lock()
+        SESSIONS.set_function(self.session_count)
+        INPUT_QUEUE_DEPTH.set_function(lambda: sum(h.input_buffer.qsize() for h in self.get_client_handlers()))
+        OUTPUT_QUEUE_DEPTH.set_function(lambda: sum(h.output_buffer.qsize() for h in self.get_client_handlers()))
 
     def __str__(self):
         s = ''
         s += f'Server address => {self.ip}:{self.port}'
-        handler = self.client_handler
-        if handler is not None:
-            s += f'\n{handler}'
+        handlers = self.get_client_handlers()
+        if handlers:
+            s += f'\nSessions: {len(handlers)}/{self.max_connection}'
+            for handler in handlers:
+                s += f'\n{handler}'
         else:
             s += '\nNo Client Connected'
         return s
 
     def init_phase(self):
+        # sessions bind the frozen responses instead of resolving them per message
+        self.event_handler.compile()
         self.server_sock.listen(self.max_connection)
         self.server_sock.settimeout(self.server_timeout)
         log.info(f'IP ==> {self.ip} port ==> {self.port}')
@@ -80,20 +111,89 @@ class Server(RepeatTimer):
         log.info('Waiting Client connect......')
         try:
             client, address = self.server_sock.accept()
+        except timeout:
+            if self.session_count() > 0:
+                return
+            log.error('No client connected before server timeout', exc_info=self.is_show_exc_info)
+            self.close()
+            return
+        except Exception:
+            if self.is_running():
+                log.error('Error!', exc_info=self.is_show_exc_info)
+                self.close()
+            return
+
+        with self.lock:
+            is_full = len(self.client_handlers) >= self.max_connection
+        if is_full:
+            Thread(target=self.reject, args=(client, address), name='ServerReject', daemon=True).start()
+            return
+        try:
             client.settimeout(self.client_timeout)
+            handler = AsyncClientHandler(client, self.event_handler, is_show_exc_info=self.is_show_exc_info)
+        except Exception:
+            log.error(f'Client {address} setup fail', exc_info=self.is_show_exc_info)
+            client.close()
+            return
+        with self.lock:
+            self.client_handlers[address] = handler
+        SESSIONS_ACCEPTED.inc()
+        session = Thread(
+            target=self.session,
+            args=(client, address, handler),
+            name='Session-%s:%s' % address,
+            daemon=True
+        )
+        session.start()
+
+    def session(self, client: socket, address: Tuple[str, int], handler: AsyncClientHandler):
+        try:
             with client:
-                handler = AsyncClientHandler(client, self.event_handler, is_show_exc_info=self.is_show_exc_info)
-                self.client_handler = handler
                 handler.run()
         except ClientLoginFail:
-            return
-        except Exception as E:
-            log.error('Error!', exc_info=self.is_show_exc_info)
-            self.close()
+            pass
+        except Exception:
+            log.error(f'Session {address} error', exc_info=self.is_show_exc_info)
         finally:
-            self.client_handler = None
+            with self.lock:
+                self.client_handlers.pop(address, None)
+
+    def reject(self, client: socket, address: Tuple[str, int]):
+        log.warning('Reject client %s:%s, %d sessions running' % (*address, self.max_connection))
+        SESSIONS_REJECTED.inc()
+        busy = SYS_BUSY.copy()
+        busy['MAX_CONNECTION'] = self.max_connection
+        try:
+            with client:
+                client.settimeout(1)
+                send(client, json.dumps(busy))
+                client.shutdown(SHUT_WR)
+                # closing with an unread request resets the connection before the client reads SYS_BUSY
+                while client.recv(4096):
+                    pass
+        except OSError:
+            pass
+
+    def session_count(self) -> int:
+        with self.lock:
+            return len(self.client_handlers)
+
+    def get_client_handlers(self) -> List[AsyncClientHandler]:
+        with self.lock:
+            return list(self.client_handlers.values())
+
+    def close(self):
+        super().close()
+        # wakes up the accept
+        try:
+            self.server_sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
 
     def close_phase(self):
+        handlers = self.get_client_handlers()
+        for handler in handlers:
+            handler.close()
         self.server_sock.close()
 
     def login(self, *args, **kwargs):
@@ -103,9 +203,12 @@ class Server(RepeatTimer):
 
         return wrap
 
-    def routine(self, *args, **kwargs):
+    def routine(self, *args, trigger: Optional[Trigger] = None, **kwargs):
+        """
+        :param trigger: run once per fire, e.g. a new camera frame or RateTrigger(10), instead of in a loop
+        """
         def wrap(func):
-            self.event_handler.add_routine(func, args, kwargs)
+            self.event_handler.add_routine(func, args, kwargs, trigger)
 
         return wrap
 
@@ -121,6 +224,33 @@ class Server(RepeatTimer):
 
         return wrap
 
+    def set_recorder(self, recorder: Optional[SessionRecorder]):
+        """
+        :param recorder: SessionRecorder of the inbound messages of all sessions, None stops recording new sessions
+        """
+        self.event_handler.set_recorder(recorder)
+
+    def middleware(self):
+        """
+        func(message, next_handler) runs around every response, the first registered is the outermost
+        """
+
+        def wrap(func):
+            self.event_handler.add_middleware(func)
+
+        return wrap
+
+    def last_value_response(self, key: str, *args, **kwargs):
+        """
+        like response(), but pending messages of key coalesce to the newest one,
+        handled on a control lane thread ahead of the other commands
+        """
+
+        def wrap(func):
+            self.event_handler.add_response(key, func, args, kwargs, is_last_value=True)
+
+        return wrap
+
     def response(self, key: str, *args, **kwargs):
         if kwargs is None:
             kwargs = {}
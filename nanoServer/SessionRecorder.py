@@ -0,0 +1,101 @@
+import json
+import logging as log
+from base64 import b64encode, b64decode
+from threading import Lock
+from time import time
+from typing import Union, Optional
+from .socketIO import PAYLOAD_KEY
+
+# values of these keys are not written to the recording
+SECRET_KEYS = ('PWD',)
+
+
+class SessionRecorder:
+    """
+    Appends every inbound message of every session to a JSON lines file,
+    {"T": unix time, "SESSION": "ip:port", "MESSAGE": {...}, "PAYLOAD": BASE64 or "PAYLOAD_SIZE": INT},
+    benchmarks/LoadReplay.py replays it. Passwords are masked, binary payloads
+    (DETECT images) are only kept with is_record_payload.
+    """
+
+    def __init__(self, path: str, is_record_payload=False, max_messages=0):
+        """
+        :param max_messages: stop recording after this many messages, 0 is unlimited
+        """
+        self.path = path
+        self.is_record_payload = is_record_payload
+        self.max_messages = max_messages
+        self.messages = 0
+        self.lock = Lock()
+        self.file = open(path, 'a')
+        log.info(f'Record sessions to {path}')
+
+    def __str__(self):
+        with self.lock:
+            return f'Recorder: {self.messages} messages => {self.path}'
+
+    def record(self, session: str, message: Union[str, dict]):
+        t = time()
+        payload = None
+        if type(message) is str:
+            try:
+                message = json.loads(message)
+            except ValueError:
+                # kept as is, the replay sends the same broken message
+                pass
+        elif type(message) is dict and PAYLOAD_KEY in message:
+            message = message.copy()
+            payload = message.pop(PAYLOAD_KEY)
+        if type(message) is dict:
+            for key in SECRET_KEYS:
+                if key in message:
+                    message = dict(message, **{key: '***'})
+        record = {'T': t, 'SESSION': session, 'MESSAGE': message}
+        if payload is not None:
+            if self.is_record_payload:
+                record['PAYLOAD'] = b64encode(payload).decode()
+            else:
+                record['PAYLOAD_SIZE'] = payload.nbytes
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            if self.file is None or 0 < self.max_messages <= self.messages:
+                return
+            self.file.write(line)
+            self.messages += 1
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            file, self.file = self.file, None
+        if file is not None:
+            file.close()
+
+
+def load_recording(path: str, session: Optional[str] = None) -> dict:
+    """
+    :param session: only this session, None loads every session
+    :return: session -> [(seconds since the first message of the session, message, payload bytes or None)]
+    """
+    sessions = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            name = record['SESSION']
+            if session is not None and name != session:
+                continue
+            payload = record.get('PAYLOAD')
+            sessions.setdefault(name, []).append((
+                record['T'],
+                record['MESSAGE'],
+                b64decode(payload) if payload is not None else None
+            ))
+    for name, records in sessions.items():
+        start = records[0][0]
+        sessions[name] = [(t - start, message, payload) for t, message, payload in records]
+    return sessions
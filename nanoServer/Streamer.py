@@ -1,20 +1,40 @@
 import logging as log
-from threading import Thread, Lock
+import numpy as np
+from threading import Lock
 from time import sleep, perf_counter
-from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Optional, Set, List, Tuple
+from .Affinity import set_thread_affinity
 from .Camera import Camera
 from .Detector import ConfigManager, DetectResult, YOLOConfiger, RemoteConfigManager
+from .Detector.DetectResult import ClassTable, class_id_dtype
+from .Metrics import REGISTRY
+from .Tracker import Tracker
+from .Trigger import Trigger
+from .ThreadProfiler import checkpoint
+
+RESULT_FORMATS = ('JSON', 'BINARY')
+# tracked boxes are moved at most this many seconds past their detection
+TRACK_MAX_PREDICT = 1.
+
+STREAM_FRAMES = REGISTRY.counter('nano_stream_frames_total', 'Frames streamed')
+STREAM_DROPPED = REGISTRY.counter('nano_stream_dropped_total', 'Stream ticks without a frame, no camera image or a failed stage')
+STREAM_FPS = REGISTRY.gauge('nano_stream_fps', 'Smoothed frames per second of the stream')
+FRAME_SECONDS = REGISTRY.histogram('nano_stream_frame_seconds', 'Time to produce a stream frame')
+DETECT_SECONDS = REGISTRY.histogram('nano_stream_detect_seconds', 'Detect stage of a stream frame')
+ENCODE_SECONDS = REGISTRY.histogram('nano_stream_encode_seconds', 'JPEG encode stage of a stream frame')
+TRACKED_DETECTIONS = REGISTRY.counter('nano_stream_tracked_detections_total', 'Detections given to the tracker of the stream')
 
 
 class Frame:
-    def __init__(self, b64image='', detect_result: Optional[DetectResult] = None):
+    __slots__ = ('b64image', 'result', 'class_version')
+
+    def __init__(self, b64image='', detect_result: Optional[DetectResult] = None, class_version=0):
         if detect_result is None:
             detect_result = DetectResult()
         self.b64image = b64image
-        self.boxes = detect_result.boxes
-        self.classes = detect_result.classes
-        self.scores = detect_result.scores
+        self.result = detect_result
+        self.class_version = class_version
 
     def is_available(self) -> bool:
         return bool(self.b64image)
@@ -32,23 +52,68 @@ class Streamer:
             remote_detector_ip='127.0.0.1',
             remote_detector_port=5050,
             remote_detector_timeout=10,
+            remote_image_encoding='JPEG',
+            remote_jpeg_quality=90,
+            remote_deadline=1.,
+            remote_failure_threshold=3,
+            remote_retry_interval=5.,
+            remote_fallback_config='',
+            cache_size=16,
+            cache_ttl=1.,
+            cache_distance=4,
+            is_track=False,
+            track_iou_threshold=0.3,
+            detector_threads=0,
+            detector_cpus: Optional[Set[int]] = None,
+            camera_cpus: Optional[Set[int]] = None,
             is_show_exc_info=False
     ):
         self.camera = Camera(jpg_encode_rate)
+        self.camera.set_cpus(camera_cpus)
         if is_local_detector:
             self.config_manager = ConfigManager(
                 yolo_configs_dir,
-                is_show_exc_info=is_show_exc_info
+                is_show_exc_info=is_show_exc_info,
+                cache_size=cache_size,
+                cache_ttl=cache_ttl,
+                cache_distance=cache_distance,
+                num_threads=detector_threads,
+                cpus=detector_cpus
             )
         else:
+            fallback = None
+            if remote_fallback_config:
+                # a light local model keeps boxes on the stream while the detect server is down
+                fallback = ConfigManager(
+                    yolo_configs_dir,
+                    is_show_exc_info=is_show_exc_info,
+                    cache_size=cache_size,
+                    cache_ttl=cache_ttl,
+                    cache_distance=cache_distance,
+                    num_threads=detector_threads,
+                    cpus=detector_cpus
+                )
+                fallback.set_config(remote_fallback_config)
             self.config_manager = RemoteConfigManager(
                 remote_detector_ip,
                 remote_detector_port,
                 remote_detector_timeout,
-                is_show_exc_info=is_show_exc_info
+                is_show_exc_info=is_show_exc_info,
+                image_encoding=remote_image_encoding,
+                jpeg_quality=remote_jpeg_quality,
+                deadline=remote_deadline,
+                failure_threshold=remote_failure_threshold,
+                retry_interval=remote_retry_interval,
+                fallback=fallback
             )
 
-        self.thread_pool = ThreadPoolExecutor(5)
+        # detect and JPEG encode run on the detector cpus
+        self.thread_pool = ThreadPoolExecutor(
+            5,
+            thread_name_prefix='StreamPool',
+            initializer=set_thread_affinity,
+            initargs=(detector_cpus,)
+        )
         self.exc_info = is_show_exc_info
         self.__is_infer = False
         self.__is_stream = False
@@ -56,6 +121,22 @@ class Streamer:
         self.idle_interval = idle_interval
         self.timeout = stream_timeout
         self.lock = Lock()
+        self.class_table = ClassTable()
+        # per session, keyed by the client address, sessions share the camera and the model
+        self.__result_formats: Dict[Tuple[str, int], str] = {}
+        self.__sent_class_versions: Dict[Tuple[str, int], int] = {}
+        # fires on camera frames while streaming and on state changes, paced to max_fps
+        self.stream_trigger = Trigger('Stream', min_interval=self.interval)
+        self.last_frame_time = 0.
+        self.camera.frame_trigger.add_listener(self.__on_frame)
+        # detection in the background, frames between detections get predicted boxes
+        self.is_track = is_track
+        self.tracker = Tracker(track_iou_threshold)
+        self.track_lock = Lock()
+        self.tracking: Optional[Future] = None
+        self.tracking_time = 0.
+        self.track_time = 0.
+        self.track_classes: List[str] = []
 
     def __str__(self):
         return str(self.config_manager) + '\n' + str(self.camera)
@@ -70,8 +151,11 @@ class Streamer:
         with self.lock:
             self.__is_infer = False
             self.__is_stream = False
+            self.__result_formats.clear()
+            self.__sent_class_versions.clear()
             self.camera.reset()
             self.config_manager.reset()
+        self.reset_tracker()
 
     def close(self):
         with self.lock:
@@ -80,22 +164,37 @@ class Streamer:
             self.camera.close()
         self.thread_pool.shutdown(True)
 
-    def get(self) -> Frame:
+    def __on_frame(self):
+        if self.__is_stream:
+            self.stream_trigger.fire()
+
+    def get(self, is_wait=True) -> Frame:
+        """
+        :param is_wait: pace to max_fps and sleep idle_interval when there is no frame,
+                        callers woken by stream_trigger are already paced
+        """
         init_time = perf_counter()
         with self.lock:
             is_stream = self.is_stream()
             is_infer = self.is_infer()
 
-        frame = Frame()
+        frame = Frame(class_version=self.class_table.version)
         if is_stream and is_infer:
             is_image, image = self.camera.get()
-            if is_image:
+            if is_image and self.is_track:
+                frame = self.track_and_encode_image(image)
+            elif is_image:
                 frame = self.infer_and_encode_image(image)
         elif is_stream:
             is_image, image = self.camera.get()
             if is_image:
-                frame.b64image = self.camera.encode_image_to_b64(image)
+                with ENCODE_SECONDS.time():
+                    frame.b64image = self.camera.encode_image_to_b64(image)
+        if is_stream:
+            self.record_frame(frame, init_time)
 
+        if not is_wait:
+            return frame
         if frame.is_available():
             ptime = perf_counter() - init_time
             if self.interval > ptime:
@@ -105,28 +204,151 @@ class Streamer:
 
         return frame
 
+    def record_frame(self, frame: Frame, init_time: float):
+        if not frame.is_available():
+            STREAM_DROPPED.inc()
+            return
+        now = perf_counter()
+        FRAME_SECONDS.observe(now - init_time)
+        STREAM_FRAMES.inc()
+        interval = now - self.last_frame_time
+        self.last_frame_time = now
+        if 0 < interval < self.timeout:
+            STREAM_FPS.set(0.9 * STREAM_FPS.get() + 0.1 / interval)
+        else:
+            # the first frame after a pause
+            STREAM_FPS.set(0)
+
+    def submit_detect(self, image) -> Future:
+        s = perf_counter()
+        if isinstance(self.config_manager, RemoteConfigManager):
+            # resolves by the remote deadline, a slow detect server does not hold the stream
+            detecting = self.config_manager.detect_async(image)
+        else:
+            detecting = self.thread_pool.submit(self.pool_task, self.config_manager.detect, image)
+        detecting.add_done_callback(lambda _: DETECT_SECONDS.observe(perf_counter() - s))
+        return detecting
+
+    def submit_encode(self, image) -> Future:
+        s = perf_counter()
+        encoding = self.thread_pool.submit(self.pool_task, self.camera.encode_image_to_b64, image)
+        encoding.add_done_callback(lambda _: ENCODE_SECONDS.observe(perf_counter() - s))
+        return encoding
+
     def infer_and_encode_image(self, image) -> Frame:
-        detecting = self.thread_pool.submit(self.config_manager.detect, image)
-        encoding = self.thread_pool.submit(self.camera.encode_image_to_b64, image)
+        detecting = self.submit_detect(image)
+        encoding = self.submit_encode(image)
         try:
             b64image = encoding.result(timeout=self.timeout)
             detect_result = detecting.result(timeout=self.timeout)
-            return Frame(b64image=b64image, detect_result=detect_result)
+            class_version = self.class_table.update(detect_result.classes)
+            return Frame(b64image=b64image, detect_result=detect_result, class_version=class_version)
         except Exception as E:
             log.error(f'Encode and infer image error {E.__class__.__name__}', exc_info=self.exc_info)
             return Frame(b64image='', detect_result=None)
 
+    def track_and_encode_image(self, image) -> Frame:
+        """
+        the frame does not wait for detection, one detection runs in the background at a time
+        and every frame gets the tracked boxes moved to the time of the frame
+        """
+        encoding = self.submit_encode(image)
+        try:
+            with self.track_lock:
+                now = perf_counter()
+                if self.tracking is not None and self.tracking.done():
+                    tracking, self.tracking = self.tracking, None
+                    self.update_tracker(tracking.result(), self.tracking_time)
+                if self.tracking is None:
+                    self.tracking = self.submit_detect(image)
+                    self.tracking_time = now
+                detect_result = self.get_tracked_result(now)
+            class_version = self.class_table.update(detect_result.classes)
+            b64image = encoding.result(timeout=self.timeout)
+            return Frame(b64image=b64image, detect_result=detect_result, class_version=class_version)
+        except Exception as E:
+            log.error(f'Encode and track image error {E.__class__.__name__}', exc_info=self.exc_info)
+            return Frame(b64image='', detect_result=None)
+
+    def update_tracker(self, detect_result: DetectResult, detect_time: float):
+        # the tracker counts in frames of max_fps
+        dt = (detect_time - self.track_time) / self.interval
+        self.tracker.update(detect_result.boxes, dt, detect_result.scores)
+        self.track_time = detect_time
+        self.track_classes = detect_result.classes
+        TRACKED_DETECTIONS.inc()
+
+    def get_tracked_result(self, now: float) -> DetectResult:
+        dt = min(now - self.track_time, TRACK_MAX_PREDICT) / self.interval
+        xyxy, class_ids, _, scores = self.tracker.get_tracks(dt)
+        return DetectResult.from_arrays(
+            np.round(xyxy).astype(np.int16),
+            class_ids.astype(class_id_dtype(len(self.track_classes))),
+            scores.astype(np.float16),
+            self.track_classes
+        )
+
+    def reset_tracker(self):
+        # a detection still running is dropped
+        with self.track_lock:
+            self.tracker.reset()
+            self.tracking = None
+            self.track_classes = []
+
+    @staticmethod
+    def pool_task(func, *args):
+        # pool threads have no loop of their own to switch cProfile in
+        checkpoint()
+        return func(*args)
+
     def set_stream(self, is_stream: bool):
         with self.lock:
             self.__is_stream = is_stream
+        self.stream_trigger.fire()
 
     def set_infer(self, is_infer: bool):
         with self.lock:
             self.__is_infer = is_infer
+        self.reset_tracker()
+        self.stream_trigger.fire()
+
+    def set_result_format(self, result_format: str, address: Tuple[str, int]):
+        """
+        :param address: the session, other clients keep their format
+        """
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f'Result format must be one of {RESULT_FORMATS}')
+        with self.lock:
+            self.__result_formats[address] = result_format
+            self.__sent_class_versions.pop(address, None)
+        self.stream_trigger.fire()
+
+    def get_result_format(self, address: Tuple[str, int]) -> str:
+        with self.lock:
+            return self.__result_formats.get(address, 'JSON')
+
+    def is_class_table_sent(self, class_version: int, address: Tuple[str, int]) -> bool:
+        """
+        True if the client of address already has the class names of class_version, otherwise mark them as sent
+        """
+        with self.lock:
+            if self.__sent_class_versions.get(address) == class_version:
+                return True
+            self.__sent_class_versions[address] = class_version
+            return False
+
+    def remove_session(self, address: Tuple[str, int]):
+        """
+        forget the state of a client that left, the stream goes on for the others
+        """
+        with self.lock:
+            self.__result_formats.pop(address, None)
+            self.__sent_class_versions.pop(address, None)
 
     def set_config(self, config_name):
-        thread = Thread(target=self.config_manager.set_config, args=(config_name,))
-        thread.start()
+        self.config_manager.set_config(config_name)
+        # class ids of the old model mean nothing to the new one
+        self.reset_tracker()
 
     def set_quality(self, width, height):
         self.camera.set_quality(width, height)
@@ -0,0 +1,97 @@
+import cProfile
+import logging as log
+from threading import Lock, current_thread, get_ident
+from time import sleep, perf_counter
+from typing import Dict, Tuple, List
+
+
+def match_thread(name: str, thread_names: Tuple[str, ...]) -> bool:
+    """
+    empty thread_names matches every thread, otherwise the name starts with one of them
+    """
+    return not thread_names or name.startswith(thread_names)
+
+
+class ThreadProfiler:
+    """
+    cProfile only sees the thread that enables it, so every matching thread turns
+    its own profile on and off in checkpoint(), called once per loop iteration
+    of RepeatTimer, the session threads and the stream pool.
+    """
+
+    def __init__(self):
+        # read without the lock by checkpoint()
+        self.is_switching = False
+        self.is_active = False
+        self.thread_names: Tuple[str, ...] = ()
+        self.lock = Lock()
+        self.running: Dict[int, Tuple[str, cProfile.Profile]] = {}
+        self.finished: List[Tuple[str, int, cProfile.Profile]] = []
+
+    def start(self, thread_names: Tuple[str, ...] = ()):
+        with self.lock:
+            if self.is_active:
+                raise RuntimeError('cProfile is running')
+            self.thread_names = tuple(thread_names)
+            self.finished = []
+            self.is_active = True
+            self.is_switching = True
+
+    def stop(self, timeout=2.) -> List[Tuple[str, int, cProfile.Profile]]:
+        """
+        :return: (thread name, thread id, profile) of the threads that reached a checkpoint within timeout
+        """
+        with self.lock:
+            self.is_active = False
+        s = perf_counter()
+        while perf_counter() - s < timeout:
+            with self.lock:
+                if not self.running:
+                    break
+            sleep(0.05)
+        with self.lock:
+            pending = [name for name, _ in self.running.values()]
+            finished, self.finished = self.finished, []
+            if not self.running:
+                self.is_switching = False
+        if pending:
+            # blocked threads switch off at their next checkpoint, their stats are dropped
+            log.warning(f'cProfile of {pending} not collected, no checkpoint within {timeout} seconds')
+        return finished
+
+    def switch(self):
+        ident = get_ident()
+        with self.lock:
+            running = self.running.get(ident)
+            if self.is_active:
+                if running is not None:
+                    return
+                name = current_thread().name
+                if not match_thread(name, self.thread_names):
+                    return
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Python 3.12+ allows one cProfile at a time
+                    log.warning(f'cProfile of {name} not started, another profiler is active')
+                    return
+                self.running[ident] = (name, profile)
+                return
+            if running is None:
+                return
+            name, profile = self.running.pop(ident)
+            profile.disable()
+            if self.is_switching:
+                self.finished.append((name, ident, profile))
+            if not self.running:
+                self.is_switching = False
+
+
+THREAD_PROFILER = ThreadProfiler()
+
+
+def checkpoint():
+    # one attribute test while no cProfile session is running
+    if THREAD_PROFILER.is_switching:
+        THREAD_PROFILER.switch()
@@ -1,7 +1,14 @@
-from typing import List, Iterable, Union
+import numpy as np
+from typing import List, Iterable, Union, Tuple, Optional
+
+# greedy takes the pairs from the highest IoU down, optimal maximizes the total IoU (needs scipy)
+ASSIGN_METHODS = ('greedy', 'optimal')
+DIAGONAL = np.arange(8)
 
 
 class Box:
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'class_id', 'id', 'gen')
+
     def __init__(self, bbox: List):
         self.x1 = bbox[0]
         self.y1 = bbox[1]
@@ -21,90 +28,275 @@ class IDGenerator:
         self.id_map[class_id] = id_count
         return id_count
 
+    def get_many(self, class_ids: np.ndarray) -> np.ndarray:
+        """
+        :return: new ids of class_ids, in order within each class
+        """
+        ids = np.empty(len(class_ids), dtype=np.int64)
+        for class_id in np.unique(class_ids):
+            mask = class_ids == class_id
+            count = int(np.count_nonzero(mask))
+            start = self.id_map.get(int(class_id), 0)
+            ids[mask] = np.arange(start + 1, start + count + 1)
+            self.id_map[int(class_id)] = start + count
+        return ids
+
     def reset(self):
         self.id_map.clear()
 
 
+def xyxy_to_cxcywh(xyxy: np.ndarray) -> np.ndarray:
+    cxcywh = np.empty(xyxy.shape, dtype=np.float64)
+    cxcywh[:, 2:] = xyxy[:, 2:] - xyxy[:, :2]
+    cxcywh[:, :2] = xyxy[:, :2] + cxcywh[:, 2:] / 2
+    return cxcywh
+
+
+def cxcywh_to_xyxy(cxcywh: np.ndarray) -> np.ndarray:
+    xyxy = np.empty(cxcywh.shape, dtype=np.float32)
+    xyxy[:, :2] = cxcywh[:, :2] - cxcywh[:, 2:] / 2
+    xyxy[:, 2:] = cxcywh[:, :2] + cxcywh[:, 2:] / 2
+    return xyxy
+
+
+class KalmanBoxFilter:
+    """
+    Constant velocity Kalman filter of [cx, cy, w, h, vcx, vcy, vw, vh], every
+    method works on all tracks at once, mean (N, 8) and covariance (N, 8, 8).
+    Noise is relative to the box size, near and far boxes behave the same.
+    dt is in frames.
+    """
+    __slots__ = ('std_position', 'std_velocity')
+
+    def __init__(self, std_position=1 / 20, std_velocity=1 / 160):
+        self.std_position = std_position
+        self.std_velocity = std_velocity
+
+    def noise(self, mean: np.ndarray, position_scale: float, velocity_scale: float) -> np.ndarray:
+        """
+        :return: (N, 8) variances of a diagonal covariance
+        """
+        wh = mean[:, [2, 3, 2, 3]]
+        return np.concatenate((
+            np.square(position_scale * self.std_position * wh),
+            np.square(velocity_scale * self.std_velocity * wh),
+        ), axis=1)
+
+    def initiate(self, xyxy: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        mean = np.zeros((len(xyxy), 8))
+        mean[:, :4] = xyxy_to_cxcywh(xyxy)
+        covariance = np.zeros((len(xyxy), 8, 8))
+        # the velocity of a new track is unknown
+        covariance[:, DIAGONAL, DIAGONAL] = self.noise(mean, 2, 10)
+        return mean, covariance
+
+    def predict(self, mean: np.ndarray, covariance: np.ndarray, dt=1.) -> Tuple[np.ndarray, np.ndarray]:
+        motion = np.eye(8)
+        motion[:4, 4:] = dt * np.eye(4)
+        noise = dt * self.noise(mean, 1, 1)
+        mean = mean @ motion.T
+        mean[:, 2:4] = np.maximum(mean[:, 2:4], 1)
+        covariance = motion @ covariance @ motion.T
+        covariance[:, DIAGONAL, DIAGONAL] += noise
+        return mean, covariance
+
+    def update(self, mean: np.ndarray, covariance: np.ndarray, xyxy: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        corrects the tracks with their measured boxes xyxy (N, 4)
+        """
+        innovation_covariance = covariance[:, :4, :4].copy()
+        innovation_covariance[:, DIAGONAL[:4], DIAGONAL[:4]] += self.noise(mean, 1, 0)[:, :4]
+        # gain = P H^T S^-1, both P and S are symmetric
+        gain = np.linalg.solve(innovation_covariance, covariance[:, :4, :]).transpose((0, 2, 1))
+        innovation = xyxy_to_cxcywh(xyxy) - mean[:, :4]
+        mean = mean + (gain @ innovation[:, :, None])[:, :, 0]
+        covariance = covariance - gain @ covariance[:, :4, :]
+        return mean, covariance
+
+    @staticmethod
+    def extrapolate(mean: np.ndarray, dt: float) -> np.ndarray:
+        """
+        :return: (N, 4) xyxy dt frames ahead, the state is not changed
+        """
+        cxcywh = mean[:, :4] + dt * mean[:, 4:]
+        cxcywh[:, 2:] = np.maximum(cxcywh[:, 2:], 1)
+        return cxcywh_to_xyxy(cxcywh)
+
+
+def iou_matrix(xyxy1: np.ndarray, class_ids1: np.ndarray, xyxy2: np.ndarray, class_ids2: np.ndarray) -> np.ndarray:
+    """
+    :return: (N, M) IoU of every pair, 0 for pairs of different classes
+    """
+    x_left = np.maximum(xyxy1[:, None, 0], xyxy2[None, :, 0])
+    y_top = np.maximum(xyxy1[:, None, 1], xyxy2[None, :, 1])
+    x_right = np.minimum(xyxy1[:, None, 2], xyxy2[None, :, 2])
+    y_bottom = np.minimum(xyxy1[:, None, 3], xyxy2[None, :, 3])
+    inter_area = np.clip(x_right - x_left, 0, None) * np.clip(y_bottom - y_top, 0, None)
+    area1 = (xyxy1[:, 2] - xyxy1[:, 0]) * (xyxy1[:, 3] - xyxy1[:, 1])
+    area2 = (xyxy2[:, 2] - xyxy2[:, 0]) * (xyxy2[:, 3] - xyxy2[:, 1])
+    union = area1[:, None] + area2[None, :] - inter_area
+    iou = inter_area / np.maximum(union, np.finfo(np.float32).eps)
+    iou[class_ids1[:, None] != class_ids2[None, :]] = 0
+    return iou
+
+
+def greedy_assign(iou: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    pairs from the highest IoU down, each row and column used once
+    :return: row indices, column indices
+    """
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind='stable')
+    rows, cols = rows[order], cols[order]
+    used_rows = np.zeros(iou.shape[0], dtype=bool)
+    used_cols = np.zeros(iou.shape[1], dtype=bool)
+    keep = np.zeros(len(rows), dtype=bool)
+    # only the candidate pairs above the threshold are visited, a few per box
+    for index, (row, col) in enumerate(zip(rows.tolist(), cols.tolist())):
+        if used_rows[row] or used_cols[col]:
+            continue
+        used_rows[row] = used_cols[col] = True
+        keep[index] = True
+    return rows[keep], cols[keep]
+
+
+def optimal_assign(iou: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    the assignment with the largest total IoU, pairs under threshold are dropped afterwards
+    :return: row indices, column indices
+    """
+    from scipy.optimize import linear_sum_assignment
+    rows, cols = linear_sum_assignment(iou, maximize=True)
+    keep = iou[rows, cols] >= threshold
+    return rows[keep], cols[keep]
+
+
 class Tracker:
-    def __init__(self, iou_threshold: float, generation_limit=3):
+    """
+    Tracks are kept in arrays with a Kalman state each. update() moves every
+    track to the time of the new detection, then matches the new boxes against
+    the predicted boxes with one class masked IoU matrix, so fast objects keep
+    their id when detection runs slower than the video. A matched box takes
+    the id of its track and corrects its state, tracks without a match age one
+    generation and are dropped after generation_limit detections. get_tracks(dt)
+    gives the boxes between two detections.
+    """
+    __slots__ = (
+        'iou_threshold', 'generation_limit', 'method', 'id_generator', 'kalman',
+        'mean', 'covariance', 'class_ids', 'ids', 'gens', 'scores'
+    )
+
+    def __init__(self, iou_threshold: float, generation_limit=3, method='greedy'):
+        if method not in ASSIGN_METHODS:
+            raise ValueError(f'Assign method must be one of {ASSIGN_METHODS}')
         self.iou_threshold = iou_threshold
-        self.tracked: List[Box] = []
-        self.id_generator = IDGenerator()
         self.generation_limit = generation_limit
+        self.method = method
+        self.id_generator = IDGenerator()
+        self.kalman = KalmanBoxFilter()
+        self.mean = np.zeros((0, 8))
+        self.covariance = np.zeros((0, 8, 8))
+        self.class_ids = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.gens = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0, dtype=np.float32)
 
     def __str__(self):
         s = ''
-        for box in self.tracked:
-            s += f'x1:{box.x1}, y1:{box.y1}, x2:{box.x2}, y2:{box.y2}, id:{box.id}, gen:{box.gen}' + '\n'
+        for (x1, y1, x2, y2), track_id, gen in zip(self.xyxy.tolist(), self.ids.tolist(), self.gens.tolist()):
+            s += f'x1:{x1}, y1:{y1}, x2:{x2}, y2:{y2}, id:{track_id}, gen:{gen}' + '\n'
         s += '-----------------------------\n'
         return s
 
-    def get(self):
-        return [box for box in self.tracked if box.gen == 0]
-
-    def update(self, boxes: Iterable):
-        if len(self.tracked) == 0:
-            self.add_all_boxes(boxes)
-            return
-        tracked = []
-        for box in boxes:
-            box = Box(box)
-            match_box = self.pop_match_box(box)
-            if match_box is None:
-                box.id = self.id_generator.get(box.class_id)
-                tracked.append(box)
-            else:
-                box.id = match_box.id
-                tracked.append(box)
-
-        self.filtrate_generation()
-        self.tracked.extend(tracked)
-
-    def pop_match_box(self, box: Box) -> Union[Box, None]:
-        max_iou_score = 0
-        exist_box_id = 0
-        for index, exist_box in enumerate(self.tracked):
-            if box.class_id != exist_box.class_id:
-                continue
-            iou_score = self.calc_iou(box, exist_box)
-            if iou_score > max_iou_score:
-                max_iou_score = iou_score
-                exist_box_id = index
-        if max_iou_score >= self.iou_threshold:
-            return self.tracked.pop(exist_box_id)
-
-        return None
-
-    def calc_iou(self, box1: Box, box2: Box) -> float:
-        if box1.class_id != box2.class_id:
-            return 0.0
-
-        x_left = max(box1.x1, box2.x1)
-        y_top = max(box1.y1, box2.y1)
-        x_right = min(box1.x2, box2.x2)
-        y_bottom = min(box1.y2, box2.y2)
-
-        if x_right < x_left or y_bottom < y_top:
-            return 0.0
-
-        inter_area = (x_right - x_left) * (y_bottom - y_top)
-        box1_area = (box1.x2 - box1.x1) * (box1.y2 - box1.y1)
-        box2_area = (box2.x2 - box2.x1) * (box2.y2 - box2.y1)
-
-        return inter_area / (box1_area + box2_area - inter_area)
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def xyxy(self) -> np.ndarray:
+        """
+        (N, 4) boxes of all tracks at the time of the last update or predict
+        """
+        return cxcywh_to_xyxy(self.mean[:, :4])
+
+    def get(self) -> List[Box]:
+        """
+        boxes of the last update
+        """
+        boxes = []
+        xyxy, class_ids, ids, _ = self.get_tracks()
+        for (x1, y1, x2, y2), class_id, track_id in zip(xyxy.tolist(), class_ids.tolist(), ids.tolist()):
+            box = Box([x1, y1, x2, y2, class_id])
+            box.id = track_id
+            boxes.append(box)
+        return boxes
+
+    def get_tracks(self, dt=0.) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :param dt: frames after the last update, the boxes are moved by their velocity
+        :return: xyxy (N, 4), class ids (N,), track ids (N,), scores (N,) of the boxes of the last update
+        """
+        seen = self.gens == 0
+        mean = self.mean[seen]
+        if dt > 0:
+            xyxy = self.kalman.extrapolate(mean, dt)
+        else:
+            xyxy = cxcywh_to_xyxy(mean[:, :4])
+        return xyxy, self.class_ids[seen], self.ids[seen], self.scores[seen]
+
+    def predict(self, dt=1.):
+        """
+        moves every track dt frames ahead without a detection
+        """
+        if len(self.ids) and dt > 0:
+            self.mean, self.covariance = self.kalman.predict(self.mean, self.covariance, dt)
+
+    def update(self, boxes: Union[Iterable, np.ndarray], dt=1., scores: Optional[Iterable] = None):
+        """
+        :param boxes: (N, 5) [x1, y1, x2, y2, class id], array, nested list or DetectResult.boxes
+        :param dt: frames since the last update, or since the last predict
+        :param scores: (N,) kept with the tracks, 1 if None
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape((-1, 5))
+        xyxy = boxes[:, :4]
+        class_ids = boxes[:, 4].astype(np.int64)
+        if scores is None:
+            scores = np.ones(len(boxes), dtype=np.float32)
+        else:
+            scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.predict(dt)
+
+        ids = np.empty(len(boxes), dtype=np.int64)
+        mean = np.empty((len(boxes), 8))
+        covariance = np.empty((len(boxes), 8, 8))
+        is_matched_track = np.zeros(len(self.ids), dtype=bool)
+        is_new = np.ones(len(boxes), dtype=bool)
+        if len(boxes) and len(self.ids):
+            iou = iou_matrix(xyxy, class_ids, self.xyxy, self.class_ids)
+            assign = greedy_assign if self.method == 'greedy' else optimal_assign
+            rows, cols = assign(iou, self.iou_threshold)
+            ids[rows] = self.ids[cols]
+            mean[rows], covariance[rows] = self.kalman.update(self.mean[cols], self.covariance[cols], xyxy[rows])
+            is_matched_track[cols] = True
+            is_new[rows] = False
+        ids[is_new] = self.id_generator.get_many(class_ids[is_new])
+        mean[is_new], covariance[is_new] = self.kalman.initiate(xyxy[is_new])
+
+        # old tracks first, the boxes of this update follow in their input order
+        old = ~is_matched_track
+        gens = self.gens[old] + 1
+        alive = gens <= self.generation_limit
+        self.mean = np.concatenate((self.mean[old][alive], mean))
+        self.covariance = np.concatenate((self.covariance[old][alive], covariance))
+        self.class_ids = np.concatenate((self.class_ids[old][alive], class_ids))
+        self.ids = np.concatenate((self.ids[old][alive], ids))
+        self.gens = np.concatenate((gens[alive], np.zeros(len(boxes), dtype=np.int64)))
+        self.scores = np.concatenate((self.scores[old][alive], scores))
 
     def reset(self):
-        self.tracked.clear()
+        self.mean = self.mean[:0]
+        self.covariance = self.covariance[:0]
+        self.class_ids = self.class_ids[:0]
+        self.ids = self.ids[:0]
+        self.gens = self.gens[:0]
+        self.scores = self.scores[:0]
         self.id_generator.reset()
-
-    def add_all_boxes(self, boxes):
-        for box in boxes:
-            box = Box(box)
-            box.id = self.id_generator.get(box.class_id)
-            self.tracked.append(box)
-
-    def filtrate_generation(self):
-        for box in self.tracked:
-            box.gen += 1
-            if box.gen > self.generation_limit:
-                self.tracked.remove(box)
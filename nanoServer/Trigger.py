@@ -0,0 +1,130 @@
+import logging as log
+from threading import Condition, Lock
+from time import perf_counter, sleep
+from typing import Callable, Any, List
+
+
+class Trigger:
+    """
+    Fired by a producer (new camera frame, detection done, state change).
+    Every waiter wakes once per fire, fires while a routine runs are merged
+    into one, so it always works on the newest state.
+    min_interval limits how often one waiter wakes up.
+    """
+
+    def __init__(self, name='Trigger', min_interval=0.):
+        if min_interval < 0:
+            raise ValueError('min_interval must not less than 0')
+        self.name = name
+        self.min_interval = min_interval
+        self.generation = 0
+        self.condition = Condition()
+        self.listeners: List[Callable[[], Any]] = []
+        self.listeners_lock = Lock()
+
+    def __str__(self):
+        return f'{self.name}: fired {self.generation} times'
+
+    def fire(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+        with self.listeners_lock:
+            listeners = tuple(self.listeners)
+        for listener in listeners:
+            try:
+                listener()
+            except Exception:
+                log.error(f'{self.name} listener fail', exc_info=True)
+
+    def add_listener(self, listener: Callable[[], Any]):
+        """
+        listener() runs on the thread that fires, it must be short
+        """
+        with self.listeners_lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], Any]):
+        with self.listeners_lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def set_min_interval(self, min_interval: float):
+        if min_interval < 0:
+            raise ValueError('min_interval must not less than 0')
+        self.min_interval = min_interval
+
+    def waiter(self) -> 'TriggerWaiter':
+        return TriggerWaiter(self)
+
+
+class TriggerWaiter:
+    """
+    the fires one routine has seen, a waiter belongs to one thread
+    """
+
+    def __init__(self, trigger: Trigger):
+        self.trigger = trigger
+        # fires before the routine started are not waited again
+        self.generation = -1
+        self.next_time = 0.
+
+    def wait(self, timeout: float) -> bool:
+        """
+        :return: True if the trigger fired since the last True
+        """
+        trigger = self.trigger
+        with trigger.condition:
+            if trigger.generation == self.generation:
+                trigger.condition.wait(timeout)
+            if trigger.generation == self.generation:
+                return False
+        now = perf_counter()
+        if now < self.next_time:
+            sleep(self.next_time - now)
+            now = perf_counter()
+        # fires during the sleep are covered by this run
+        with trigger.condition:
+            self.generation = trigger.generation
+        self.next_time = now + trigger.min_interval
+        return True
+
+
+class RateTrigger(Trigger):
+    """
+    Fires by itself rate times a second, without a thread of its own,
+    every waiter keeps its own schedule. fire() still wakes waiters at once.
+    """
+
+    def __init__(self, rate: float, name='RateTrigger'):
+        if rate <= 0:
+            raise ValueError('rate must greater than 0')
+        Trigger.__init__(self, name)
+        self.interval = 1 / rate
+
+    def waiter(self) -> 'RateWaiter':
+        return RateWaiter(self)
+
+
+class RateWaiter(TriggerWaiter):
+    def __init__(self, trigger: RateTrigger):
+        TriggerWaiter.__init__(self, trigger)
+        self.generation = trigger.generation
+        self.next_tick = perf_counter()
+
+    def wait(self, timeout: float) -> bool:
+        trigger = self.trigger
+        with trigger.condition:
+            remaining = self.next_tick - perf_counter()
+            if remaining > 0 and trigger.generation == self.generation:
+                trigger.condition.wait(min(remaining, timeout))
+            is_fired = trigger.generation != self.generation
+            self.generation = trigger.generation
+        now = perf_counter()
+        if not is_fired and now < self.next_tick:
+            return False
+        # a late routine skips the ticks it missed instead of running them back to back
+        self.next_tick += trigger.interval
+        if self.next_tick < now:
+            self.next_tick = now + trigger.interval
+        return True
@@ -1,21 +1,51 @@
+import json
 from socket import socket
-from struct import pack, unpack, calcsize
+from struct import pack, unpack, calcsize, Struct
+from typing import Union
+
+# a binary frame starts with a zero byte, which JSON text never does, followed by
+# the length of the JSON message and the message itself, the rest is the payload
+BINARY_MARK = 0
+BINARY_HEADER = Struct('>BI')
+PAYLOAD_KEY = 'PAYLOAD'
 
 
 def recv(sock: socket, header: str = '>i', encoding: str = 'utf8') -> str:
+    return recv_frame(sock, header).decode(encoding)
+
+
+def recv_frame(sock: socket, header: str = '>i') -> bytearray:
     header_size = calcsize(header)
     head = recv_all(sock, header_size)
     head = unpack(header, head)[0]
-    return recv_all(sock, head).decode(encoding)
+    return recv_all(sock, head)
+
+
+def recv_message(sock: socket, header: str = '>i', encoding: str = 'utf8') -> Union[str, dict]:
+    """
+    :return: JSON text, or the message dict of a binary frame with its payload under PAYLOAD_KEY
+    """
+    frame = recv_frame(sock, header)
+    if not frame or frame[0] != BINARY_MARK:
+        return frame.decode(encoding)
+    _, message_size = BINARY_HEADER.unpack_from(frame)
+    offset = BINARY_HEADER.size + message_size
+    message = json.loads(frame[BINARY_HEADER.size:offset].decode(encoding))
+    if type(message) is not dict:
+        raise TypeError('Binary frame message must be a JSON dictionary')
+    message[PAYLOAD_KEY] = memoryview(frame)[offset:]
+    return message
 
 
 def recv_all(sock: socket, byte_len: int) -> bytearray:
-    buffer = bytearray()
-    while len(buffer) < byte_len:
-        byte = sock.recv(byte_len - len(buffer))
-        if not byte:
+    buffer = bytearray(byte_len)
+    view = memoryview(buffer)
+    received = 0
+    while received < byte_len:
+        size = sock.recv_into(view[received:], byte_len - received)
+        if not size:
             raise RuntimeError('pipe close')
-        buffer.extend(byte)
+        received += size
     return buffer
 
 
@@ -26,11 +56,25 @@ def send(sock: socket, message: str, header: str = '>i', encoding: str = 'utf-8'
     send_all(sock, byte)
 
 
+def send_binary(sock: socket, message: dict, payload, header: str = '>i', encoding: str = 'utf-8'):
+    """
+    :param payload: bytes-like, sent as is without base64
+    """
+    byte = json.dumps(message).encode(encoding)
+    payload = memoryview(payload).cast('B')
+    send_all(sock, pack(header, BINARY_HEADER.size + len(byte) + len(payload)))
+    send_all(sock, BINARY_HEADER.pack(BINARY_MARK, len(byte)))
+    send_all(sock, byte)
+    send_all(sock, payload)
+
+
 def send_all(sock: socket, byte):
     total_send = 0
+    # slicing a memoryview does not copy the rest of the buffer
+    view = memoryview(byte)
 
-    while total_send < len(byte):
-        sent = sock.send(byte[total_send:])
+    while total_send < len(view):
+        sent = sock.send(view[total_send:])
         if not sent:
             raise RuntimeError('Pipline close')
         total_send += sent
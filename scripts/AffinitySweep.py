@@ -0,0 +1,124 @@
+import sys
+
+sys.path.append('.')
+import os
+import json
+import subprocess
+import numpy as np
+from threading import Thread, Event
+from time import perf_counter, sleep
+
+
+def pwm_jitter(cpus, stop: Event, period=0.005, samples=None):
+    """
+    a software PWM loop like PWMSimulator, records how late each edge is
+    """
+    from nanoServer.Affinity import set_thread_affinity
+    set_thread_affinity(cpus)
+    deadline = perf_counter()
+    while not stop.is_set():
+        deadline += period / 2
+        sleep(max(deadline - perf_counter(), 0))
+        samples.append(perf_counter() - deadline)
+
+
+def run_split(config, image_path, detector_cpus, other_cpus, seconds):
+    """
+    runs in a fresh process, Tensorflow thread settings only apply before it starts
+    """
+    import cv2
+    from nanoServer.Affinity import set_thread_affinity, configure_tensorflow
+    from nanoServer.Detector.Detector import Detector
+    from nanoServer.Detector.core.configer import YOLOConfiger
+
+    set_thread_affinity(detector_cpus)
+    configure_tensorflow(len(detector_cpus), 1)
+    configer = YOLOConfiger(config)
+    configer.num_threads = len(detector_cpus)
+    detector = Detector(configer)
+    detector.warm_up()
+    image = cv2.imread(image_path)
+
+    samples = []
+    stop = Event()
+    pwm = Thread(target=pwm_jitter, args=(other_cpus, stop), kwargs={'samples': samples})
+    pwm.start()
+    frames = 0
+    s = perf_counter()
+    while perf_counter() - s < seconds:
+        detector.detect(image)
+        frames += 1
+    fps = frames / (perf_counter() - s)
+    stop.set()
+    pwm.join()
+    jitter = np.array(samples) * 1000
+    return {
+        'fps': fps,
+        'jitter_p50': float(np.percentile(jitter, 50)),
+        'jitter_p99': float(np.percentile(jitter, 99)),
+    }
+
+
+def candidates(num_cpus):
+    """
+    detector gets the first k cores, camera / network / PWM share the rest,
+    the last candidate is no affinity at all
+    """
+    all_cpus = list(range(num_cpus))
+    for k in range(1, num_cpus):
+        yield all_cpus[:k], all_cpus[k:]
+    yield all_cpus, all_cpus
+
+
+def fmt(cpus):
+    return ','.join(map(str, cpus))
+
+
+if __name__ == '__main__':
+    # python3 scripts/AffinitySweep.py configs/yolov4-tiny-416.json person.jpg [SECONDS] [MAX_JITTER_MS]
+    if len(sys.argv) >= 2 and sys.argv[1] == '--split':
+        _, _, config, image_path, detector_cpus, other_cpus, seconds = sys.argv
+        result = run_split(
+            config,
+            image_path,
+            [int(c) for c in detector_cpus.split(',')],
+            [int(c) for c in other_cpus.split(',')],
+            float(seconds)
+        )
+        print(json.dumps(result))
+        exit(0)
+    if len(sys.argv) < 3:
+        print('usage: AffinitySweep.py CONFIG IMAGE [SECONDS] [MAX_JITTER_MS]')
+        exit(1)
+    config, image_path = sys.argv[1:3]
+    seconds = sys.argv[3] if len(sys.argv) > 3 else '10'
+    max_jitter = float(sys.argv[4]) if len(sys.argv) > 4 else 1.
+
+    results = []
+    print('%-12s %-12s %8s %12s %12s' % ('detector', 'others', 'FPS', 'p50(ms)', 'p99(ms)'))
+    for detector_cpus, other_cpus in candidates(os.cpu_count() or 1):
+        output = subprocess.run(
+            [sys.executable, __file__, '--split', config, image_path, fmt(detector_cpus), fmt(other_cpus), seconds],
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append((detector_cpus, other_cpus, result))
+        print('%-12s %-12s %8.2f %12.3f %12.3f' % (
+            fmt(detector_cpus), fmt(other_cpus), result['fps'], result['jitter_p50'], result['jitter_p99']
+        ))
+
+    # the fastest split that keeps PWM edges on time, otherwise the steadiest one
+    stable = [r for r in results if r[2]['jitter_p99'] <= max_jitter]
+    if stable:
+        detector_cpus, other_cpus, _ = max(stable, key=lambda r: r[2]['fps'])
+    else:
+        detector_cpus, other_cpus, _ = min(results, key=lambda r: r[2]['jitter_p99'])
+    print('\nRecommended sys.ini')
+    print('[Performance]')
+    print(f'detector_threads = {len(detector_cpus)}')
+    print('tf_inter_op_threads = 1')
+    print(f'detector_cpus = {fmt(detector_cpus)}')
+    for name in ('camera_cpus', 'network_cpus', 'pwm_cpus'):
+        print(f'{name} = {fmt(other_cpus)}')
@@ -0,0 +1,48 @@
+import sys
+
+sys.path.append('.')
+import os
+from threading import Thread
+from nanoServer.Affinity import PROCESS_CPUS, set_thread_affinity
+
+
+def thread_cpus(cpus) -> set:
+    result = set()
+
+    def pin():
+        set_thread_affinity(cpus)
+        result.update(os.sched_getaffinity(0))
+
+    t = Thread(target=pin)
+    t.start()
+    t.join()
+    return result
+
+
+def check_disjoint_sets():
+    """
+    a thread started by a pinned thread moves to a disjoint set, like the detector
+    threads started after the main thread is pinned to the network cpus
+    """
+    cpus = sorted(PROCESS_CPUS)
+    if len(cpus) < 2:
+        print(f'disjoint sets: skipped, process has cpus {cpus}')
+        return
+    a = set(cpus[:len(cpus) // 2])
+    b = set(cpus[len(cpus) // 2:])
+    main_cpus = os.sched_getaffinity(0)
+    try:
+        set_thread_affinity(a)
+        assert os.sched_getaffinity(0) == a, os.sched_getaffinity(0)
+        assert thread_cpus(b) == b
+        # a partly overlapping set keeps only the cpus of the process
+        assert thread_cpus(b | {max(cpus) + 1}) == b
+    finally:
+        os.sched_setaffinity(0, main_cpus)
+    print('disjoint sets: ok')
+
+
+if __name__ == '__main__':
+    # python3 scripts/AffinityTest.py
+    # taskset -c 0-3 python3 scripts/AffinityTest.py
+    check_disjoint_sets()
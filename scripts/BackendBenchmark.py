@@ -0,0 +1,90 @@
+import sys
+
+sys.path.append('.')
+import cv2
+import numpy as np
+from time import perf_counter
+from nanoServer.Detector.core.configer import YOLOConfiger
+from nanoServer.Detector.core.converter import list_images
+from nanoServer.Detector.Detector import Detector
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def match(reference, boxes, iou_threshold=0.5):
+    """
+    count boxes of the reference detector found again by the compared detector
+    """
+    reference = np.array(reference, dtype=np.float32).reshape(-1, 5)
+    boxes = np.array(boxes, dtype=np.float32).reshape(-1, 5)
+    used = np.zeros(len(boxes), dtype=bool)
+    matched = 0
+    for ref in reference:
+        candidate = (boxes[:, 4] == ref[4]) & ~used
+        if not np.any(candidate):
+            continue
+        ious = np.where(candidate, box_iou(ref, boxes), 0)
+        best = int(np.argmax(ious))
+        if ious[best] >= iou_threshold:
+            used[best] = True
+            matched += 1
+    return matched, len(reference), len(boxes)
+
+
+def run(detector, images, warm_up=3):
+    for image in images[:warm_up]:
+        detector.detect(image)
+    results = []
+    times = []
+    for image in images:
+        s = perf_counter()
+        results.append(detector.detect(image).boxes)
+        times.append(perf_counter() - s)
+    return results, np.array(times)
+
+
+if __name__ == '__main__':
+    # python3 scripts/BackendBenchmark.py images/ configs/yolov4-416.json configs/yolov4-416-int8.json ...
+    if len(sys.argv) < 4:
+        print('usage: BackendBenchmark.py IMAGE_DIR REFERENCE_CONFIG CONFIG [CONFIG ...]')
+        exit(1)
+    image_dir, reference_config, *configs = sys.argv[1:]
+    images = [cv2.imread(str(p)) for p in list_images(image_dir)]
+    images = [image for image in images if image is not None]
+
+    reference_detector = Detector(YOLOConfiger(reference_config))
+    reference_results, reference_times = run(reference_detector, images)
+    del reference_detector
+
+    print('%-30s %-8s %10s %8s %8s %8s' % ('config', 'frame', 'time(ms)', 'FPS', 'recall', 'precision'))
+    print('%-30s %-8s %10.2f %8.2f %8s %8s' % (
+        reference_config, 'tf', reference_times.mean() * 1000, 1 / reference_times.mean(), '-', '-'
+    ))
+    for config in configs:
+        configer = YOLOConfiger(config)
+        detector = Detector(configer)
+        results, times = run(detector, images)
+        matched = total_reference = total = 0
+        for reference, boxes in zip(reference_results, results):
+            m, r, t = match(reference, boxes)
+            matched += m
+            total_reference += r
+            total += t
+        print('%-30s %-8s %10.2f %8.2f %8.3f %8.3f' % (
+            config,
+            configer.frame_work,
+            times.mean() * 1000,
+            1 / times.mean(),
+            matched / max(total_reference, 1),
+            matched / max(total, 1),
+        ))
+        del detector
@@ -0,0 +1,76 @@
+import sys
+
+sys.path.append('.')
+import cv2
+from time import perf_counter
+from nanoServer.Detector.core.configer import YOLOConfiger
+from nanoServer.Detector.Detector import Detector
+from nanoServer.Detector.CascadeDetector import CascadeDetector
+from BackendBenchmark import match
+
+
+def read_clip(video_path, max_frames=300):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def run(detector, frames):
+    """
+    frames are detected back to back like the Streamer, the FPS includes every cascade decision
+    """
+    detector.warm_up()
+    results = []
+    s = perf_counter()
+    for frame in frames:
+        results.append(detector.detect(frame).boxes)
+    return results, len(frames) / (perf_counter() - s)
+
+
+def recall(reference_results, results):
+    matched = total_reference = total = 0
+    for reference, boxes in zip(reference_results, results):
+        m, r, t = match(reference, boxes)
+        matched += m
+        total_reference += r
+        total += t
+    return matched / max(total_reference, 1), matched / max(total, 1)
+
+
+if __name__ == '__main__':
+    # python3 scripts/CascadeBenchmark.py clip.mp4 configs/yolov4-tiny-416.json configs/yolov4-416.json
+    # the light config may set cascade_mode / cascade_low / cascade_high / cascade_target_fps
+    if len(sys.argv) < 4:
+        print('usage: CascadeBenchmark.py VIDEO LIGHT_CONFIG FULL_CONFIG')
+        exit(1)
+    video_path, light_config, full_config = sys.argv[1:4]
+    frames = read_clip(video_path)
+    light_configer = YOLOConfiger(light_config)
+    full_configer = YOLOConfiger(full_config)
+
+    # there is no ground truth for a recorded clip, the full model is the reference
+    full_detector = Detector(full_configer)
+    full_results, full_fps = run(full_detector, frames)
+    full_detector.release()
+
+    print('%-10s %8s %8s %8s' % ('model', 'FPS', 'recall', 'precision'))
+    print('%-10s %8.2f %8s %8s' % ('full', full_fps, '-', '-'))
+
+    light_detector = Detector(light_configer)
+    light_results, light_fps = run(light_detector, frames)
+    light_detector.release()
+    print('%-10s %8.2f %8.3f %8.3f' % ('light', light_fps, *recall(full_results, light_results)))
+
+    for mode in ('crop', 'frame'):
+        light_configer.cascade_mode = mode
+        cascade_detector = CascadeDetector(light_configer, full_configer)
+        cascade_results, cascade_fps = run(cascade_detector, frames)
+        print('%-10s %8.2f %8.3f %8.3f' % (f'cascade-{mode}', cascade_fps, *recall(full_results, cascade_results)))
+        print(cascade_detector)
+        cascade_detector.release()
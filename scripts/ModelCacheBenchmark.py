@@ -0,0 +1,44 @@
+import sys
+
+sys.path.append('.')
+import shutil
+import numpy as np
+import tensorflow as tf
+from time import perf_counter
+from nanoServer.Detector.core.configer import YOLOConfiger
+from nanoServer.Detector.core.models import build_model, inference_cache_path, load_inference_model
+
+
+def first_inference(infer, size):
+    s = perf_counter()
+    infer(np.zeros((1, size, size, 3), dtype=np.float32))
+    return perf_counter() - s
+
+
+if __name__ == '__main__':
+    # python3 scripts/ModelCacheBenchmark.py configs/yolov4-416.json configs/yolov4-tiny-416.json
+    if len(sys.argv) < 2:
+        print('usage: ModelCacheBenchmark.py CONFIG [CONFIG ...]')
+        exit(1)
+    print('%-30s %10s %10s %10s %10s' % ('config', 'build(s)', 'infer(s)', 'cached(s)', 'infer(s)'))
+    for config in sys.argv[1:]:
+        configer = YOLOConfiger(config)
+        shutil.rmtree(inference_cache_path(configer), ignore_errors=True)
+
+        tf.keras.backend.clear_session()
+        s = perf_counter()
+        model = build_model(configer, training=False, is_filter=False)
+        build_time = perf_counter() - s
+        build_infer_time = first_inference(lambda batch: model(batch, training=False), configer.size)
+
+        # the first call writes the cache, the second one is a cold start from it
+        tf.keras.backend.clear_session()
+        load_inference_model(configer)
+        tf.keras.backend.clear_session()
+        s = perf_counter()
+        infer = load_inference_model(configer)
+        load_time = perf_counter() - s
+        load_infer_time = first_inference(infer, configer.size)
+        print('%-30s %10.2f %10.2f %10.2f %10.2f' % (
+            config, build_time, build_infer_time, load_time, load_infer_time
+        ))
@@ -0,0 +1,87 @@
+import sys
+
+sys.path.append('.')
+import numpy as np
+import tensorflow as tf
+from timeit import timeit
+from nanoServer.Detector.core import postprocess, utils
+
+
+def legacy_nms(bboxes, iou_threshold):
+    """
+    utils.nms before the NumPy rewrite
+    """
+    classes_in_img = list(set(bboxes[:, 5]))
+    best_bboxes = []
+
+    for cls in classes_in_img:
+        cls_mask = (bboxes[:, 5] == cls)
+        cls_bboxes = bboxes[cls_mask]
+
+        while len(cls_bboxes) > 0:
+            max_ind = np.argmax(cls_bboxes[:, 4])
+            best_bbox = cls_bboxes[max_ind]
+            best_bboxes.append(best_bbox)
+            cls_bboxes = np.concatenate([cls_bboxes[: max_ind], cls_bboxes[max_ind + 1:]])
+            iou = utils.bbox_iou(best_bbox[np.newaxis, :4], cls_bboxes[:, :4])
+            weight = np.ones((len(iou),), dtype=np.float32)
+            weight[iou > iou_threshold] = 0.0
+            cls_bboxes[:, 4] = cls_bboxes[:, 4] * weight
+            cls_bboxes = cls_bboxes[cls_bboxes[:, 4] > 0.]
+
+    return best_bboxes
+
+
+def random_bboxes(rng, num_boxes, num_class=4, size=416):
+    xy = rng.uniform(0, size, size=(num_boxes, 2))
+    wh = rng.uniform(4, size / 3, size=(num_boxes, 2))
+    scores = rng.uniform(size=(num_boxes, 1))
+    classes = rng.integers(0, num_class, size=(num_boxes, 1))
+    return np.concatenate((xy, xy + wh, scores, classes), axis=-1).astype(np.float32)
+
+
+def random_predictions(rng, num_boxes, num_class=4, size=416):
+    xy = rng.uniform(0, size, size=(num_boxes, 2))
+    wh = rng.uniform(4, size / 3, size=(num_boxes, 2))
+    pred_xywh = np.concatenate((xy, wh), axis=-1).astype(np.float32)
+    pred_prob = (rng.uniform(size=(num_boxes, num_class)) ** 8).astype(np.float32)
+    return pred_xywh, pred_prob
+
+
+def tf_postprocess(pred_xywh, pred_prob):
+    num_boxes = len(pred_xywh)
+    yxyx = postprocess.xywh_to_xyxy(pred_xywh)[:, [1, 0, 3, 2]]
+    return tf.image.combined_non_max_suppression(
+        boxes=tf.reshape(yxyx, (1, num_boxes, 1, 4)),
+        scores=pred_prob[np.newaxis],
+        max_output_size_per_class=50,
+        max_total_size=50,
+        iou_threshold=0.45,
+        score_threshold=0.25,
+    )
+
+
+def np_postprocess(pred_xywh, pred_prob):
+    return postprocess.postprocess(pred_xywh, pred_prob, 416, 1280, 720, 0.25, 0.45, 50, 50)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    number = 5
+    print('utils.nms')
+    print('%8s %14s %14s' % ('boxes', 'legacy(ms)', 'numpy(ms)'))
+    for num_boxes in (100, 500, 2000):
+        bboxes = random_bboxes(rng, num_boxes)
+        legacy = timeit(lambda: legacy_nms(bboxes.copy(), 0.45), number=number) / number
+        vectorized = timeit(lambda: utils.nms(bboxes.copy(), 0.45), number=number) / number
+        print('%8d %14.3f %14.3f' % (num_boxes, legacy * 1000, vectorized * 1000))
+
+    # yolov4-416 has 10647 candidate boxes, the tiny model 2535
+    print('filter + class-aware NMS of one frame')
+    print('%8s %14s %14s' % ('boxes', 'tf(ms)', 'numpy(ms)'))
+    for num_boxes in (2535, 10647):
+        pred_xywh, pred_prob = random_predictions(rng, num_boxes)
+        tf_postprocess(pred_xywh, pred_prob)
+        tf_time = timeit(lambda: tf_postprocess(pred_xywh, pred_prob), number=number) / number
+        np_time = timeit(lambda: np_postprocess(pred_xywh, pred_prob), number=number) / number
+        print('%8d %14.3f %14.3f' % (num_boxes, tf_time * 1000, np_time * 1000))
@@ -0,0 +1,71 @@
+import sys
+
+sys.path.append('.')
+import cv2
+from collections import deque
+from time import perf_counter, sleep
+from nanoServer.Detector.ConfigManager import ConfigManager
+from nanoServer.Detector.DetectorPool import DetectorPool
+from nanoServer.Detector.core.converter import list_images
+
+
+def wait_loaded(manager, config_name, timeout=300):
+    s = perf_counter()
+    while perf_counter() - s < timeout:
+        configer = manager.get_config()
+        if configer is not None and configer.name == config_name:
+            return
+        sleep(0.5)
+    raise TimeoutError(f'Loading {config_name} timeout')
+
+
+def run_pool(pool: DetectorPool, images, num_requests, window):
+    """
+    keep `window` requests in flight like a pipelining client
+    """
+    pending = deque()
+    s = perf_counter()
+    for i in range(num_requests):
+        if len(pending) >= window:
+            pending.popleft().result()
+        pending.append(pool.detect_async(images[i % len(images)]))
+    while pending:
+        pending.popleft().result()
+    return num_requests / (perf_counter() - s)
+
+
+def run_single(manager: ConfigManager, images, num_requests):
+    s = perf_counter()
+    for i in range(num_requests):
+        manager.detect(images[i % len(images)])
+    return num_requests / (perf_counter() - s)
+
+
+if __name__ == '__main__':
+    # python3 scripts/PoolBenchmark.py configs/ yolov4-tiny-416-onnx images/ 1 2 4 8
+    if len(sys.argv) < 5:
+        print('usage: PoolBenchmark.py CONFIGS_DIR CONFIG_NAME IMAGE_DIR WORKERS [WORKERS ...]')
+        exit(1)
+    configs_dir, config_name, image_dir, *workers = sys.argv[1:]
+    images = [cv2.imread(str(p)) for p in list_images(image_dir)]
+    images = [image for image in images if image is not None]
+    num_requests = 200
+
+    # the cache would hide the model cost on repeated images
+    manager = ConfigManager(configs_dir, cache_size=0)
+    manager.set_config(config_name)
+    wait_loaded(manager, config_name)
+    run_single(manager, images, 10)
+    base_fps = run_single(manager, images, num_requests)
+    manager.close()
+
+    print('%-10s %8s %8s' % ('workers', 'FPS', 'speedup'))
+    print('%-10s %8.2f %8.2f' % ('in-proc', base_fps, 1))
+    for num_workers in map(int, workers):
+        pool = DetectorPool(configs_dir, num_workers=num_workers, cache_size=0)
+        pool.set_config(config_name)
+        wait_loaded(pool, config_name)
+        run_pool(pool, images, num_workers * 4, num_workers * 2)
+        fps = run_pool(pool, images, num_requests, num_workers * 2)
+        print('%-10d %8.2f %8.2f' % (num_workers, fps, fps / base_fps))
+        pool.close()
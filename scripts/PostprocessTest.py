@@ -0,0 +1,108 @@
+import sys
+
+sys.path.append('.')
+import numpy as np
+import tensorflow as tf
+from nanoServer.Detector.core.configer import YOLOConfiger
+from nanoServer.Detector.core.yolov4 import decode_tf
+from nanoServer.Detector.core import postprocess
+
+
+def check_decode(configer: YOLOConfiger, batch_size=2):
+    rng = np.random.default_rng(0)
+    decoder = postprocess.YOLODecoder(configer)
+    feature_maps = [
+        rng.normal(size=(batch_size, output_size, output_size, 3 * (5 + configer.num_class))).astype(np.float32)
+        for output_size in decoder.output_sizes
+    ]
+    tf_xywh = []
+    tf_prob = []
+    for i, (fm, output_size) in enumerate(zip(feature_maps, decoder.output_sizes)):
+        xywh, prob = decode_tf(
+            tf.constant(fm), output_size, configer.num_class, configer.strides, configer.anchors, i, configer.xyscale
+        )
+        tf_xywh.append(xywh.numpy())
+        tf_prob.append(prob.numpy())
+    np_xywh, np_prob = decoder.decode(feature_maps)
+    np.testing.assert_allclose(np_xywh, np.concatenate(tf_xywh, axis=1), rtol=1e-4, atol=1e-3)
+    np.testing.assert_allclose(np_prob, np.concatenate(tf_prob, axis=1), rtol=1e-4, atol=1e-6)
+    print('decode: ok')
+
+
+def random_predictions(rng, num_boxes, num_class, size=416):
+    xy = rng.uniform(0, size, size=(num_boxes, 2))
+    wh = rng.uniform(4, size / 3, size=(num_boxes, 2))
+    pred_xywh = np.concatenate((xy, wh), axis=-1).astype(np.float32)
+    pred_prob = (rng.uniform(size=(num_boxes, num_class)) ** 4).astype(np.float32)
+    return pred_xywh, pred_prob
+
+
+def check_nms(num_boxes=2000, num_class=4, score_threshold=0.25, iou_threshold=0.45, max_per_class=50, max_total=50):
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        pred_xywh, pred_prob = random_predictions(rng, num_boxes, num_class)
+        boxes, scores, class_ids = postprocess.filter_boxes(pred_xywh, pred_prob, score_threshold)
+        keep = postprocess.batched_nms(boxes, scores, class_ids, iou_threshold, max_per_class, max_total)
+
+        # the TF path works on [y1, x1, y2, x2]
+        yxyx = postprocess.xywh_to_xyxy(pred_xywh)[:, [1, 0, 3, 2]]
+        tf_boxes, tf_scores, tf_classes, valid = tf.image.combined_non_max_suppression(
+            boxes=tf.reshape(yxyx, (1, num_boxes, 1, 4)),
+            scores=pred_prob[np.newaxis],
+            max_output_size_per_class=max_per_class,
+            max_total_size=max_total,
+            iou_threshold=iou_threshold,
+            score_threshold=score_threshold,
+        )
+        valid = int(valid[0])
+        assert valid == len(keep), f'{valid} boxes from TF, {len(keep)} from NumPy'
+        np.testing.assert_allclose(scores[keep], tf_scores[0, :valid].numpy(), rtol=1e-6)
+        np.testing.assert_array_equal(class_ids[keep], tf_classes[0, :valid].numpy().astype(np.int64))
+        np.testing.assert_allclose(boxes[keep][:, [1, 0, 3, 2]], tf_boxes[0, :valid].numpy(), atol=1e-3)
+    print('batched nms: ok')
+
+
+def check_soft_nms(num_boxes=300, iou_threshold=0.45, sigma=0.5):
+    rng = np.random.default_rng(2)
+    pred_xywh, pred_prob = random_predictions(rng, num_boxes, 1)
+    boxes = postprocess.xywh_to_xyxy(pred_xywh)
+    scores = pred_prob[:, 0]
+    keep, keep_scores = postprocess.soft_nms(boxes, scores, iou_threshold, sigma=sigma, score_threshold=0.05)
+    tf_keep, tf_scores = tf.image.non_max_suppression_with_scores(
+        boxes[:, [1, 0, 3, 2]], scores, num_boxes, iou_threshold=1., score_threshold=0.05,
+        # TF soft-nms weight is exp(-0.5 * iou ^ 2 / sigma)
+        soft_nms_sigma=sigma / 2
+    )
+    np.testing.assert_array_equal(keep, tf_keep.numpy())
+    np.testing.assert_allclose(keep_scores, tf_scores.numpy(), rtol=1e-4)
+    print('soft nms: ok')
+
+
+def check_clip(size=416, width=1280, height=720):
+    # boxes past the left, top, right and bottom border of the model input
+    pred_xywh = np.array([
+        [10, 200, 60, 40],
+        [200, 5, 40, 60],
+        [400, 200, 60, 40],
+        [200, 410, 40, 60],
+    ], dtype=np.float32)
+    pred_prob = np.eye(4, dtype=np.float32)
+    boxes, scores = postprocess.postprocess(pred_xywh, pred_prob, size, width, height, 0.25, 0.45, 50, 50)
+    assert len(boxes) == 4, boxes
+    assert boxes[:, [0, 1]].min() >= 0, boxes
+    assert boxes[:, 2].max() <= width and boxes[:, 3].max() <= height, boxes
+    # the borders the boxes stick out of
+    assert boxes[boxes[:, 4] == 0, 0] == 0 and boxes[boxes[:, 4] == 1, 1] == 0
+    assert boxes[boxes[:, 4] == 2, 2] == width and boxes[boxes[:, 4] == 3, 3] == height
+    print('clip: ok')
+
+
+if __name__ == '__main__':
+    # python3 scripts/PostprocessTest.py configs/yolov4-416.json
+    if len(sys.argv) < 2:
+        print('usage: PostprocessTest.py CONFIG')
+        exit(1)
+    check_decode(YOLOConfiger(sys.argv[1]))
+    check_nms()
+    check_soft_nms()
+    check_clip()
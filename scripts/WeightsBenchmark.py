@@ -0,0 +1,88 @@
+import sys
+
+sys.path.append('.')
+import numpy as np
+import tensorflow as tf
+from time import perf_counter
+from nanoServer.Detector.core import utils
+from nanoServer.Detector.core.yolov4 import YOLO
+
+
+def legacy_load_weights(model, weights_file, model_name='yolov4', is_tiny=False):
+    """
+    utils.load_weights before the memory-mapped loader
+    """
+    layer_size, output_pos = utils.darknet_layer_size(model_name, is_tiny)
+    wf = open(weights_file, 'rb')
+    major, minor, revision, seen, _ = np.fromfile(wf, dtype=np.int32, count=5)
+
+    j = 0
+    for i in range(layer_size):
+        conv_layer_name = 'conv2d_%d' % i if i > 0 else 'conv2d'
+        bn_layer_name = 'batch_normalization_%d' % j if j > 0 else 'batch_normalization'
+
+        conv_layer = model.get_layer(conv_layer_name)
+        filters = conv_layer.filters
+        k_size = conv_layer.kernel_size[0]
+        in_dim = conv_layer.input_shape[-1]
+
+        if i not in output_pos:
+            bn_weights = np.fromfile(wf, dtype=np.float32, count=4 * filters)
+            bn_weights = bn_weights.reshape((4, filters))[[1, 0, 2, 3]]
+            bn_layer = model.get_layer(bn_layer_name)
+            j += 1
+        else:
+            conv_bias = np.fromfile(wf, dtype=np.float32, count=filters)
+
+        conv_shape = (filters, in_dim, k_size, k_size)
+        conv_weights = np.fromfile(wf, dtype=np.float32, count=np.prod(conv_shape))
+        conv_weights = conv_weights.reshape(conv_shape).transpose([2, 3, 1, 0])
+
+        if i not in output_pos:
+            conv_layer.set_weights([conv_weights])
+            bn_layer.set_weights(bn_weights)
+        else:
+            conv_layer.set_weights([conv_weights, conv_bias])
+    wf.close()
+
+
+def build(model_name, is_tiny, num_class=80, size=416):
+    # the legacy loader needs layer names starting from conv2d
+    tf.keras.backend.clear_session()
+    input_layer = tf.keras.layers.Input([size, size, 3])
+    return tf.keras.Model(input_layer, YOLO(input_layer, num_class, model_name, is_tiny))
+
+
+def timed(func, *args, **kwargs):
+    s = perf_counter()
+    func(*args, **kwargs)
+    return perf_counter() - s
+
+
+if __name__ == '__main__':
+    # python3 scripts/WeightsBenchmark.py yolov4.weights yolov4-tiny.weights
+    # the file name decides the model, the cache goes to a temporary folder
+    if len(sys.argv) < 2:
+        print('usage: WeightsBenchmark.py WEIGHTS [WEIGHTS ...]')
+        exit(1)
+    from tempfile import TemporaryDirectory
+
+    print('%-24s %12s %12s %12s' % ('weights', 'legacy(s)', 'convert(s)', 'cached(s)'))
+    for weights_file in sys.argv[1:]:
+        is_tiny = 'tiny' in weights_file
+        model_name = 'yolov3' if 'yolov3' in weights_file else 'yolov4'
+        with TemporaryDirectory() as cache_dir:
+            model = build(model_name, is_tiny)
+            legacy_time = timed(legacy_load_weights, model, weights_file, model_name, is_tiny)
+            legacy_weights = model.get_weights()
+
+            model = build(model_name, is_tiny)
+            convert_time = timed(utils.load_weights, model, weights_file, model_name, is_tiny, cache_dir)
+            for a, b in zip(legacy_weights, model.get_weights()):
+                np.testing.assert_array_equal(a, b)
+
+            model = build(model_name, is_tiny)
+            cached_time = timed(utils.load_weights, model, weights_file, model_name, is_tiny, cache_dir)
+            for a, b in zip(legacy_weights, model.get_weights()):
+                np.testing.assert_array_equal(a, b)
+        print('%-24s %12.3f %12.3f %12.3f' % (weights_file, legacy_time, convert_time, cached_time))
@@ -21,7 +21,10 @@ if __name__ == '__main__':
         'frequency': 0.25,
         'min_angle': 45,
         'max_angle': 135,
-        'is_pwm_listen': False
+        'is_pwm_listen': False,
+        'is_hardware_pwm': True,
+        'spin_time': 0.0005,
+        'switch_interval': 0
     }
 
     config['Streamer'] = {
@@ -36,7 +39,37 @@ if __name__ == '__main__':
         'is_local_detector': True,
         'detect_server_ip': '192.168.0.1',
         'detect_server_port': 0,
-        'timeout': 10
+        'timeout': 10,
+        'remote_image_encoding': 'JPEG',
+        'remote_jpeg_quality': 90,
+        'remote_deadline': 1,
+        'remote_failure_threshold': 3,
+        'remote_retry_interval': 5,
+        'remote_fallback_config': '',
+        'cache_size': 16,
+        'cache_ttl': 1,
+        'cache_distance': 4,
+        'track': False,
+        'track_iou_threshold': 0.3
+    }
+    # empty cpu lists keep the default affinity, 0 threads keeps the library default
+    config['Performance'] = {
+        'detector_threads': 0,
+        'tf_inter_op_threads': 0,
+        'camera_cpus': '',
+        'detector_cpus': '',
+        'network_cpus': '',
+        'pwm_cpus': ''
+    }
+    # Prometheus text file, empty disables it, GET_METRICS works either way
+    config['Metrics'] = {
+        'path': '',
+        'interval': 10
+    }
+    # JSON lines of every inbound message for benchmarks/LoadReplay.py, empty disables it
+    config['Recorder'] = {
+        'path': '',
+        'is_record_payload': False
     }
     with open('./sys.ini', 'w') as f:
         config.write(f)